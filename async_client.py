@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+#
+# The same sliding-window client as better_client.py, but driven by an asyncio
+# event loop instead of a blocking recvfrom() loop.
+#
+# better_client.py alternates between sending and waiting for ACKs, so while
+# it is busy pushing out a window of packets, ACKs pile up unread, and while
+# it's waiting for ACKs, nothing new gets sent. Here, ACKs are handled as soon
+# as the loop sees them arrive, and new packets are sent in small bursts of
+# burstSize, giving the loop a chance to deliver waiting ACKs between bursts.
+# The retransmission timer is a loop timer set for the moment the oldest
+# packet in flight expires, or the pacer lets the next packet go, instead of a
+# socket timeout.
+#
+# All the protocol logic (window, RTO, congestion control, send buffer) is the
+# Transfer class from better_client.py, and the packets are exactly the same,
+# so this client works with either server. The handshake before the transfer,
+# and the FIN after it, are better_client.py's too, and so are its settings
+# for them (use_handshake, resumefile): they happen on the same socket, before
+# and after the event loop runs, so an interrupted transfer resumes just the
+# same.
+#
+# Run the program like this:
+#   python3 async_client.py 1.2.3.4 6000 [reno|cubic]
+# This will send data to a UDP server at IP address 1.2.3.4 port 6000. The
+# optional third argument picks the congestion controller.
+
+import asyncio
+import socket
+import sys
+import better_client
+import datasource
+import trace
+
+# most new packets to send before letting the loop look for ACKs
+burstSize = 32
+
+class ClientProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, finished, addr, hello):
+        self.finished = finished    # future, set when every packet is ACKed
+        self.addr = addr            # the server's address
+        self.hello = hello          # the server's answer to our handshake, or None
+        self.transport = None
+        self.loop = None
+        self.xfer = None
+        self.timer = None
+        self.timerDeadline = None
+        self.pumping = False        # a call to pump() is scheduled
+        self.paused = False         # the transport's buffer is full
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.xfer = better_client.Transfer(lambda packet: transport.sendto(packet, self.addr),
+                hello=self.hello)
+        print("Beginning transmission using %s congestion control..." % (self.xfer.cc.name))
+        self.schedule_pump()
+
+    def datagram_received(self, msg, addr):
+        t = better_client.ackStage.start()
+        newlyAcked = self.xfer.process_ack(msg, better_client.now())
+        better_client.ackStage.stop(t)
+        if newlyAcked > 0:
+            self.xfer.fast_retransmit()
+            self.schedule_pump()
+
+    def error_received(self, exc):
+        if better_client.verbose >= 1:
+            print("Socket error: %s" % (exc))
+
+    def connection_lost(self, exc):
+        if not self.finished.done():
+            self.finished.set_result(False)
+
+    # The transport calls these when its send buffer fills up and drains.
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.schedule_pump()
+
+    def schedule_pump(self):
+        if not self.pumping:
+            self.pumping = True
+            self.loop.call_soon(self.pump)
+
+    # Send a burst of new packets, and come back for more if the window still
+    # has room.
+    def pump(self):
+        self.pumping = False
+        if self.xfer.done():
+            self.finish()
+            return
+        if not self.paused and self.xfer.fill(burstSize) == burstSize:
+            self.schedule_pump()
+        self.arm_timer()
+
+    # Make sure the timer goes off when the oldest packet in flight expires,
+    # or when the pacer is ready for the next packet.
+    def arm_timer(self):
+        deadline = self.xfer.deadline()
+        if deadline is None:
+            return # nothing in flight, or waiting to be sent
+        if self.timer is not None:
+            if self.timerDeadline <= deadline:
+                return # an earlier timer will re-arm itself
+            self.timer.cancel()
+        self.timerDeadline = deadline
+        self.timer = self.loop.call_later(max(deadline - better_client.now(), 0), self.timeout)
+
+    def timeout(self):
+        self.timer = None
+        if self.xfer.done():
+            self.finish()
+            return
+        self.xfer.retransmit_expired()
+        self.schedule_pump()
+
+    def finish(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.finished.done():
+            self.finished.set_result(True)
+
+
+# Send everything over socket s to addr. The transport closes the socket it is
+# given when it's done, so it gets a copy, and s is still open for the FIN.
+async def send_all(s, addr, hello):
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+    (transport, protocol) = await loop.create_datagram_endpoint(
+            lambda: ClientProtocol(finished, addr, hello), sock=s.dup())
+    try:
+        await finished
+    finally:
+        transport.close()
+    return protocol.xfer
+
+
+def main(host, port):
+    print("Sending UDP packets to %s:%d" % (host, port))
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datasource.install_signal_handler()
+    better_client.init_trace()
+
+    addr = (host, port)
+    hello = better_client.open_transfer(s, addr)
+    xfer = asyncio.run(send_all(s, addr, hello))
+    if hello is not None and xfer.done():
+        better_client.finish(s, addr, hello)
+
+    xfer.showStats()
+    trace.close()
+    return xfer
+
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 2:
+        print("To send data to the server at 1.2.3.4 port 6000, try running:")
+        print("   python3 %s 1.2.3.4 6000" % (sys.argv[0]))
+        sys.exit(0)
+    host = sys.argv[1]
+    port = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        better_client.algorithm = sys.argv[3]
+    main(host, port)
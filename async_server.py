@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+#
+# The same server as server.py, but driven by an asyncio event loop instead of
+# a blocking recvfrom() loop.
+#
+# Each arriving packet is handled by exactly the same code as in server.py
+# (server.handle_packet), so the wire format, the ACKs and the logging are all
+# identical, and any of the clients can talk to it. What changes is the
+# timing: instead of shortening the socket timeout whenever a delayed ACK is
+# owed, a loop timer fires ackDelay seconds after the first unACKed packet, and
+# another timer drops idle flows once a second. Nothing waits on the socket,
+# so other asyncio code can share the loop.
+#
+# Run the program like this:
+#   python3 async_server.py 1.2.3.4 6000
+# This will listen for data on UDP 1.2.3.4:6000. The IP address should be the IP
+# for our own host.
+
+import asyncio
+import sys
+import time
+import datasink
+import server
+
+class ServerProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self):
+        self.transport = None
+        self.loop = None
+        self.pending = {}       # flows owed a delayed ACK
+        self.ackTimer = None
+        self.start = time.time()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.evict()
+
+    def datagram_received(self, packet, client_addr):
+        tRecv = time.time()
+        tStart = time.perf_counter()
+        server.handle_packet_safely(self.transport, packet, client_addr, tRecv, self.start, self.pending)
+        datasink.loopLatency.observe(time.perf_counter() - tStart)
+        datasink.batchSizes.observe(1)
+        if self.pending and self.ackTimer is None:
+            self.ackTimer = self.loop.call_later(server.ackDelay, self.send_due_acks)
+
+    # Timer: send any delayed ACKs whose time is up, and wait for the rest.
+    def send_due_acks(self):
+        self.ackTimer = None
+        tNow = time.time()
+        server.send_due_acks(self.transport, self.pending, tNow)
+        if self.pending:
+            deadline = min(flow.ackDeadline for flow in self.pending)
+            self.ackTimer = self.loop.call_later(max(deadline - tNow, 0), self.send_due_acks)
+
+    # Timer: drop idle flows, once a second.
+    def evict(self):
+        datasink.evict_idle(time.time())
+        self.loop.call_later(1.0, self.evict)
+
+    def error_received(self, exc):
+        if server.verbose >= 1:
+            print("Socket error: %s" % (exc))
+
+
+async def serve(host, port):
+    loop = asyncio.get_running_loop()
+    (transport, protocol) = await loop.create_datagram_endpoint(
+            ServerProtocol, local_addr=("0.0.0.0", port))
+    try:
+        await asyncio.Future() # run forever
+    finally:
+        transport.close()
+
+
+def main(host, port):
+    print("Listening for UDP packets at %s:%d" % (host, port))
+    server.init_trace(server.tracefile)
+    datasink.init(host)
+    asyncio.run(serve(host, port))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 2:
+        print("To listen for data on IP address 1.2.3.4 UDP port 6000, try running:")
+        print("   python3 async_server.py 1.2.3.4 6000")
+        sys.exit(0)
+    host = sys.argv[1]
+    port = int(sys.argv[2])
+    main(host, port)
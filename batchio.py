@@ -0,0 +1,254 @@
+# Batched UDP receive and send, so the server doesn't pay for one system call
+# per packet.
+#
+# BatchReceiver waits (using the socket's timeout) for the first packet, then
+# grabs up to batchSize - 1 more that are already waiting, all at once. Packets
+# are received straight into a preallocated pool of buffers, and handed back as
+# (memoryview, addr) pairs, so nothing is allocated or copied per packet. The
+# views point into the pool, which is reused by the next call to recv(), so
+# callers must copy anything they want to keep.
+#
+# BatchSender has the same sendto(data, addr) method as a socket, but just
+# copies the data into its own pool. flush() then sends everything queued up.
+#
+# On Linux, the batches are moved with a single recvmmsg() or sendmmsg() system
+# call, made through ctypes. Anywhere those aren't available, we fall back to a
+# loop of non-blocking recvfrom_into() and sendto() calls, which still saves
+# the time spent waiting between packets, just not the system calls.
+
+import ctypes
+import ctypes.util
+import socket
+import struct
+import sys
+
+# largest ACK (or other packet) the sender will queue; anything bigger is just
+# sent on its own
+maxSendSize = 512
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.c_void_p),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+sockaddrSize = 128 # sizeof(struct sockaddr_storage)
+
+# Find recvmmsg() and sendmmsg() in the C library, if they're there. Other
+# systems lay out struct sockaddr differently, so only try on Linux.
+recvmmsg = None
+sendmmsg = None
+try:
+    if not sys.platform.startswith("linux"):
+        raise OSError("not Linux")
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    recvmmsg = libc.recvmmsg
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg = libc.sendmmsg
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    recvmmsg = sendmmsg = None
+
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0x40)
+EAGAIN = (11, 35) # Linux, BSD/macOS
+
+# Turn a raw struct sockaddr into the same address tuple recvfrom() gives.
+def decode_sockaddr(raw):
+    family = struct.unpack_from("=H", raw, 0)[0]
+    if family == socket.AF_INET:
+        port = struct.unpack_from(">H", raw, 2)[0]
+        return (socket.inet_ntop(socket.AF_INET, raw[4:8]), port)
+    if family == socket.AF_INET6:
+        (port, flowinfo) = struct.unpack_from(">HI", raw, 2)
+        scope = struct.unpack_from("=I", raw, 24)[0]
+        return (socket.inet_ntop(socket.AF_INET6, raw[8:24]), port, flowinfo, scope)
+    return None
+
+# The reverse: a raw struct sockaddr for an address tuple, or None if it
+# isn't a numeric IPv4 or IPv6 address.
+def encode_sockaddr(addr):
+    try:
+        if len(addr) == 2:
+            return (struct.pack("=H", socket.AF_INET) + struct.pack(">H", addr[1]) +
+                    socket.inet_pton(socket.AF_INET, addr[0]) + bytes(8))
+        (host, port, flowinfo, scope) = addr
+        return (struct.pack("=H", socket.AF_INET6) + struct.pack(">HI", port, flowinfo) +
+                socket.inet_pton(socket.AF_INET6, host) + struct.pack("=I", scope))
+    except (OSError, ValueError, TypeError):
+        return None
+
+class BatchReceiver:
+
+    def __init__(self, sock, batchSize=64, bufSize=4000):
+        self.sock = sock
+        self.batchSize = batchSize
+        self.bufSize = bufSize
+        self.pool = bytearray(batchSize * bufSize)
+        self.view = memoryview(self.pool)
+        self.addrCache = {}     # raw sockaddr -> address tuple
+        self.numBatches = 0
+        self.numPackets = 0
+        self.msgs = None
+        if recvmmsg is not None and batchSize > 1:
+            self.setup_mmsg()
+
+    # Build the recvmmsg() arguments once: message i receives into buffer i of
+    # the pool, and its address into slot i of names.
+    def setup_mmsg(self):
+        n = self.batchSize
+        base = ctypes.addressof(ctypes.c_char.from_buffer(self.pool))
+        self.names = ctypes.create_string_buffer(n * sockaddrSize)
+        namesBase = ctypes.addressof(self.names)
+        self.iovs = (iovec * n)()
+        self.msgs = (mmsghdr * n)()
+        for i in range(n):
+            self.iovs[i].iov_base = base + i * self.bufSize
+            self.iovs[i].iov_len = self.bufSize
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = namesBase + i * sockaddrSize
+            hdr.msg_iov = ctypes.addressof(self.iovs[i])
+            hdr.msg_iovlen = 1
+        self.namesView = memoryview(self.names).cast("B")
+
+    # Wait for at least one packet, and return a list of (packet, addr) pairs.
+    # Raises socket.timeout if nothing arrives before the socket's timeout.
+    def recv(self):
+        (n, addr) = self.sock.recvfrom_into(self.view[0:self.bufSize])
+        batch = [(self.view[0:n], addr)]
+        if self.batchSize > 1:
+            if self.msgs is not None:
+                self.recv_mmsg(batch)
+            else:
+                self.recv_loop(batch)
+        self.numBatches = self.numBatches + 1
+        self.numPackets = self.numPackets + len(batch)
+        return batch
+
+    def recv_mmsg(self, batch):
+        n = self.batchSize - 1
+        for i in range(1, self.batchSize):
+            self.msgs[i].msg_hdr.msg_namelen = sockaddrSize
+        got = recvmmsg(self.sock.fileno(), ctypes.byref(self.msgs, ctypes.sizeof(mmsghdr)), n, MSG_DONTWAIT, None)
+        if got < 0:
+            err = ctypes.get_errno()
+            if err in EAGAIN:
+                return
+            raise OSError(err, "recvmmsg failed")
+        for i in range(1, 1 + got):
+            msg = self.msgs[i]
+            raw = bytes(self.namesView[i * sockaddrSize:i * sockaddrSize + msg.msg_hdr.msg_namelen])
+            addr = self.addrCache.get(raw)
+            if addr is None:
+                addr = self.addrCache[raw] = decode_sockaddr(raw)
+            off = i * self.bufSize
+            batch.append((self.view[off:off + msg.msg_len], addr))
+
+    def recv_loop(self, batch):
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            for i in range(1, self.batchSize):
+                off = i * self.bufSize
+                (n, addr) = self.sock.recvfrom_into(self.view[off:off + self.bufSize])
+                batch.append((self.view[off:off + n], addr))
+        except BlockingIOError:
+            pass
+        finally:
+            self.sock.settimeout(timeout)
+
+class BatchSender:
+
+    def __init__(self, sock, batchSize=64):
+        self.sock = sock
+        self.batchSize = batchSize
+        self.pool = bytearray(batchSize * maxSendSize)
+        self.count = 0
+        self.lens = [0] * batchSize
+        self.addrs = [None] * batchSize
+        self.nameCache = {}     # address tuple -> raw sockaddr
+        self.numBatches = 0
+        self.numPackets = 0
+        self.msgs = None
+        if sendmmsg is not None and batchSize > 1:
+            self.setup_mmsg()
+
+    def setup_mmsg(self):
+        n = self.batchSize
+        base = ctypes.addressof(ctypes.c_char.from_buffer(self.pool))
+        self.names = ctypes.create_string_buffer(n * sockaddrSize)
+        namesBase = ctypes.addressof(self.names)
+        self.iovs = (iovec * n)()
+        self.msgs = (mmsghdr * n)()
+        for i in range(n):
+            self.iovs[i].iov_base = base + i * maxSendSize
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = namesBase + i * sockaddrSize
+            hdr.msg_iov = ctypes.addressof(self.iovs[i])
+            hdr.msg_iovlen = 1
+
+    # Queue data to be sent to addr by the next flush().
+    def sendto(self, data, addr):
+        n = len(data)
+        if n > maxSendSize:
+            self.sock.sendto(data, addr)
+            return
+        i = self.count
+        off = i * maxSendSize
+        self.pool[off:off + n] = data
+        self.lens[i] = n
+        self.addrs[i] = addr
+        self.count = i + 1
+        if self.count == self.batchSize:
+            self.flush()
+
+    # Send everything that's queued.
+    def flush(self):
+        count = self.count
+        if count == 0:
+            return
+        self.count = 0
+        self.numBatches = self.numBatches + 1
+        self.numPackets = self.numPackets + count
+        sent = 0
+        if self.msgs is not None:
+            sent = self.send_mmsg(count)
+        view = memoryview(self.pool)
+        for i in range(sent, count):
+            off = i * maxSendSize
+            self.sock.sendto(view[off:off + self.lens[i]], self.addrs[i])
+
+    # Send as many of the queued packets as sendmmsg() will take, and return
+    # how many that was. Whatever is left is sent the ordinary way.
+    def send_mmsg(self, count):
+        for i in range(count):
+            addr = self.addrs[i]
+            raw = self.nameCache.get(addr)
+            if raw is None:
+                raw = encode_sockaddr(addr)
+                if raw is None:
+                    return 0
+                self.nameCache[addr] = raw
+            ctypes.memmove(self.msgs[i].msg_hdr.msg_name, raw, len(raw))
+            self.msgs[i].msg_hdr.msg_namelen = len(raw)
+            self.iovs[i].iov_len = self.lens[i]
+        sent = 0
+        while sent < count:
+            n = sendmmsg(self.sock.fileno(), ctypes.byref(self.msgs, sent * ctypes.sizeof(mmsghdr)),
+                    count - sent, MSG_DONTWAIT)
+            if n <= 0:
+                break # socket buffer full, or an error: let sendto() sort it out
+            sent = sent + n
+        return sent
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+#
+# Benchmarks: runs each client against the server over loopback, optionally
+# through the network emulator (see netem.py), and measures how well it did.
+#
+# Every run is three or four processes, forked from this one: the server, the
+# emulator (unless the profile is "clean"), and the client. They all use
+# synthetic data (see datasource.py), so nothing under /var/streaming is
+# needed, and send numPackets packets. For each run we report:
+#    seconds        time from the client starting until it finished
+#    goodputMBps    unique payload bytes the server got, per second
+#    retransmitRatio  retransmissions per packet
+#    duplicates, misordered, missing, undelivered
+#                   from datasink; missing is the holes below the highest
+#                   seqno received, undelivered is every packet that never
+#                   arrived at all
+#    latency50, latency90, latency99, latencyMax
+#                   seconds from a packet's first transmission until the
+#                   server delivered it in order
+# A run that doesn't finish within runTimeout seconds (the stop-and-wait
+# client deadlocks on the first lost packet, for one) is reported with
+# "timedOut": true.
+#
+# The results go to resultsFile as JSON, one object per run. Given a baseline
+# file of earlier results, the benchmark fails (exit status 1) if any run
+# that finished in the baseline now times out, is missing data, or has lost
+# more than tolerance of its goodput, so it can be used as a regression gate:
+#   python3 bench.py [client ...] [--profile name ...] [--baseline file]
+
+import json
+import mmap
+import os
+import signal
+import struct
+import sys
+import time
+import datasink
+import datasource
+import netem
+import server
+import sharedstats
+
+# how many packets each run sends
+numPackets = 3600
+
+# seconds to wait for a client before giving up on it
+runTimeout = 30.0
+
+resultsFile = "bench_results.json"
+
+# a run has regressed if its goodput is this much lower than the baseline's
+tolerance = 0.2
+
+serverPort = 6500
+proxyPort = 6501
+
+clients = ["test_client", "better_client", "async_client"]
+
+# netem settings for each impairment profile
+profiles = {
+    "clean": None,
+    "lossy": {"loss": 0.02, "delay": 0.005, "jitter": 0.001},
+    "reorder": {"delay": 0.005, "jitter": 0.002, "reorder": 0.05, "duplicate": 0.01},
+    "slow": {"delay": 0.02, "jitter": 0.002, "bandwidth": 2e6, "queueLimit": 0.05},
+}
+
+# Shared between the processes of a run: the time each seqno was first sent,
+# and the time the server delivered it, as doubles.
+timeFormat = struct.Struct("d")
+
+def fork(fn, *args):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            quiet()
+            fn(*args)
+        finally:
+            os._exit(1)
+    return pid
+
+# Keep the child's own messages out of the results.
+def quiet():
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+def run_server(stats, deliverTimes):
+    server.verbose = 0
+    server.tracefile = None
+    datasink.verbose = 0
+    datasink.checkpointDir = None
+
+    def delivered(flow, seqno, payload):
+        if seqno < numPackets:
+            timeFormat.pack_into(deliverTimes, seqno * timeFormat.size, time.time())
+    datasink.onDeliver = delivered
+
+    def stop(signum, frame):
+        stats.publish(0, datasink.totals())
+        os._exit(0)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop)
+    s = server.open_socket(serverPort)
+    server.serve(s, stats, 0)
+
+def run_proxy(settings):
+    netem.verbose = 0
+    for (name, value) in settings.items():
+        setattr(netem, name, value)
+    signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(0))
+    netem.run(proxyPort, ("127.0.0.1", serverPort))
+
+def run_client(name, port, sendTimes, results):
+    datasource.synthetic = True
+    datasource.numPackets = numPackets
+    source = datasource.wait_for_data
+
+    # Packets are built just before they are first sent, and kept for
+    # retransmission, so the first time a seqno is asked for is when it goes out.
+    def timed_source(seqno):
+        off = seqno * timeFormat.size
+        if seqno < numPackets and timeFormat.unpack_from(sendTimes, off)[0] == 0.0:
+            timeFormat.pack_into(sendTimes, off, time.time())
+        return source(seqno)
+    datasource.wait_for_data = timed_source
+
+    module = __import__(name)
+    module.verbose = 0
+    module.tracefile = None
+    if name == "better_client":
+        module.resumefile = None
+    if name == "async_client":
+        module.better_client.verbose = 0
+        module.better_client.tracefile = None
+    tStart = time.time()
+    xfer = module.main("127.0.0.1", port)
+    elapsed = time.time() - tStart
+    retransmits = xfer.window.numRetransmits if xfer is not None else 0
+    os.write(results, json.dumps({"seconds": elapsed, "retransmits": retransmits}).encode())
+    os._exit(0)
+
+# Wait up to timeout seconds for process pid to exit. Returns True if it did.
+def wait_for(pid, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        (done, status) = os.waitpid(pid, os.WNOHANG)
+        if done != 0:
+            return True
+        time.sleep(0.05)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    return False
+
+def stop(pid):
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+
+def percentile(sorted, p):
+    if not sorted:
+        return None
+    return sorted[min(len(sorted) - 1, int(p * len(sorted)))]
+
+# Run one client under one profile, and return its results as a dict.
+def run(client, profile):
+    settings = profiles[profile]
+    stats = sharedstats.SharedStats(1)
+    sendTimes = mmap.mmap(-1, numPackets * timeFormat.size)
+    deliverTimes = mmap.mmap(-1, numPackets * timeFormat.size)
+    (readEnd, writeEnd) = os.pipe()
+
+    serverPid = fork(run_server, stats, deliverTimes)
+    proxyPid = None
+    port = serverPort
+    if settings is not None:
+        proxyPid = fork(run_proxy, settings)
+        port = proxyPort
+    time.sleep(0.5) # let them open their sockets
+
+    clientPid = fork(run_client, client, port, sendTimes, writeEnd)
+    os.close(writeEnd)
+    finished = wait_for(clientPid, runTimeout)
+    time.sleep(0.2) # let the last few packets arrive
+    if proxyPid is not None:
+        stop(proxyPid)
+    stop(serverPid)
+    output = b""
+    while True:
+        chunk = os.read(readEnd, 4096)
+        if not chunk:
+            break
+        output = output + chunk
+    os.close(readEnd)
+
+    totals = stats.read(0)
+    result = {"client": client, "profile": profile, "packets": numPackets,
+              "timedOut": not finished or not output}
+    if output:
+        result.update(json.loads(output))
+    else:
+        result.update({"seconds": None, "retransmits": None})
+    latencies = []
+    for seqno in range(numPackets):
+        tSent = timeFormat.unpack_from(sendTimes, seqno * timeFormat.size)[0]
+        tDelivered = timeFormat.unpack_from(deliverTimes, seqno * timeFormat.size)[0]
+        if tSent > 0 and tDelivered > 0:
+            latencies.append(tDelivered - tSent)
+    latencies.sort()
+    seconds = result["seconds"]
+    result.update({
+        "goodputMBps": totals["uniquePackets"] * datasource.packetSize / seconds / 1e6 if seconds else None,
+        "retransmitRatio": result["retransmits"] / numPackets if result["retransmits"] is not None else None,
+        "uniquePackets": totals["uniquePackets"],
+        "duplicates": totals["duplicatePackets"],
+        "misordered": totals["misorderedPackets"],
+        "missing": totals["missingPackets"],
+        "undelivered": numPackets - totals["uniquePackets"],
+        "latency50": percentile(latencies, 0.5),
+        "latency90": percentile(latencies, 0.9),
+        "latency99": percentile(latencies, 0.99),
+        "latencyMax": latencies[-1] if latencies else None,
+    })
+    sendTimes.close()
+    deliverTimes.close()
+    return result
+
+# Returns a list of reasons why results are worse than baseline.
+def regressions(results, baseline):
+    before = {(r["client"], r["profile"]): r for r in baseline}
+    problems = []
+    for r in results:
+        old = before.get((r["client"], r["profile"]))
+        if old is None or old["timedOut"]:
+            continue
+        name = "%s/%s" % (r["client"], r["profile"])
+        if r["timedOut"]:
+            problems.append("%s timed out" % (name))
+        elif r["undelivered"] > old["undelivered"]:
+            problems.append("%s left %d packets undelivered" % (name, r["undelivered"]))
+        elif r["goodputMBps"] < (1 - tolerance) * old["goodputMBps"]:
+            problems.append("%s goodput fell from %0.2f to %0.2f MBps" % (name, old["goodputMBps"], r["goodputMBps"]))
+    return problems
+
+def show(r):
+    def fmt(x, f):
+        return "-" if x is None else f % (x)
+    print("%-14s %-8s %8s s %8s MBps  retx %6s  dup %4d  missing %4d  undelivered %5d  latency p50 %s p99 %s%s" %
+            (r["client"], r["profile"], fmt(r["seconds"], "%0.3f"), fmt(r["goodputMBps"], "%0.2f"),
+             fmt(r["retransmitRatio"], "%0.3f"), r["duplicates"], r["missing"], r["undelivered"],
+             fmt(r["latency50"], "%0.4f"), fmt(r["latency99"], "%0.4f"),
+             "  (timed out)" if r["timedOut"] else ""))
+    sys.stdout.flush()
+
+def main(names, profileNames, baselineFile):
+    results = []
+    for profile in profileNames:
+        for client in names:
+            r = run(client, profile)
+            results.append(r)
+            show(r)
+    with open(resultsFile, "w") as f:
+        json.dump(results, f, indent=1)
+    print("Results written to %s" % (resultsFile))
+    if baselineFile is not None:
+        with open(baselineFile) as f:
+            problems = regressions(results, json.load(f))
+        for problem in problems:
+            print("Regression: %s" % (problem))
+        if problems:
+            sys.exit(1)
+        print("No regressions against %s" % (baselineFile))
+
+if __name__ == "__main__":
+    names = []
+    profileNames = []
+    baselineFile = None
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "--profile":
+            profileNames.append(args.pop(0))
+        elif arg == "--baseline":
+            baselineFile = args.pop(0)
+        elif arg in clients:
+            names.append(arg)
+        else:
+            print("Oops, unknown client or option %s" % (arg))
+            print("To benchmark better_client.py over a lossy link, against earlier results, try running:")
+            print("   python3 %s better_client --profile lossy --baseline %s" % (sys.argv[0], resultsFile))
+            sys.exit(1)
+    for name in profileNames:
+        if name not in profiles:
+            print("Oops, unknown profile %s (try one of %s)" % (name, ", ".join(profiles)))
+            sys.exit(1)
+    main(names or clients, profileNames or ["clean"], baselineFile)
@@ -3,37 +3,93 @@
 # Author: J. McDonald & A. Furnari
 # Date: 04 December 2020
 #
-# Stop-and-wait client for a simple TCP-like semi-reliable protocol on top of UDP.
+# Sliding-window client for a simple TCP-like semi-reliable protocol on top of UDP.
 #
-# What it does: This implements the stop-and-wait protocol, mostly. It sends one UDP packet,
-# waits for an ACK, sends one more, waits for an ACK, etc. A sequence number is
-# included in each packet, so the server can detect duplicates, detect missing
-# packets, and sort any mis-ordered packets back into the correct order. A
-# "magic" integer (0xBAADCAFE) is also included with each packet, for no reason
-# at all (you can replace it with something else, or remove it entirely).
+# What it does: This keeps a window of packets in flight at once. Each time an
+# ACK comes back, the window slides forward and more new packets are sent, so
+# the path stays full instead of idling for one round trip per packet. The
+# size of the window is set by a congestion controller (see congestion.py),
+# which grows it while ACKs keep coming and shrinks it when packets are lost.
 #
-# What it doesn't do: There are no NACKs or timeouts, so if any packet is lost,
-# the protocol will deadlock. The ACK numbers are also completely ignored, so if
-# there packets get duplicated in the network, things will probably go haywire.
+# The time each packet was sent is recorded, and any packet that has gone
+# unACKed for longer than the retransmission timeout (RTO) is retransmitted on
+# its own. Packets that have already been ACKed are never resent. The RTO
+# adapts to the measured round trip time, and backs off exponentially while
+# packets keep getting lost (see rto.py). If a packet three or more seqnos
+# above some packet is ACKed, along with something sent after it, but that
+# packet isn't, it is retransmitted right away (fast retransmit). If that
+# turns out to have been a mistake, because the packet had only been overtaken,
+# the congestion window is put back, and it takes more packets overtaking one
+# before it's resent (see window.py).
+#
+# We ask the server for cumulative ACKs with selective-ACK ranges, which name
+# every hole in what it has received, so every lost packet in a window can be
+# retransmitted at once. Setting use_sack = False goes back to one plain ACK
+# per packet.
+#
+# A sequence number is included in each packet, so the server can detect
+# duplicates, detect missing packets, and sort any mis-ordered packets back
+# into the correct order. A "magic" integer is also included with each packet,
+# holding the packet type and a session id (see protocol.py), so the server
+# can tell our packets apart from other clients' packets.
+#
+# Setting payload_encoding compresses each row before sending it (see
+# rowcodec.py), which cuts the bytes on the wire several times over.
+#
+# Setting fec_group sends parity packets along with the data (see fec.py), so
+# the server can rebuild most lost packets without waiting for them to be
+# resent.
+#
+# New packets are paced: spread out at about one window per round trip,
+# instead of going out in a burst that overflows the buffers along the way
+# (see pacer.py). Setting use_pacing = False turns that off. The client's
+# timestamps all come from time.perf_counter_ns() (see now()), a monotonic
+# clock fine enough to time packets microseconds apart.
+#
+# The client opens the transfer with a handshake (see protocol.py): the server
+# hands out the session id, and agrees to a window and which of the options
+# above to use. It also says what it already has of the transfer, so a client
+# that was interrupted, and is run again, only sends the packets the server is
+# missing; the transfer's id is kept in resumefile until then. Once everything
+# has been ACKed, a FIN tells the server the transfer is finished. Setting
+# use_handshake = False just starts sending, as the original clients did.
+#
+# A Transfer can also send just one shard of the data, for parallel_client.py,
+# which runs several of them at once (see shards.py).
+#
+# Running with PROFILE=stages times building packets, sending them and
+# handling ACKs (see profiling.py).
+#
+# ACKs may arrive in any order, or more than once. ACKs for seqnos that are not
+# in flight are ignored. See window.py
+# for the bookkeeping.
 #
 # Run the program like this:
-#   python3 client_saw.py 1.2.3.4 6000
-# This will send data to a UDP server at IP address 1.2.3.4 port 6000.
+#   python3 better_client.py 1.2.3.4 6000 [reno|cubic]
+# This will send data to a UDP server at IP address 1.2.3.4 port 6000. The
+# optional third argument picks the congestion controller.
 
 # Collaboration Log: no collaboration other than with Alexa and Jacob
 
-# Changes to make (for a better protocol):
-#       Cope with packet loss, e.g. by having timeouts and retransmitting packets as needed.
-#       Cope with packet duplication and mis-ordering, e.g. by using the sequence numbers in ACKs.
-#       Use a sliding window for speed, so that multiple packets can be in flight simultaneously.
-#       Avoid excessive retransmissions.
-
+import os
+import random
 import socket
 import sys
 import time
 import struct
 import datasource
 import trace
+from window import SendWindow
+from sendbuffer import SendBuffer
+from rto import RTOEstimator
+from fec import FecEncoder
+from pacer import Pacer
+import rowcodec
+from rowcodec import RowEncoder
+import congestion
+import profiling
+import protocol
+import shards
 
 # setting verbose = 0 turns off most printing
 # setting verbose = 1 turns on a little bit of printing
@@ -42,98 +98,451 @@ import trace
 verbose = 2
 
 # setting tracefile = None disables writing a trace file for the client
+# a name ending in .bin writes a faster, binary trace instead (see trace.py)
 # tracefile = None
 tracefile = "client_saw_packets.csv"
 
-magic = 0xBAADCAFE
+# session id to put in every packet, unless the server hands one out in the
+# handshake; use different ones to run several clients from the same host at
+# once
+session = protocol.defaultSession
+
+# congestion controller to use, "reno" or "cubic"
+algorithm = "reno"
+
+# ask the server for cumulative/selective ACKs instead of one per packet
+use_sack = True
+
+# initial congestion window, in packets
+initial_window = 10
+
+# the sender never gets more than this many packets ahead of the lowest
+# unACKed packet, whatever the congestion window says
+window_size = 4096
+
+# seconds to wait for an ACK before retransmitting a packet, until we have an
+# RTT measurement to go on
+initial_timeout = 0.5
+
+# never wait less than this many seconds for an ACK, however short the RTT
+min_timeout = 0.2
+
+# forward error correction: after every fec_group packets, send fec_parity
+# parity packets, from which the server can rebuild lost packets without
+# waiting for a retransmission (see fec.py); fec_group = 0 turns it off
+fec_group = 0
+fec_parity = 1
+
+# payload encoding: "zlib" or "lz4" sends each row compressed, as a delta
+# against the row above or the same row of the frame before when that helps
+# (see rowcodec.py); None sends rows as they are
+payload_encoding = None
+
+# pacing: send new packets at pacing_gain times the congestion window per
+# smoothed RTT (twice that in slow start), or at a fixed pacing_rate packets
+# per second if that isn't None, in bursts of at most pacing_burst packets
+# (see pacer.py); use_pacing = False sends as fast as the window allows
+use_pacing = True
+pacing_gain = 1.25
+pacing_rate = None
+pacing_burst = 4
+
+# handshake: open the transfer with a SYN and close it with a FIN (see
+# protocol.py), waiting handshake_timeout seconds for each answer, and asking
+# up to handshake_retries times before giving up on the server answering
+use_handshake = True
+handshake_timeout = 1.0
+handshake_retries = 5
+
+# the transfer's id is kept in resumefile until it has finished, so running
+# the client again after it was interrupted carries on with the same transfer;
+# resumefile = None starts a new one every time
+resumefile = "client_transfer.id"
+
+
+# the stages of the send loop, for PROFILE=stages (see profiling.py)
+payloadStage = profiling.Stage("payload")
+sendStage = profiling.Stage("sendto")
+fecStage = profiling.Stage("fec")
+recvStage = profiling.Stage("recv")
+ackStage = profiling.Stage("ack")
+
+# The clock used for all of the client's timing, in seconds.
+def now():
+    return time.perf_counter_ns() * 1e-9
+
+
+# The state of one transfer: the window, the timers, the congestion controller
+# and the packets themselves. It doesn't know anything about sockets; packets
+# go out by calling send(packet), and ACKs come in through process_ack(), so the
+# same code drives both the blocking client here and async_client.py.
+#
+# Given shard = (group, index, numShards), it sends only shard number index of
+# the parallel transfer with id group, numbering its packets from 0 (see
+# shards.py). Given hello, the server's answer to a handshake, it uses the
+# session id and options the server agreed to, and skips whatever the server
+# already has.
+class Transfer:
+
+    def __init__(self, send, numPackets=None, shard=None, hello=None):
+        if numPackets is None:
+            numPackets = datasource.numPackets
+        self.send = send
+        self.session = session
+        windowSize = window_size
+        flags = wanted_flags()
+        if hello is not None:
+            self.session = hello.session
+            windowSize = hello.window
+            flags = flags & hello.flags
+        rows = datasource.wait_for_data
+        if shard is not None:
+            (group, index, numShards) = shard
+            self.session = protocol.make_shard_session(group, index, numShards)
+            flags = flags | protocol.flagShard
+            numPackets = shards.shard_size(numPackets, index, numShards, datasource.height)
+            rows = lambda seqno: datasource.wait_for_data(
+                    shards.to_global(seqno, index, numShards, datasource.height))
+        self.cc = congestion.make_controller(algorithm, initial_window, windowSize)
+        self.window = SendWindow(self.cc.window(), 0, numPackets, windowSize)
+        if hello is not None and hello.resumed():
+            self.window.resume(hello.cumAck, hello.ranges)
+        self.rto = RTOEstimator(initial_timeout, min_timeout)
+        # packets fast-retransmitted since the last loss, and not yet found to
+        # have been only reordered (see process_ack)
+        self.undoCount = 0
+
+        # Packets are built once, in place, and kept around for retransmission.
+        # The ring has a slot for every seqno the window can have outstanding.
+        self.fec = None
+        if flags & protocol.flagFec:
+            self.fec = FecEncoder(fec_group, fec_parity, protocol.make_magic(protocol.parityType, self.session))
+            # Give the server a chance to rebuild a lost packet from the
+            # group's parity before deciding it needs to be resent.
+            self.window.dupthresh = max(SendWindow.dupthresh, fec_group + fec_parity)
+        source = rows
+        maxPayload = datasource.packetSize
+        self.codec = None
+        if flags & protocol.flagEncoded:
+            # Only take deltas against rows the server got from us, not ones
+            # it had before we resumed, which it may not have kept.
+            self.codec = RowEncoder(rows, self.window.acked_here,
+                    payload_encoding, distances=(datasource.height, 1))
+            source = self.codec.encode
+            maxPayload = maxPayload + rowcodec.codecHeader.size
+        magic = protocol.make_data_magic(self.session, flags)
+        self.sendbuf = SendBuffer(windowSize, maxPayload, magic, source)
+        # Until there's an RTT to go on, only a fixed pacing_rate applies.
+        self.pacer = Pacer(pacing_rate, pacing_burst) if use_pacing else None
+        self.tStart = now()
+
+    def done(self):
+        return self.window.done()
+
+    # When the oldest packet in flight will need retransmitting, or the pacer
+    # will let the next new packet go, whichever is sooner.
+    def deadline(self):
+        t = self.window.next_deadline(self.rto.rto)
+        if self.pacer is not None and self.window.can_send():
+            tPace = self.pacer.next_time()
+            if tPace is not None and (t is None or tPace * 1e-9 < t):
+                t = tPace * 1e-9
+        return t
+
+    # Set the pacing rate from the congestion window and the smoothed RTT.
+    def update_pacing(self):
+        if self.pacer is None or pacing_rate is not None or self.rto.srtt is None:
+            return
+        gain = 2 * pacing_gain if self.cc.cwnd < self.cc.ssthresh else pacing_gain
+        self.pacer.rate = gain * self.cc.window() / max(self.rto.srtt, 1e-6)
+
+    # Fill the window with new packets, sending at most limit of them (if limit
+    # is not None), and no faster than the pacer allows. Returns how many were
+    # sent.
+    def fill(self, limit=None):
+        window = self.window
+        pacer = self.pacer
+        n = 0
+        while window.can_send() and (limit is None or n < limit):
+            if pacer is not None and not pacer.take(time.perf_counter_ns()):
+                break
+            seqno = window.next
+            t = payloadStage.start()
+            packet = self.sendbuf.packet(seqno)
+            payloadStage.stop(t)
+            t = sendStage.start()
+            self.send(packet)
+            sendStage.stop(t)
+            window.sent(seqno, now())
+            n = n + 1
+            if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
+                print("Sent packet with seqno %d" % (seqno))
+            if self.fec is not None:
+                t = fecStage.start()
+                parity = self.fec.add(seqno, packet[protocol.hdrSize:])
+                if window.next == window.last:
+                    parity.extend(self.fec.flush())
+                fecStage.stop(t)
+                for p in parity:
+                    self.send(p)
+        return n
+
+    # Handle an ACK that arrived at time tRecv. Returns how many packets it
+    # newly ACKed.
+    def process_ack(self, msg, tRecv):
+        window = self.window
+        rto = self.rto
+        cc = self.cc
+
+        # unpack integers from the ACK packet, and work out which packets it
+        # covers; an ACK for a packet resent less than the shortest RTT ago
+        # must be for the original, which wasn't lost after all
+        (magack, ackno) = struct.unpack_from(">II", msg)
+        tooSoon = tRecv - rto.minRtt if rto.minRtt is not None else None
+        spurious = window.numSpurious
+        if protocol.packet_type(magack) == protocol.sackType:
+            (ackno, ranges) = protocol.unpack_sack(msg, window.base)
+            newlyAcked = window.ack_range(window.base, ackno, tooSoon)
+            for (start, end) in ranges:
+                newlyAcked.extend(window.ack_range(start, end, tooSoon))
+        else:
+            ackno = protocol.unwrap(ackno, window.base)
+            newlyAcked = window.ack_range(ackno, ackno + 1, tooSoon)
+        if window.numSpurious > spurious:
+            # Once every packet resent since the last loss turns out to have
+            # been only reordered, there was no loss: take back the cut.
+            self.undoCount = self.undoCount - (window.numSpurious - spurious)
+            if self.undoCount <= 0:
+                cc.undo()
+        if not newlyAcked:
+            if verbose >= 3:
+                print("Ignoring duplicate ack with seqno %d" % (ackno))
+            return 0
+
+        # Measure the RTT from the most recently sent packet this ACK covers,
+        # unless Karn's rule says not to.
+        (sampled, tSent, retransmitted) = max(newlyAcked, key=lambda a: a[1])
+        rtt = rto.sample(tRecv - tSent, retransmitted)
+        if verbose >= 3 or (verbose >= 1 and ackno < 5 or ackno % 1000 == 0):
+            print("Got ack with seqno %d, rto is now %0.4f s" % (ackno, rto.rto))
+
+        tStart = self.tStart
+        for (seqno, tSent, retransmitted) in newlyAcked:
+            cc.on_ack(tRecv, rto.srtt, window.base)
+            # write info about the packet and the ACK to the log file
+            trace.write(seqno, tSent - tStart, ackno, tRecv - tStart,
+                        rtt if seqno == sampled and rtt is not None else trace.blank,
+                        rto.srtt, rto.rto, cc.cwnd, cc.ssthresh)
+        window.size = cc.window()
+        self.update_pacing()
+        return len(newlyAcked)
+
+    # Retransmit any holes that later packets have got past.
+    def fast_retransmit(self):
+        window = self.window
+        cc = self.cc
+        lost = window.lost()
+        if not lost:
+            return
+        tNow = now()
+        losses = cc.numLosses
+        cc.on_loss(tNow, window.in_flight(), window.next - 1)
+        if cc.numLosses > losses:
+            self.undoCount = 0
+        window.size = cc.window()
+        self.update_pacing()
+        if self.pacer is not None:
+            self.pacer.charge(time.perf_counter_ns(), len(lost))
+        for seqno in lost:
+            self.send(self.sendbuf.packet(seqno))
+            window.sent(seqno, tNow)
+            window.fast_retransmitted(seqno)
+            self.undoCount = self.undoCount + 1
+            if verbose >= 2:
+                print("Fast retransmit of packet with seqno %d, cwnd is now %0.1f" % (seqno, cc.cwnd))
+
+    # Retransmit every packet whose timer has run out, and nothing else.
+    def retransmit_expired(self):
+        window = self.window
+        tNow = now()
+        late = window.expired(tNow, self.rto.rto)
+        for seqno in late:
+            self.send(self.sendbuf.packet(seqno))
+            window.sent(seqno, tNow)
+            if verbose >= 2:
+                print("Timeout, retransmitted packet with seqno %d" % (seqno))
+        if late:
+            self.rto.backoff()
+            self.cc.on_timeout(tNow, window.in_flight())
+            window.size = self.cc.window()
+            self.update_pacing()
+            if self.pacer is not None:
+                self.pacer.charge(time.perf_counter_ns(), len(late))
+
+    def showStats(self):
+        elapsed = now() - self.tStart
+        print("Finished sending all packets!")
+        print("Elapsed time: %0.4f s" % (elapsed))
+        print("Packets built: %d, retransmitted from the send buffer: %d" %
+                (self.sendbuf.numBuilt, self.sendbuf.numReused))
+        if self.window.first > 0 or self.window.resumed:
+            print("Resumed: skipped %d packets the server already had" %
+                    (self.window.first + len(self.window.resumed)))
+        print("Retransmissions: %d (%d fast retransmit episodes, %d timeouts)" %
+                (self.window.numRetransmits, self.cc.numLosses, self.cc.numTimeouts))
+        if self.window.numSpurious > 0:
+            print("Reordering: %d packets resent needlessly, %d losses undone, dupthresh now %d" %
+                    (self.window.numSpurious, self.cc.numUndos, self.window.dupthresh))
+        if self.rto.srtt is not None:
+            print("Smoothed RTT: %0.4f s, final RTO: %0.4f s" % (self.rto.srtt, self.rto.rto))
+        if self.pacer is not None and self.pacer.rate is not None:
+            print("Pacing: final rate %0.0f packets/s, %d waits for the pacer" %
+                    (self.pacer.rate, self.pacer.numWaits))
+        if self.fec is not None:
+            print("Parity packets sent: %d (groups of %d with %d parity)" %
+                    (self.fec.numParity, fec_group, fec_parity))
+        if self.codec is not None and self.codec.numEncoded > 0:
+            print("Payloads encoded: %d (%d as deltas, %d sent raw), %d bytes down to %d (%0.1f%%)" %
+                    (self.codec.numEncoded, self.codec.numDelta, self.codec.numRaw,
+                     self.codec.bytesIn, self.codec.bytesOut,
+                     100.0 * self.codec.bytesOut / self.codec.bytesIn))
+
+
+# The flags for the options the settings above ask for.
+def wanted_flags():
+    flags = protocol.flagSack if use_sack else 0
+    if fec_group > 0:
+        flags = flags | protocol.flagFec
+    if payload_encoding is not None:
+        flags = flags | protocol.flagEncoded
+    return flags
+
+# The id of our transfer: the one saved in resumefile, if there is one, or else
+# a new one, saved there in case we are interrupted.
+def transfer_id():
+    if resumefile is not None and os.path.exists(resumefile):
+        with open(resumefile) as f:
+            return int(f.read().strip(), 16)
+    transferId = random.getrandbits(32)
+    if resumefile is not None:
+        with open(resumefile, "w") as f:
+            f.write("%08x\n" % (transferId))
+    return transferId
+
+# Send a handshake packet of type ptype carrying hello to addr, until an
+# answer of type replyType comes back for the same transfer. Returns the
+# answer's Hello, or None if the server never answered.
+def exchange(s, addr, ptype, hello, replyType):
+    packet = protocol.pack_hello(ptype, hello)
+    for attempt in range(handshake_retries):
+        s.sendto(packet, addr)
+        deadline = now() + handshake_timeout
+        while now() < deadline:
+            s.settimeout(deadline - now())
+            try:
+                (msg, reply_addr) = s.recvfrom(4000)
+            except (socket.timeout, BlockingIOError):
+                break
+            # anything else is a late ACK from before
+            (magic, seqno) = struct.unpack_from(">II", msg)
+            if protocol.packet_type(magic) == replyType:
+                reply = protocol.unpack_hello(msg)
+                if reply is not None and reply.transferId == hello.transferId:
+                    return reply
+    return None
+
+# Open the transfer. Returns the server's answer (see Transfer), or None if
+# there wasn't one.
+def handshake(s, addr):
+    flags = wanted_flags()
+    compression = 0
+    if payload_encoding is not None:
+        compression = rowcodec.compressions[payload_encoding]
+    hello = protocol.Hello(transfer_id(), datasource.numPackets, window_size, flags, compression)
+    return exchange(s, addr, protocol.synType, hello, protocol.synAckType)
+
+# Start the transfer with a handshake, unless use_handshake is off. Returns the
+# server's answer, or None if we are just sending without one.
+def open_transfer(s, addr):
+    if not use_handshake:
+        return None
+    hello = handshake(s, addr)
+    if hello is None:
+        print("Oops, no answer to our handshake, sending without one")
+    elif hello.resumed():
+        have = hello.cumAck + sum(end - start for (start, end) in hello.ranges)
+        print("Resuming transfer 0x%08x, the server already has %d of %d packets" %
+                (hello.transferId, have, hello.numPackets))
+    return hello
+
+# Tell the server the transfer has finished, and forget about it.
+def finish(s, addr, hello):
+    fin = protocol.Hello(hello.transferId, hello.numPackets, hello.window, hello.flags,
+            hello.compression, hello.session, hello.numPackets)
+    reply = exchange(s, addr, protocol.finType, fin, protocol.finAckType)
+    if reply is None:
+        print("Oops, the server didn't answer our FIN; it will forget the transfer once it's idle")
+    elif reply.cumAck < hello.numPackets:
+        print("Oops, the server says it is still missing seqno %d; run again to resend it" % (reply.cumAck))
+        return
+    if resumefile is not None and os.path.exists(resumefile):
+        os.remove(resumefile)
+
+def init_trace():
+    title = "Log of all packets sent and ACKs received by client"
+    if fec_group > 0:
+        title = title + " (FEC groups of %d with %d parity)" % (fec_group, fec_parity)
+    if payload_encoding is not None:
+        title = title + " (%s payload encoding)" % (payload_encoding)
+    trace.init(tracefile, title,
+               "SeqNo", "TimeSent", "AckNo", "timeACKed", "RTTSample", "SRTT", "RTO",
+               "CWnd", "SSThresh")
 
 
 def main(host, port):
     print("Sending UDP packets to %s:%d" % (host, port))
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Makes a UDP socket!
+    datasource.install_signal_handler()
+    init_trace()
 
-    trace.init(tracefile,
-               "Log of all packets sent and ACKs received by client",
-               "SeqNo", "TimeSent", "AckNo", "timeACKed")
-
-    # --------------------------------------------------------------------------------------------------
-    # Try getting an ACK - if you can't, then retransmit.
-    # If lost (after 3 attempts of retransmitting), then move on and send another packet
-    print("Beginning transmission of 10 packets without ACKs...")
-    tStart = time.time()
-    for seqno in range(0, 180000):
-        xpctACKnum = seqno - 10
-        # Use a sliding window for speed,
-        # so that multiple packets can be in flight simultaneously
-        # Goal: Send 10 packets in a row (using current loop?), no waiting for ACKS
-        # At this point in code about to send seq# "seqno" and about to receive ACK for seq# "seqno - 10"
-        if seqno <= 10:
-            print("Sending packet # " + str(seqno) + " without ACK ")
-            # get some example data to send
-            body = datasource.wait_for_data(seqno)
-
-            # make a header, create a packet, and send it
-            hdr = bytearray(struct.pack(">II", magic, seqno))
-            pkt = hdr + body
-            #tSend = time.time()
-            s.sendto(pkt, (host, port))
-            if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
-                print("Sent packet with seqno %d" % (seqno))
-            if xpctACKnum < 0:
-                continue
+    addr = (host, port)
+    hello = open_transfer(s, addr)
+    xfer = Transfer(lambda packet: s.sendto(packet, addr), hello=hello)
+
+    print("Beginning transmission using %s congestion control..." % (xfer.cc.name))
+    run(s, xfer)
+    if hello is not None:
+        finish(s, addr, hello)
+
+    xfer.showStats()
+    trace.close()
+    return xfer
 
-        print("Trying to receive an ACK...")
+# Send everything in xfer over socket s, and handle the ACKs that come back.
+def run(s, xfer):
+    while not xfer.done():
+        xfer.fill()
+
+        # Wait for an ACK, but only until the oldest packet in flight expires.
+        s.settimeout(max(xfer.deadline() - now(), 0.0001))
         try:
             while True:
-                s.settimeout(.5)
-                print("Timeout of .5 seconds has been set; about to try receiving...")
+                t = recvStage.start()
                 (msg, reply_addr) = s.recvfrom(4000)
-                print("Waiting for ACK # " + str(xpctACKnum))
-                tRecv = time.time()
-                # Message received in time, do something with the message...
-                # unpack integers from the ACK packet, then print some messages
-                (magack, ackno) = struct.unpack(">II", msg)
-                # if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
-                print("Got ack with seqno %d" % (ackno))
-                # write info about the packet and the ACK to the log file
-                #trace.write(seqno, tElapsed - tStart, ackno, tRecv - tStart)
-                # Cope with packet duplication and mis-ordering, e.g. by using the sequence numbers in ACKs.
-                if ackno != xpctACKnum:
-                    print(
-                        "***UH OH - This is not the ACK we wanted! Receiving again...***")
-                    continue
-                # optionally retransmit one or more
-
-                # If this is the ACK we want, then stop
-                if ackno == xpctACKnum:
-                    break
-
-        # If we do not get an ACK back, retransmit!
-        except (socket.timeout, socket.error):
-            # We never got ACK for xpctACKnum - must retransmit xpctACKnum + 1...etc
-            print("*******BEGINNING RETRANSMISSIONS*******")
-            for x in range(xpctACKnum, seqno):
-                print("Beginning retransmission of packet # " + str(x))
-                # get some example data to send
-                body = datasource.wait_for_data(x)
-                # make a header, create a packet, and send it
-                hdr = bytearray(struct.pack(">II", magic, x))
-                pkt = hdr + body
-                s.sendto(pkt, (host, port))
-                print("Sent retransmission of packet # " + str(x))
-                if verbose >= 3 or (verbose >= 1 and x < 5 or x % 1000 == 0):
-                    print("Sent packet with seqno %d" % (x))
-                    
-        # At this point either an ACK has been received OR
-        # The three retransmissions have failed. In either case,
-        # send the next packet
-# ---------------------------------------------------------------------------------------------------
-    end = time.time()
-    elapsed = end - tStart
-    print("Finished sending all packets!")
-    print("Elapsed time: %0.4f s" % (elapsed))
-    trace.close()
+                recvStage.stop(t)
+                tRecv = now()
+
+                # Drain any other ACKs that are already waiting, then go back
+                # to sending.
+                s.setblocking(False)
+                t = ackStage.start()
+                xfer.process_ack(msg, tRecv)
+                ackStage.stop(t)
+        except (socket.timeout, BlockingIOError):
+            pass
 
+        xfer.fast_retransmit()
+        xfer.retransmit_expired()
 
 if __name__ == "__main__":
     if len(sys.argv) <= 2:
@@ -142,4 +551,6 @@ if __name__ == "__main__":
         sys.exit(0)
     host = sys.argv[1]
     port = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        algorithm = sys.argv[3]
     main(host, port)
@@ -0,0 +1,46 @@
+# Checkpoints: what the server has received of each transfer, saved on disk,
+# so an interrupted transfer can carry on where it left off even if the server
+# was restarted in between (see the handshake in protocol.py).
+#
+# A checkpoint is the SYN-ACK the server would send for the transfer, but with
+# every run of seqnos it has received, not just the first maxHelloRanges: the
+# transfer id and options, the session id, the cumulative ACK and the runs
+# above it. There is one file per transfer, named after its id, in directory.
+# Each is written to a temporary file first and then renamed over the old one,
+# so a crash while saving leaves the previous checkpoint intact.
+
+import os
+import protocol
+
+# Returns the name of the checkpoint file for transferId.
+def path(directory, transferId):
+    return os.path.join(directory, "transfer-%08x.ckpt" % (transferId))
+
+# Save hello, a protocol.Hello with everything received so far.
+def save(directory, hello):
+    os.makedirs(directory, exist_ok=True)
+    filename = path(directory, hello.transferId)
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(protocol.pack_hello(protocol.synAckType, hello))
+    os.replace(tmp, filename)
+
+# Returns the protocol.Hello saved for transferId, or None if there isn't one
+# (or it's unreadable).
+def load(directory, transferId):
+    try:
+        with open(path(directory, transferId), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    hello = protocol.unpack_hello(data)
+    if hello is None or hello.transferId != transferId:
+        return None
+    return hello
+
+# Throw away the checkpoint for transferId, once it's finished.
+def remove(directory, transferId):
+    try:
+        os.remove(path(directory, transferId))
+    except OSError:
+        pass
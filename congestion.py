@@ -0,0 +1,182 @@
+# Congestion control for our TCP-like protocol. A controller decides how many
+# packets the sender may have in flight (cwnd), and is driven by three events:
+#
+#   on_ack(t, rtt, base)    - a new packet was ACKed. base is the lowest seqno
+#                             that still hasn't been ACKed.
+#   on_loss(t, inFlight, highest)
+#                           - a packet was found lost by fast retransmit, i.e.
+#                             dupthresh packets sent after it have been ACKed.
+#                             highest is the highest seqno sent so far.
+#   on_timeout(t, inFlight) - the retransmission timer expired.
+#
+# If the packets fast retransmit resent turn out not to have been lost at all,
+# only overtaken by later ones (see window.py), undo() puts the window back
+# the way it was before the loss, as in RFC 4015.
+#
+# Two controllers are provided:
+#
+#   Reno  - slow start, additive-increase/multiplicative-decrease congestion
+#           avoidance, and fast recovery.
+#   Cubic - the same slow start and fast recovery, but in congestion avoidance
+#           the window grows along a cubic curve centered on the window size at
+#           the last loss, so it probes quickly on fat pipes and stays near the
+#           old limit on paths that keep dropping.
+#
+# Use make_controller("reno") or make_controller("cubic") to get one. Windows
+# are measured in packets, and may be fractional; callers should use
+# window() which rounds down and never returns less than one.
+
+slow_start = "slow start"
+avoidance = "congestion avoidance"
+recovery = "fast recovery"
+
+class Reno:
+
+    name = "reno"
+
+    def __init__(self, initialWindow=10, maxWindow=None):
+        self.cwnd = float(initialWindow)
+        self.ssthresh = float("inf")
+        self.maxWindow = maxWindow
+        self.state = slow_start
+        self.recover = None     # leave fast recovery once base passes this
+        self.prior = None       # what save() said before the last loss
+        self.numLosses = 0
+        self.numTimeouts = 0
+        self.numUndos = 0
+
+    # Number of packets that may be in flight right now.
+    def window(self):
+        w = int(self.cwnd)
+        if self.maxWindow is not None:
+            w = min(w, self.maxWindow)
+        return max(w, 1)
+
+    def on_ack(self, t, rtt, base):
+        if self.state == recovery:
+            if base <= self.recover:
+                return
+            # Everything outstanding at the time of the loss is now ACKed.
+            self.cwnd = self.ssthresh
+            self.state = avoidance
+            self.recover = None
+            return
+        if self.cwnd < self.ssthresh:
+            self.state = slow_start
+            self.cwnd = self.cwnd + 1
+        else:
+            self.state = avoidance
+            self.grow(t, rtt)
+        if self.maxWindow is not None:
+            self.cwnd = min(self.cwnd, self.maxWindow)
+
+    # Congestion avoidance: one extra packet per round trip.
+    def grow(self, t, rtt):
+        self.cwnd = self.cwnd + 1.0 / self.cwnd
+
+    def on_loss(self, t, inFlight, highest):
+        # Only react once per window of data.
+        if self.state == recovery:
+            return
+        self.numLosses = self.numLosses + 1
+        self.prior = self.save()
+        self.ssthresh = max(self.reduce(t, inFlight), 2.0)
+        self.cwnd = self.ssthresh
+        self.state = recovery
+        self.recover = highest
+
+    def on_timeout(self, t, inFlight):
+        self.numTimeouts = self.numTimeouts + 1
+        self.prior = None
+        self.ssthresh = max(self.reduce(t, inFlight), 2.0)
+        self.cwnd = 1.0
+        self.state = slow_start
+        self.recover = None
+
+    # Returns the new ssthresh after a loss.
+    def reduce(self, t, inFlight):
+        return max(self.cwnd, inFlight) / 2.0
+
+    # The last loss was no loss at all: go back to where we were before it.
+    def undo(self):
+        if self.prior is None:
+            return
+        self.restore(self.prior)
+        self.prior = None
+        self.state = slow_start if self.cwnd < self.ssthresh else avoidance
+        self.recover = None
+        self.numUndos = self.numUndos + 1
+
+    # Everything reduce() and the loss change, so undo() can put it back.
+    def save(self):
+        return (self.cwnd, self.ssthresh)
+
+    def restore(self, saved):
+        (self.cwnd, self.ssthresh) = saved
+
+
+class Cubic(Reno):
+
+    name = "cubic"
+
+    C = 0.4
+    beta = 0.7
+
+    def __init__(self, initialWindow=10, maxWindow=None):
+        Reno.__init__(self, initialWindow, maxWindow)
+        self.wMax = 0.0         # window size just before the last reduction
+        self.epochStart = None  # time congestion avoidance last (re)started
+        self.K = 0.0            # seconds from epochStart to get back to wMax
+        self.wEst = 0.0         # what Reno would have done, for fairness
+
+    def grow(self, t, rtt):
+        if self.epochStart is None:
+            self.epochStart = t
+            if self.cwnd < self.wMax:
+                self.K = ((self.wMax - self.cwnd) / self.C) ** (1.0 / 3)
+            else:
+                self.K = 0.0
+                self.wMax = self.cwnd
+            self.wEst = self.cwnd
+        if rtt is None:
+            rtt = 0.0
+        elapsed = t - self.epochStart + rtt
+        target = self.C * (elapsed - self.K) ** 3 + self.wMax
+
+        # Never grow slower than Reno would on the same path.
+        self.wEst = self.wEst + 3 * (1 - self.beta) / (1 + self.beta) / self.cwnd
+        target = max(target, self.wEst)
+
+        if target > self.cwnd:
+            self.cwnd = self.cwnd + min(target - self.cwnd, self.cwnd) / self.cwnd
+        else:
+            self.cwnd = self.cwnd + 0.01 / self.cwnd
+
+    def reduce(self, t, inFlight):
+        w = max(self.cwnd, inFlight)
+        # Fast convergence: if we are losing before reaching the old maximum,
+        # another flow probably took the bandwidth, so back off further.
+        if w < self.wMax:
+            self.wMax = w * (1 + self.beta) / 2
+        else:
+            self.wMax = w
+        self.epochStart = None
+        return w * self.beta
+
+    def save(self):
+        return (self.cwnd, self.ssthresh, self.wMax, self.epochStart, self.K, self.wEst)
+
+    def restore(self, saved):
+        (self.cwnd, self.ssthresh, self.wMax, self.epochStart, self.K, self.wEst) = saved
+
+
+controllers = {
+    "reno": Reno,
+    "cubic": Cubic,
+}
+
+def make_controller(name, initialWindow=10, maxWindow=None):
+    if name not in controllers:
+        raise Exception("Oops, unknown congestion controller %s, try one of: %s" %
+                (name, ", ".join(sorted(controllers))))
+    return controllers[name](initialWindow, maxWindow)
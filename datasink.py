@@ -3,18 +3,47 @@
 #
 # This file consumes packets as they are received by a server. It also
 # calculates and prints some statistics.
+#
+# The same statistics, and a few more, can be watched while the server runs,
+# without printing anything: the web view's HTTP server publishes them at
+# /metrics, in the Prometheus text format, and at /stats.json (see
+# metrics.py).
+#
+# A parallel transfer arrives as several flows, one per shard (see shards.py).
+# Each shard's flow hands its packets, as they arrive, to the ShardGroup for the
+# whole transfer, which maps them back to their place in it and puts them in
+# order, so the browser sees one stream.
+#
+# A client that opens its transfer with a handshake (see protocol.py) gets a
+# session id from open_transfer(), and the flow is remembered by the
+# transfer's id, so a client that restarts (from a new port) carries on with
+# the same flow. What each such transfer has received is saved to disk now and
+# then (see checkpoint.py), so it can carry on after the server restarts too.
 
 import time
+import json
 import os
+import random
 import signal
 import sys
 import struct
 import threading
-from queue import Queue
 from simple_websocket_server import WebSocketServer, WebSocket
 import http.server
 import socketserver
 import trace
+import frames
+import ring
+import metrics
+from fec import FecDecoder
+from rowcodec import RowDecoder
+from reorder import ReorderBuffer
+from seqset import ReceivedSet
+import protocol
+import rowcodec
+import shards
+import checkpoint
+import steering
 
 # setting verbose = 0 turns off most printing
 # setting verbose = 1 turns on a little bit of printing
@@ -25,74 +54,588 @@ verbose = 2
 # setting shortStats = True makes the printing a little more condensed
 shortStats = True
 
-# statistics
-startTime = None
-endTime = None
+# A server can be receiving from many clients at once. Each stream of packets
+# is a "flow", identified by the client's (address, port) and a session id
+# carried in the packet header (see protocol.py), and each flow gets its own
+# Flow object below with its own statistics and record of which seqnos have
+# arrived. Flows that go quiet for flowTimeout seconds are evicted.
+
+# seconds of silence after which a flow is forgotten
+flowTimeout = 30.0
+
+# Each flow puts its packets back in order with a reorder buffer (see
+# reorder.py) before passing them on to the browser. The buffer only takes
+# memory once packets arrive out of order, and then only as much as they need.
+# These set the most memory each flow's buffer can use, the largest payload it
+# can hold, and how many seconds to wait for a missing packet before giving up
+# on it (None means only give up when the buffer is full).
+reorderBytes = 8 * 1024 * 1024
+maxPayload = 1464
+holeTimeout = 5.0
+
+# how many recent payloads each flow that uses parity packets keeps, for
+# rebuilding lost packets (see fec.py)
+fecPackets = 1024
+
+# how many recent rows each flow that encodes its payloads keeps, to undo
+# deltas against (see rowcodec.py). A client takes deltas against rows at most
+# one frame back, and never has more than its window span of seqnos
+# outstanding, so this must be more than the two added together.
+codecPackets = 8192
+
+# what transfers opened with a handshake have received is saved in
+# checkpointDir every checkpointInterval seconds (see checkpoint.py);
+# checkpointDir = None turns that off
+checkpointDir = "checkpoints"
+checkpointInterval = 5.0
+
+# which of numWorkers server workers sharing the port this is (see server.py);
+# only session ids the kernel steers back here are handed out
+worker = 0
+numWorkers = 1
+
+class Flow:
+
+    def __init__(self, addr, session, flowid):
+        self.addr = addr
+        self.session = session
+        self.flowid = flowid
+        self.name = "flow %d (%s:%d session 0x%06x)" % (flowid, addr[0], addr[1], session)
+
+        # statistics
+        self.startTime = None
+        self.endTime = None
+        self.totalBytes = 0
+        self.totalPackets = 0
+        self.uniquePackets = 0
+        self.duplicatePackets = 0
+        self.misorderedPackets = 0
+        self.expectedSeqno = 0
+
+        # Tracks how many times each seqno has been received, along with the
+        # cumulative ACK and the runs of seqnos received above it (see
+        # seqset.py).
+        self.received = ReceivedSet()
+
+        # ACK bookkeeping for server.py. sack is True if the client asked for
+        # cumulative ACKs, unacked counts packets that arrived since the last
+        # ACK was sent, and ackDeadline is when a delayed ACK must go out.
+        self.sack = False
+        self.unacked = 0
+        self.ackDeadline = None
+
+        # Payloads are released from here in seqno order.
+        self.reorder = ReorderBuffer(reorderBytes // maxPayload, maxPayload,
+                self.consume, 0, holeTimeout)
+
+        # For clients that send parity packets, lost packets are rebuilt from
+        # the parity (see fec.py). rebuilt lists the seqnos rebuilt since
+        # server.py last looked, so it can ACK them.
+        self.fec = None
+        self.rebuilt = []
+
+        # For clients that encode their payloads, this decodes them.
+        self.codec = None
+
+        # bytes and packets per second, for /metrics
+        self.rates = metrics.RateWindow()
+
+        # For a shard of a parallel transfer, the ShardGroup its packets go
+        # on to, and which shard it is.
+        self.group = None
+        self.shard = 0
+
+        # For a transfer opened with a handshake, the protocol.Hello with the
+        # options we agreed to, and how many seqnos had arrived when it was
+        # last checkpointed.
+        self.transfer = None
+        self.checkpointed = 0
+
+        # Runs of seqnos that arrived before the server restarted (see
+        # restore()), which will never come through the reorder buffer.
+        self.restoredRanges = []
+
+    # deliver() uses the seqno to put payloads into the proper order, and marks that
+    # seqno as having been received. It also prints various statistics. It returns a
+    # number indicating how many times this seqno has been seen. So it will return 1
+    # the first time a seqno is seen, and it will return larger numbers when a seqno
+    # is a duplicate of some previous packet. An encoded payload that can't be
+    # decoded is thrown away, as if it had been lost, and deliver() returns 0.
+    def deliver(self, seqno, payload):
+        # Keep track of the most recent packet arrival time
+        self.endTime = time.time()
+
+        # Seqnos are 32 bits on the wire, and may wrap around.
+        seqno = self.received.unwrap(seqno)
+
+        # Decode the payload, the first time we see it.
+        data = payload
+        if self.codec is not None and self.count_times_received(seqno) == 0:
+            data = self.codec.decode(seqno, payload)
+            if data is None:
+                log("Oops, could not decode payload of seqno %d, dropping it", seqno)
+                return 0
+
+        # Mark the packet as having been received.
+        n = self.mark_as_received(seqno)
+        if n == 1:
+            # Put it in order. The reorder buffer calls consume() for each
+            # packet once all the packets before it have been released.
+            # The shards of a parallel transfer are put in order by their
+            # ShardGroup instead.
+            if self.group is not None:
+                self.group.add(self.shard, seqno, data, self.endTime)
+            else:
+                self.reorder.add(seqno, data, self.endTime)
+            if self.restoredRanges:
+                self.skip_restored()
+            # It might be the last piece needed to rebuild a lost packet.
+            if self.fec is not None:
+                self.rebuild(self.fec.data(seqno, payload, self.received))
+
+        # Update statistics and print warning/error messages.
+        global totalBytes, totalPackets, uniquePackets, duplicatePackets, misorderedPackets
+        totalBytes = totalBytes + len(payload)
+        totalPackets = totalPackets + 1
+        self.totalBytes = self.totalBytes + len(payload)
+        self.totalPackets = self.totalPackets + 1
+        rates.add(self.endTime, len(payload))
+        self.rates.add(self.endTime, len(payload))
+        if n > 1:
+            duplicatePackets = duplicatePackets + 1
+            self.duplicatePackets = self.duplicatePackets + 1
+            if self.duplicatePackets <= 10 or verbose >= 2 :
+                log("Oops, got seqno %d, but already got that %d times", seqno, n-1)
+                if self.duplicatePackets == 10 and verbose < 2:
+                    log("  (supressing further messages like this)")
+        else:
+            uniquePackets = uniquePackets + 1
+            self.uniquePackets = self.uniquePackets + 1
+            if not seqno == self.expectedSeqno:
+                misorderedPackets = misorderedPackets + 1
+                self.misorderedPackets = self.misorderedPackets + 1
+                if self.misorderedPackets <= 10 or verbose >= 2:
+                    log("Oops, got seqno %d, but was expecting seqno %d", seqno, self.expectedSeqno)
+                    if self.misorderedPackets == 10 and verbose < 2:
+                        log("  (supressing further messages like this)")
+        self.expectedSeqno = seqno + 1
+
+        # Print statistics, but not for every packet.
+        flowPackets = self.totalPackets
+        if flowPackets == 1:
+            self.startTime = self.endTime
+            if verbose >= 2:
+                log("First packet arrived for %s: seqno = %d, payload length = %d bytes", self.name, seqno, len(payload))
+        else:
+            if verbose >= 3:
+                log("A new packet arrived: seqno = %d, payload length = %d bytes", seqno, len(payload))
+            if verbose >= 2 and (
+                    (flowPackets < 10) or
+                    (flowPackets < 100 and flowPackets % 10 == 0) or
+                    (flowPackets < 1000 and flowPackets % 100 == 0) or
+                    (flowPackets < 10000 and flowPackets % 1000 == 0)):
+                self.showStats()
+            elif flowPackets % 10000 == 0:
+                self.showStats()
+
+        # Return a count of how many times this packet has been seen so far.
+        return n
+
+    # Start keeping what's needed to rebuild lost packets from parity packets.
+    def enable_fec(self):
+        if self.fec is None:
+            self.fec = FecDecoder(fecPackets, maxPayload)
+
+    # Start decoding payloads (see rowcodec.py).
+    def enable_codec(self):
+        if self.codec is None:
+            self.codec = RowDecoder(codecPackets, maxPayload)
+
+    # Carry on with a transfer from a checkpoint (a protocol.Hello): mark
+    # everything in it as received, and deliver from the first hole on. The
+    # packets above that which arrived before were never delivered, and the
+    # client won't send them again, so the browser never sees them.
+    def restore(self, saved):
+        for seqno in range(saved.cumAck):
+            self.received.mark(seqno)
+        for (start, end) in saved.ranges:
+            for seqno in range(start, end):
+                self.received.mark(seqno)
+        self.checkpointed = self.received.unique
+        self.expectedSeqno = saved.cumAck
+        self.reorder = ReorderBuffer(reorderBytes // maxPayload, maxPayload,
+                self.consume, saved.cumAck, holeTimeout)
+        self.restoredRanges = list(saved.ranges)
+
+    # Don't let the reorder buffer wait for restored packets.
+    def skip_restored(self):
+        ranges = self.restoredRanges
+        while ranges and self.reorder.next >= ranges[0][0]:
+            (start, end) = ranges.pop(0)
+            if self.reorder.next < end:
+                self.reorder.skip_to(end, self.endTime)
+
+    # The client has moved to a new address (it was restarted).
+    def move(self, addr):
+        self.addr = addr
+        self.name = "flow %d (%s:%d session 0x%06x)" % (self.flowid, addr[0], addr[1], self.session)
+
+    # A protocol.Hello for a transfer opened with a handshake, with what has
+    # arrived so far: the cumulative ACK and up to maxRanges runs above it
+    # (all of them if maxRanges is None).
+    def progress(self, maxRanges=None):
+        t = self.transfer
+        if maxRanges is None:
+            maxRanges = len(self.received.rangeStarts)
+        return protocol.Hello(t.transferId, t.numPackets, t.window, t.flags, t.compression,
+                self.session, self.received.cumAck, self.sack_ranges(maxRanges))
+
+    # True once every packet of a transfer opened with a handshake has arrived.
+    def complete(self):
+        return self.received.cumAck >= self.transfer.numPackets
+
+    # Save what a transfer opened with a handshake has received, if anything
+    # new has arrived since last time.
+    def save_checkpoint(self):
+        if checkpointDir is None or self.transfer is None or self.received.unique == self.checkpointed:
+            return
+        checkpoint.save(checkpointDir, self.progress())
+        self.checkpointed = self.received.unique
+
+    # Pass this flow's packets on to the ShardGroup of the parallel transfer
+    # its session id says it belongs to (see shards.py).
+    def join_group(self):
+        if self.group is None:
+            (group, self.shard, numShards) = protocol.shard_info(self.session)
+            self.group = get_group(self.addr[0], group, numShards)
+            self.group.numFlows = self.group.numFlows + 1
+
+    # deliver_parity() takes a parity packet for the group starting at seqno,
+    # and delivers any packet it lets us rebuild.
+    def deliver_parity(self, seqno, parity):
+        self.endTime = time.time()
+        self.enable_fec()
+        self.rebuild(self.fec.parity(self.received.unwrap(seqno), parity, self.received))
+
+    def rebuild(self, packets):
+        for (seqno, payload) in packets:
+            self.rebuilt.append(seqno)
+            self.deliver(seqno, payload)
+
+    # Called with each payload, in seqno order.
+    def consume(self, seqno, payload):
+        release(self, seqno, payload)
+
+    def throughput(self):
+        totalTime = (self.endTime - self.startTime)
+        if totalTime <= 0:
+            return 0.0
+        return self.totalBytes / totalTime
+
+    def showStats(self):
+        totalTime = (self.endTime - self.startTime)
+        bytesPerSecond = self.throughput()
+        missingPackets = self.received.missing()
+        if shortStats:
+            log("%s: elapsed time %0.3f s, total received %s, throughput %s",
+                    self.name, totalTime, kb(self.totalBytes), kb(bytesPerSecond)+"ps")
+            log("  %d packets, %d unique, %d duplicate, %d misordered, %d missing",
+                    self.totalPackets, self.uniquePackets, self.duplicatePackets,
+                    self.misorderedPackets, missingPackets)
+            if self.group is not None:
+                log("  shard %d of %s", self.shard, self.group.name)
+            else:
+                log("  %d delivered in order, %d waiting for a hole to fill, %d given up on",
+                        self.reorder.numReleased, self.reorder.depth, self.reorder.numSkipped)
+            if self.fec is not None:
+                log("  %d parity packets, %d packets rebuilt from parity",
+                        self.fec.numParity, self.fec.numRebuilt)
+            if self.codec is not None:
+                log("  %d payloads decoded, %s on the wire, %s decoded, %d undecodable",
+                        self.codec.numDecoded, kb(self.codec.bytesIn), kb(self.codec.bytesOut),
+                        self.codec.numFailed)
+            if self.transfer is not None:
+                log("  transfer 0x%08x: %d of %d packets received",
+                        self.transfer.transferId, self.received.unique, self.transfer.numPackets)
+        else:
+            log("  Flow: %s", self.name)
+            log("  Elapsed time: %0.3f s", totalTime)
+            log("  Total Packets: %d", self.totalPackets)
+            log("  Unique Packets: %d", self.uniquePackets)
+            log("  Missing packets: %d", missingPackets)
+            log("  First missing seqno: %d", self.received.first_missing())
+            log("  Duplicate packets: %d", self.duplicatePackets)
+            log("  Out-of-order packets: %d", self.misorderedPackets)
+            log("  Delivered in order: %d", self.reorder.numReleased)
+            log("  Waiting in reorder buffer: %d", self.reorder.depth)
+            log("  Given up on: %d", self.reorder.numSkipped)
+            if self.fec is not None:
+                log("  Parity packets: %d", self.fec.numParity)
+                log("  Rebuilt from parity: %d", self.fec.numRebuilt)
+            if self.codec is not None:
+                log("  Payloads decoded: %d", self.codec.numDecoded)
+                log("  Encoded bytes: %s", kb(self.codec.bytesIn))
+                log("  Decoded bytes: %s", kb(self.codec.bytesOut))
+                log("  Undecodable payloads: %d", self.codec.numFailed)
+            if self.transfer is not None:
+                log("  Transfer: 0x%08x", self.transfer.transferId)
+                log("  Packets in transfer: %d", self.transfer.numPackets)
+                log("  Received in transfer: %d", self.received.unique)
+            log("  Data: %s", kb(self.totalBytes))
+            log("  Throughput: %s", kb(bytesPerSecond)+"ps")
+
+    def mark_as_received(self, seqno):
+        return self.received.mark(seqno)
+
+    def count_times_received(self, seqno):
+        return self.received.count(seqno)
+
+    # Returns up to maxRanges (start, end) runs of received seqnos above the
+    # cumulative ACK, lowest first.
+    def sack_ranges(self, maxRanges):
+        return self.received.sack_ranges(maxRanges)
+
+
+# The shards of one parallel transfer, all from the same host, put back
+# together. Each shard's packets arrive here in whatever order they came,
+# numbered by that shard, and go out in order, numbered across the whole
+# transfer.
+class ShardGroup:
+
+    def __init__(self, host, group, numShards):
+        self.host = host
+        self.group = group
+        self.numShards = numShards
+        self.name = "parallel transfer 0x%04x (%s, %d shards)" % (group, host, numShards)
+        self.numFlows = 0       # shards' flows that haven't been evicted
+
+        # The shards don't keep in step with each other, so this can grow to
+        # have room for each of them to be as far ahead of the slowest as a
+        # flow can be.
+        self.reorder = ReorderBuffer(numShards * reorderBytes // maxPayload, maxPayload,
+                self.consume, 0, holeTimeout)
+
+    def add(self, shard, seqno, payload, t):
+        self.reorder.add(shards.to_global(seqno, shard, self.numShards, rowsPerFrame), payload, t)
+
+    def consume(self, seqno, payload):
+        release(self, seqno, payload)
+
+    def showStats(self):
+        log("%s: %d delivered in order, %d waiting for another shard, %d given up on",
+                self.name, self.reorder.numReleased, self.reorder.depth, self.reorder.numSkipped)
+
+
+# All the flows we are currently receiving, keyed by (addr, session).
+flows = {}
+nextFlowId = 0
+
+# All the parallel transfers we are currently receiving, keyed by (host,
+# group id).
+groups = {}
+
+# The flows of all the transfers opened with a handshake, keyed by transfer id.
+transfers = {}
+lastCheckpoint = 0.0
+
+# If not None, called as onDeliver(flow, seqno, payload) for every payload,
+# as it is released in seqno order (bench.py uses this to time packets). For
+# a parallel transfer, flow is its ShardGroup.
+onDeliver = None
+
+# Totals over every flow seen so far, including ones that have been evicted.
 totalBytes = 0
 totalPackets = 0
 uniquePackets = 0
 duplicatePackets = 0
 misorderedPackets = 0
-expectedSeqno = 0
-highestSeqno = -1
-
-# deliver() uses the seqno to put payloads into the proper order, and marks that
-# seqno as having been received. It also prints various statistics. It returns a
-# number indicating how many times this seqno has been seen. So it will return 1
-# the first time a seqno is seen, and it will return larger numbers when a seqno
-# is a duplicate of some previous packet.
-def deliver(seqno, payload):
-    # Keep track of the most recent packet arrival time
-    global startTime, endTime
-    endTime = time.time()
-
-    # Put the packet into a queue to be sent to the browser, if there is one.
-    if recentPackets is not None:
-        recentPackets.put((seqno, payload))
-
-    # Mark the packet as having been received.
-    n = mark_as_received(seqno)
-
-    # Update statistics and print warning/error messages.
-    global highestSeqno, expectedSeqno, totalBytes, totalPackets, uniquePackets, duplicatePackets, misorderedPackets
-    totalBytes = totalBytes + len(payload)
-    totalPackets = totalPackets + 1
-    if n > 1:
-        duplicatePackets = duplicatePackets + 1
-        if duplicatePackets <= 10 or verbose >= 2 :
-            print("Oops, got seqno %d, but already got that %d times" % (seqno, n-1))
-            if duplicatePackets == 10 and verbose < 2:
-                print("  (supressing further messages like this)")
-    else:
-        uniquePackets = uniquePackets + 1
-        if not seqno == expectedSeqno:
-            misorderedPackets = misorderedPackets + 1
-            if misorderedPackets <= 10 or verbose >= 2:
-                print("Oops, got seqno %d, but was expecting seqno %d" % (seqno, expectedSeqno))
-                if misorderedPackets == 10 and verbose < 2:
-                    print("  (supressing further messages like this)")
-    expectedSeqno = seqno + 1
-    highestSeqno = max(highestSeqno, seqno)
-
-    # Print statistics, but not for every packet.
-    if totalPackets == 1:
-        startTime = endTime
-        if verbose >= 2:
-            print("First packet arrived: seqno = %d, payload length = %d bytes" % (seqno, len(payload)))
-    else:
-        if verbose >= 3:
-            print("A new packet arrived: seqno = %d, payload length = %d bytes" % (seqno, len(payload)))
-        if verbose >= 2 and (
-                (totalPackets < 10) or
-                (totalPackets < 100 and totalPackets % 10 == 0) or
-                (totalPackets < 1000 and totalPackets % 100 == 0) or
-                (totalPackets < 10000 and totalPackets % 1000 == 0)):
-            showStats()
-        elif totalPackets % 10000 == 0:
-            showStats()
 
-    # Return a count of how many times this packet has been seen so far.
-    return n
+# Returns the Flow for packets from addr with the given session id, making a
+# new one if this is the first packet of a flow.
+def get_flow(addr, session):
+    global nextFlowId
+    key = (addr, session)
+    flow = flows.get(key)
+    if flow is None:
+        flow = Flow(addr, session, nextFlowId)
+        nextFlowId = nextFlowId + 1
+        flows[key] = flow
+        if verbose >= 1:
+            log("New %s", flow.name)
+    return flow
+
+# Start the transfer a client asked for in a SYN (hello, a protocol.Hello) from
+# addr, or carry on with it if we already have some of it, in memory or in a
+# checkpoint. Returns its Flow, whose transfer says what we agreed to.
+def open_transfer(addr, hello):
+    flow = transfers.get(hello.transferId)
+    if flow is not None and flow.transfer.numPackets != hello.numPackets:
+        close_transfer(flow) # the same id for a different transfer
+        flow = None
+    if flow is not None:
+        if flow.addr != addr:
+            if flows.get((flow.addr, flow.session)) is flow:
+                del flows[(flow.addr, flow.session)]
+            flow.move(addr)
+            flows[(addr, flow.session)] = flow
+            if verbose >= 1:
+                log("Resuming transfer 0x%08x as %s", hello.transferId, flow.name)
+    else:
+        saved = None
+        if checkpointDir is not None:
+            saved = checkpoint.load(checkpointDir, hello.transferId)
+        if saved is not None and saved.numPackets != hello.numPackets:
+            saved = None
+        if saved is not None and is_our_session(saved.session):
+            flow = get_flow(addr, saved.session)
+        else:
+            flow = get_flow(addr, new_session())
+        if saved is not None:
+            flow.restore(saved)
+            if verbose >= 1:
+                log("Resuming transfer 0x%08x from its checkpoint as %s, %d of %d packets received",
+                        hello.transferId, flow.name, flow.received.unique, hello.numPackets)
+        transfers[hello.transferId] = flow
+    flow.transfer = negotiate(hello, flow.received.unique > 0)
+    # the client never has more than its window in flight, so the reorder
+    # buffer need never grow any bigger than that
+    flow.reorder.capacity = flow.transfer.window
+    flow.endTime = time.time() # so it's evicted if the client never sends anything
+    return flow
+
+# The options we agree to for a transfer, given the ones the client asked for:
+# a window of at least one packet but no more than a reorder buffer holds,
+# encoded payloads only with compression we can undo, and no parity for a
+# transfer that's being resumed, since the client's parity groups would have
+# holes where the packets we already have are.
+def negotiate(hello, resumed):
+    flags = hello.flags & (protocol.flagSack | protocol.flagFec | protocol.flagEncoded)
+    compression = hello.compression
+    if compression not in rowcodec.compressions.values() or (
+            compression == rowcodec.compressions["lz4"] and rowcodec.lz4 is None):
+        flags = flags & ~protocol.flagEncoded
+    if not flags & protocol.flagEncoded:
+        compression = rowcodec.compressions["none"]
+    if resumed:
+        flags = flags & ~protocol.flagFec
+    window = max(1, min(hello.window, reorderBytes // maxPayload))
+    return protocol.Hello(hello.transferId, hello.numPackets, window, flags, compression)
+
+# A session id that no transfer is using, and that steers back to this worker.
+def new_session():
+    inUse = set(flow.session for flow in transfers.values())
+    while True:
+        session = random.getrandbits(24)
+        if is_our_session(session) and session not in inUse:
+            return session
+
+# True if the packets for session come to this worker (see steering.py).
+def is_our_session(session):
+    return steering.session_worker(session, numWorkers) == worker
+
+# The client has finished the transfer flow was for: forget about it, and its
+# checkpoint.
+def close_transfer(flow):
+    transferId = flow.transfer.transferId
+    if transfers.get(transferId) is flow:
+        del transfers[transferId]
+    if flows.get((flow.addr, flow.session)) is flow:
+        del flows[(flow.addr, flow.session)]
+    if checkpointDir is not None:
+        checkpoint.remove(checkpointDir, transferId)
+    if verbose >= 1:
+        log("Finished transfer 0x%08x", transferId)
+        if flow.totalPackets > 0:
+            flow.showStats()
+
+# Checkpoint every transfer that has received something new.
+def save_checkpoints():
+    for flow in list(transfers.values()):
+        flow.save_checkpoint()
+
+# Returns the ShardGroup for the parallel transfer with the given id from
+# host, making a new one for its first shard.
+def get_group(host, group, numShards):
+    key = (host, group)
+    g = groups.get(key)
+    if g is None:
+        g = ShardGroup(host, group, numShards)
+        groups[key] = g
+        if verbose >= 1:
+            log("New %s", g.name)
+    return g
+
+# Hand a payload, in order, to whatever is watching: onDeliver and the browser.
+# source is the Flow or ShardGroup it came from.
+def release(source, seqno, payload):
+    if onDeliver is not None:
+        onDeliver(source, seqno, payload)
+    # Put the packet into a ring to be sent to the browser, if there is one.
+    if recentPackets is not None:
+        recentPackets.put(seqno, payload)
+
+# Forget about flows that have not sent anything for flowTimeout seconds, and
+# give up on any holes that have been blocking delivery for too long. A
+# parallel transfer is forgotten along with the last of its shards. Every
+# checkpointInterval seconds, transfers opened with a handshake are
+# checkpointed, and one that goes idle is checkpointed before it's forgotten,
+# so the client can still resume it.
+def evict_idle(now):
+    global lastCheckpoint
+    for flow in flows.values():
+        flow.reorder.expire(now)
+        if flow.restoredRanges:
+            flow.skip_restored()
+    for g in groups.values():
+        g.reorder.expire(now)
+    if now - lastCheckpoint >= checkpointInterval:
+        lastCheckpoint = now
+        save_checkpoints()
+    for key in [key for key, flow in flows.items() if flow.endTime is not None and now - flow.endTime > flowTimeout]:
+        flow = flows.pop(key)
+        if verbose >= 1:
+            log("Evicting idle %s", flow.name)
+            if flow.totalPackets > 0:
+                flow.showStats()
+        if flow.transfer is not None and transfers.get(flow.transfer.transferId) is flow:
+            flow.save_checkpoint()
+            del transfers[flow.transfer.transferId]
+        if flow.group is not None:
+            flow.group.numFlows = flow.group.numFlows - 1
+            if flow.group.numFlows == 0:
+                groups.pop((flow.group.host, flow.group.group))
+                if verbose >= 1:
+                    flow.group.showStats()
+
+# bytes and packets per second over every flow, how long the server's receive
+# loop takes over each batch of packets (in seconds), and how many packets
+# are in each batch, for /metrics
+rates = metrics.RateWindow()
+loopLatency = metrics.Histogram([0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                                 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1])
+batchSizes = metrics.Histogram([1, 2, 4, 8, 16, 32, 64, 128])
+
+# server.py sets this to its sharedstats.SharedStats when it runs several
+# worker processes, so /metrics can show the totals for all of them
+sharedStats = None
+
+# rates are reported averaged over each of these windows, in seconds
+rateWindows = [1, 10, 60]
+
+# The totals above, plus flow counts and the number of packets the active
+# flows are still missing, in a dict (see sharedstats.py). The HTTP server's
+# thread calls this while flows come and go, hence the copy of flows.
+def totals():
+    return {"totalBytes": totalBytes, "totalPackets": totalPackets,
+            "uniquePackets": uniquePackets, "duplicatePackets": duplicatePackets,
+            "misorderedPackets": misorderedPackets, "activeFlows": len(flows),
+            "totalFlows": nextFlowId,
+            "missingPackets": sum(flow.received.missing() for flow in list(flows.values()))}
+
+# deliver() hands a packet to the flow it belongs to. Code that only ever deals
+# with one client can leave out addr and session.
+def deliver(seqno, payload, addr=("", 0), session=0):
+    return get_flow(addr, session).deliver(seqno, payload)
 
 
 # The rest of this file is for printing statistics, sending data to a web
@@ -109,48 +652,179 @@ def kb(n):
         return "%0.2f GB" % (n/1024.0/1024.0/1024.0)
 
 def showStats():
-    global startTime, highestSeqno, expectedSeqno, totalBytes, totalPackets, uniquePackets, duplicatePackets, misorderedPackets
-
-    totalTime = (endTime - startTime)
-    bytesPerSecond = totalBytes / totalTime
-    missingPackets = highestSeqno+1 - uniquePackets
-    if shortStats:
-        print("elapsed time %0.3f s, total received %s, throughput %s" %
-                (totalTime, kb(totalBytes), kb(bytesPerSecond)+"ps"))
-        print("  %d packets, %d unique, %d duplicate, %d misordered, %d missing" %
-                (totalPackets, uniquePackets, duplicatePackets,
-                misorderedPackets, missingPackets))
-    else:
-        print("  Elapsed time: %0.3f s" % (totalTime))
-        print("  Total Packets: %d" % (totalPackets))
-        print("  Unique Packets: %d" % (uniquePackets))
-        print("  Missing packets: %d" % (missingPackets))
-        print("  Duplicate packets: %d" % (duplicatePackets))
-        print("  Out-of-order packets: %d" % (misorderedPackets))
-        print("  Data: %s" % (kb(totalBytes)))
-        print("  Throughput: %s" % (kb(bytesPerSecond)+"ps"))
-
-
-# A list tracking how many times each seqno has been received.
-# Anything over 180,000 is ignored.
-seqno_count = [0] * 180000
-
-def mark_as_received(seqno):
-    global seqno_count
-    if seqno < 0 or seqno >= 180000:
-        return 1
-    n = seqno_count[seqno] = seqno_count[seqno] + 1
-    return n
-
-def count_times_received(seqno):
-    global seqno_count
-    if seqno < 0 or seqno >= 180000:
-        return
-    return seqno_count[seqno]
-    return n
-
-# A queue of recent (seqno, packet) data, to be sent to browser for display.
+    for flow in list(flows.values()):
+        if flow.totalPackets > 0:
+            flow.showStats()
+    for g in list(groups.values()):
+        g.showStats()
+    if len(flows) > 1:
+        log("%d flows, %d packets, %s in total", len(flows), totalPackets, kb(totalBytes))
+    flush_log()
+
+# Messages about packets are not printed by the thread receiving them, which
+# could get stuck behind a slow terminal. Instead, log() puts the format and
+# arguments into a bounded ring (see ring.py), and a printer thread formats
+# and prints them. If the printer falls behind, messages are dropped, and it
+# says how many.
+logRing = ring.Ring(65536)
+printer = None
+
+def log(fmt, *args):
+    global printer
+    if printer is None:
+        printer = threading.Thread(target=print_log, args=())
+        printer.daemon = True
+        printer.start()
+    logRing.put((fmt, args))
+
+def print_log():
+    dropped = 0
+    while True:
+        lines = []
+        for (fmt, args) in logRing.wait_batch(1024):
+            lines.append(fmt % args if args else fmt)
+        if logRing.numDropped > dropped:
+            lines.append("  (%d messages dropped)" % (logRing.numDropped - dropped))
+            dropped = logRing.numDropped
+        lines.append("")
+        sys.stdout.write("\n".join(lines))
+        sys.stdout.flush()
+
+# Wait for everything logged so far to be printed.
+def flush_log():
+    if printer is not None:
+        logRing.drain()
+        sys.stdout.flush()
+
+# Recent packets, to be sent to the browser for display, in a bounded ring
+# (see ring.py) so a slow browser can't hold up the receive loop or use up
+# memory. If the browser falls behind, whole frames of rowsPerFrame packets
+# are dropped.
+#
+# With streamMode = "rows", each packet is sent to the browser as a message of
+# its own, its 4-byte seqno followed by the payload, which is what the viewer
+# (index.html) expects. Setting rowsPerMessage sends up to that many packets
+# per message instead, each as an 8-byte header (seqno, payload length)
+# followed by the payload, which takes far fewer messages but needs a viewer
+# that knows the format. With streamMode = "frames", rows are put back
+# together into whole frames first, and the browser gets one message per
+# frame, at most maxFrameRate frames per second (None for no limit), shrunk
+# by a factor of downsample and encoded with frameEncoding (see frames.py);
+# that too needs a viewer that can decode it, so it's only used if asked for.
 recentPackets = None
+recentCapacity = 4096
+rowsPerFrame = 360 # the height of the images (see datasource.py)
+rowsPerMessage = None
+streamMode = "rows"
+maxFrameRate = 30
+downsample = 1
+frameEncoding = "delta"
+frameDeadline = 0.5
+
+# The statistics for /stats.json, as a dict. This runs in the HTTP server's
+# thread while the receive loop carries on, so the numbers for different flows
+# may be a packet or two apart.
+def snapshot():
+    now = time.time()
+    stats = {"time": now, "totals": totals(), "rates": rates_dict(rates, now),
+             "loopLatency": loopLatency.as_dict(), "batchSize": batchSizes.as_dict(),
+             "flows": [], "parallelTransfers": []}
+    for flow in list(flows.values()):
+        f = {"flow": flow.flowid, "client": "%s:%d" % (flow.addr[0], flow.addr[1]),
+             "session": "0x%06x" % (flow.session),
+             "totalBytes": flow.totalBytes, "totalPackets": flow.totalPackets,
+             "uniquePackets": flow.uniquePackets, "duplicatePackets": flow.duplicatePackets,
+             "misorderedPackets": flow.misorderedPackets,
+             "missingPackets": flow.received.missing(),
+             "reorderDepth": flow.reorder.depth, "delivered": flow.reorder.numReleased,
+             "givenUp": flow.reorder.numSkipped,
+             "rates": rates_dict(flow.rates, now)}
+        if flow.group is not None:
+            f["parallelTransfer"] = "0x%04x" % (flow.group.group)
+            f["shard"] = flow.shard
+        if flow.transfer is not None:
+            f["transfer"] = "0x%08x" % (flow.transfer.transferId)
+            f["transferPackets"] = flow.transfer.numPackets
+        if flow.fec is not None:
+            f["parityPackets"] = flow.fec.numParity
+            f["rebuiltPackets"] = flow.fec.numRebuilt
+        if flow.codec is not None:
+            f["decodedPayloads"] = flow.codec.numDecoded
+            f["decodedBytes"] = flow.codec.bytesOut
+            f["undecodablePayloads"] = flow.codec.numFailed
+        stats["flows"].append(f)
+    for g in list(groups.values()):
+        stats["parallelTransfers"].append({"group": "0x%04x" % (g.group), "client": g.host,
+             "shards": g.numShards, "reorderDepth": g.reorder.depth,
+             "delivered": g.reorder.numReleased, "givenUp": g.reorder.numSkipped})
+    if sharedStats is not None:
+        stats["allWorkers"] = sharedStats.totals()
+    return stats
+
+def rates_dict(window, now):
+    r = {}
+    for seconds in rateWindows:
+        (bytesPerSecond, packetsPerSecond) = window.rates(now, seconds)
+        r["%ds" % (seconds)] = {"bytesPerSecond": bytesPerSecond, "packetsPerSecond": packetsPerSecond}
+    return r
+
+# The same statistics, for /metrics.
+def prometheus_metrics():
+    stats = snapshot()
+    page = metrics.PrometheusText("udpstream_")
+    t = stats["totals"]
+    page.add("received_bytes_total", "counter", "Payload bytes received.", t["totalBytes"])
+    page.add("received_packets_total", "counter", "Data packets received.", t["totalPackets"])
+    page.add("unique_packets_total", "counter", "Data packets received for the first time.", t["uniquePackets"])
+    page.add("duplicate_packets_total", "counter", "Data packets received more than once.", t["duplicatePackets"])
+    page.add("misordered_packets_total", "counter", "Data packets received out of order.", t["misorderedPackets"])
+    page.add("missing_packets", "gauge", "Holes in what the active flows have received.", t["missingPackets"])
+    page.add("active_flows", "gauge", "Flows currently being received.", t["activeFlows"])
+    page.add("flows_total", "counter", "Flows seen since the server started.", t["totalFlows"])
+    page.add("received_bytes_per_second", "gauge", "Payload bytes per second, averaged over a window.",
+            [({"window": w}, r["bytesPerSecond"]) for (w, r) in stats["rates"].items()])
+    page.add("received_packets_per_second", "gauge", "Data packets per second, averaged over a window.",
+            [({"window": w}, r["packetsPerSecond"]) for (w, r) in stats["rates"].items()])
+    page.add_histogram("loop_latency_seconds", "Time the receive loop spends on each batch of packets.", loopLatency)
+    page.add_histogram("batch_packets", "Packets taken off the socket per wakeup.", batchSizes)
+
+    def per_flow(name, kind, help, key):
+        page.add(name, kind, help, [(flow_labels(f), f[key]) for f in stats["flows"] if key in f])
+    per_flow("flow_received_bytes_total", "counter", "Payload bytes received, per flow.", "totalBytes")
+    per_flow("flow_received_packets_total", "counter", "Data packets received, per flow.", "totalPackets")
+    per_flow("flow_unique_packets_total", "counter", "Data packets received for the first time, per flow.", "uniquePackets")
+    per_flow("flow_duplicate_packets_total", "counter", "Data packets received more than once, per flow.", "duplicatePackets")
+    per_flow("flow_misordered_packets_total", "counter", "Data packets received out of order, per flow.", "misorderedPackets")
+    per_flow("flow_missing_packets", "gauge", "Holes in what the flow has received.", "missingPackets")
+    per_flow("flow_reorder_depth", "gauge", "Packets waiting in the flow's reorder buffer for a hole to fill.", "reorderDepth")
+    per_flow("flow_delivered_packets_total", "counter", "Packets released in order, per flow.", "delivered")
+    per_flow("flow_given_up_packets_total", "counter", "Holes the flow's reorder buffer gave up on.", "givenUp")
+    per_flow("flow_parity_packets_total", "counter", "Parity packets received, per flow.", "parityPackets")
+    per_flow("flow_rebuilt_packets_total", "counter", "Packets rebuilt from parity, per flow.", "rebuiltPackets")
+    per_flow("flow_undecodable_payloads_total", "counter", "Encoded payloads that could not be decoded, per flow.", "undecodablePayloads")
+    page.add("flow_received_bytes_per_second", "gauge", "Payload bytes per second per flow, averaged over a window.",
+            [(dict(flow_labels(f), window=w), r["bytesPerSecond"]) for f in stats["flows"] for (w, r) in f["rates"].items()])
+    page.add("flow_received_packets_per_second", "gauge", "Data packets per second per flow, averaged over a window.",
+            [(dict(flow_labels(f), window=w), r["packetsPerSecond"]) for f in stats["flows"] for (w, r) in f["rates"].items()])
+
+    def per_group(name, kind, help, key):
+        page.add(name, kind, help, [({"group": g["group"], "client": g["client"]}, g[key])
+                                    for g in stats["parallelTransfers"]])
+    per_group("parallel_delivered_packets_total", "counter", "Packets of a parallel transfer released in order.", "delivered")
+    per_group("parallel_reorder_depth", "gauge", "Packets of a parallel transfer waiting for another shard.", "reorderDepth")
+    per_group("parallel_given_up_packets_total", "counter", "Holes a parallel transfer's reorder buffer gave up on.", "givenUp")
+
+    if "allWorkers" in stats:
+        w = stats["allWorkers"]
+        page.add("all_workers_received_bytes_total", "counter", "Payload bytes received by every worker.", w["totalBytes"])
+        page.add("all_workers_received_packets_total", "counter", "Data packets received by every worker.", w["totalPackets"])
+        page.add("all_workers_unique_packets_total", "counter", "Unique data packets received by every worker.", w["uniquePackets"])
+        page.add("all_workers_duplicate_packets_total", "counter", "Duplicate data packets received by every worker.", w["duplicatePackets"])
+        page.add("all_workers_active_flows", "gauge", "Flows currently being received by every worker.", w["activeFlows"])
+    return page.text()
+
+def flow_labels(f):
+    return {"flow": f["flow"], "client": f["client"], "session": f["session"]}
 
 class HTTPHandler(http.server.SimpleHTTPRequestHandler):
 
@@ -160,9 +834,20 @@ class HTTPHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
         if self.path == "/" or self.path == "/index.html":
             self.do_GET_Index()
+        elif self.path == "/metrics":
+            self.send_body(prometheus_metrics().encode(), "text/plain; version=0.0.4")
+        elif self.path == "/stats.json":
+            self.send_body(json.dumps(snapshot()).encode(), "application/json")
         else:
             http.server.SimpleHTTPRequestHandler.do_GET(self)
 
+    def send_body(self, body, contentType):
+        self.send_response(200)
+        self.send_header("Content-type", contentType)
+        self.send_header("Content-length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_GET_Index(self):
         self.send_response(200)
         self.send_header("Content-type", "text/html")
@@ -172,14 +857,42 @@ class HTTPHandler(http.server.SimpleHTTPRequestHandler):
 
 def handle_websocket_connection(ws):
     global recentPackets
-    recentPackets = Queue()
+    packets = ring.PacketRing(recentCapacity, maxPayload, rowsPerFrame)
+    recentPackets = packets
     ws.send_message("welcome")
-    while True:
-        (seqno, payload) = recentPackets.get(True)
-        hdr = bytearray(struct.pack(">I", seqno))
-        # ws.send_message(hdr)
-        ws.send_message(hdr + payload)
-        # recentPackets.task_done()
+    if streamMode == "frames":
+        stream_frames(ws, packets)
+        return
+    # a newer browser connection takes over the ring
+    while recentPackets is packets:
+        if rowsPerMessage is None:
+            send = lambda seqno, payload: ws.send_message(struct.pack(">I", seqno) + payload)
+            if packets.get_each(send, rowsPerFrame) == 0:
+                time.sleep(ring.pollInterval)
+            continue
+        msg = bytearray()
+        if packets.get_into(msg, rowsPerMessage) == 0:
+            time.sleep(ring.pollInterval)
+            continue
+        ws.send_message(msg)
+
+def stream_frames(ws, packets):
+    encoder = frames.FrameEncoder(frameEncoding)
+    lastSent = [0.0]
+
+    def send_frame(frame, pixels, complete):
+        now = time.time()
+        if maxFrameRate is not None and now - lastSent[0] < 1.0 / maxFrameRate:
+            return # too soon after the last one, skip it
+        lastSent[0] = now
+        ws.send_message(encoder.encode(frame, pixels, assembler.width(), assembler.height(), complete))
+
+    assembler = frames.FrameAssembler(rowsPerFrame, send_frame, downsample, frameDeadline)
+    while recentPackets is packets:
+        now = time.time()
+        if packets.get_each(lambda seqno, payload: assembler.add(seqno, payload, now), rowsPerFrame) == 0:
+            assembler.expire(now)
+            time.sleep(ring.pollInterval)
 
 class WSHandler(WebSocket):
 
@@ -264,7 +977,8 @@ def init(host):
 
     def signal_handler(signal, frame):
         print("Exiting...")
-        if totalPackets > 1:
+        save_checkpoints()
+        if totalPackets > 0:
             showStats()
         trace.close()
         sys.exit(0)
@@ -12,10 +12,37 @@
 # by one more image, so in all we have:
 #    500 images * 360 packets per image = 180,000 packets
 #    180,000 packets * 1440 bytes per packet = about 260 MB
+#
+# Rendering packets from the images and video is slow, and loading the video
+# takes most of a minute. So there's also an offline build step that renders
+# every packet, once, into a single binary file (the "packet store"):
+#   python3 datasource.py --build /var/streaming/packets.bin
+# The file starts with a small header:
+#    8 bytes   b"PKTSTORE"
+#    4 bytes   number of packets
+#    4 bytes   bytes per packet
+#    4 bytes   offset of the first packet
+# followed by all the packets, back to back, in seqno order. If the store
+# exists, we map it into memory with mmap instead of loading the images and
+# video, and wait_for_data() just returns a memoryview slice of it, without
+# copying anything.
+#
+# Without a packet store, nothing is loaded when this file is imported.
+# Instead each image, and each short run of video frames, is decoded the first
+# time a seqno inside it is asked for. Decoded frames are kept in a
+# least-recently-used cache, and the oldest ones are thrown away once the cache
+# holds more than cacheBudget bytes. Set lazy = False (or call
+# load_example_data()) to decode everything up front instead.
+#
+# Setting synthetic = True makes up the data instead: color bars that slide
+# sideways a little every frame, with a box moving across them. It looks
+# enough like the real thing to test with, and needs no files at all.
 
-from PIL import Image
-import imageio
+from collections import OrderedDict
+import mmap
+import os
 import signal
+import struct
 import sys
 import trace
 
@@ -24,78 +51,221 @@ height = 360
 numFrames = 500
 
 numPackets = numFrames * height # 180000
+packetSize = width * 3 # 1440
+
+# setting storefile = None disables the packet store
+storefile = "/var/streaming/packets.bin"
+
+storeMagic = b"PKTSTORE"
+storeHeader = ">8sIII"
+storeAlign = 4096
+
+# setting lazy = False loads all the example data when this file is imported
+lazy = True
+
+# setting synthetic = True makes up the data instead of using the images and
+# video (see synthetic_packet())
+synthetic = False
+
+# most memory, in bytes, to spend on decoded frames (None means no limit)
+cacheBudget = 64 * 1024 * 1024
+
+# number of video frames to decode at once when one of them is needed
+chunkFrames = 8
+
+# where each frame comes from: frames 0-2 and the last frame are images, and
+# everything in between is from the video (skipping its first 20 frames)
+imageFiles = {
+    0: "/var/streaming/colorbars3.png",
+    1: "/var/streaming/colorbars2.png",
+    2: "/var/streaming/colorbars1.png",
+    numFrames-1: "/var/streaming/done.png",
+}
+videoFile = "/var/streaming/video.mp4"
+videoSkip = 20
 
 # This function returns example payload data for a given sequence number.
 def wait_for_data(seqno):
     if seqno < 0:
         raise Exception("Oops, seqno %s is negative!" % (str(seqno)))
-    print("seqno is", seqno)
-    f = seqno // height;
-    y = seqno % height;
-    if f == 0:
-        return get_image_packet(img3, y)
-    elif f == 1:
-        return get_image_packet(img2, y)
-    elif f == 2:
-        return get_image_packet(img1, y)
-    elif f < numFrames-1:
-        return get_video_packet(vid, f, y)
-    else:
-        return get_image_packet(img0, y)
+    if synthetic:
+        return synthetic_packet(seqno)
+    if store is not None:
+        if seqno >= numPackets:
+            # past the end, every packet is the last image, just like below
+            seqno = (numFrames-1) * height + seqno % height
+        off = storeOffset + seqno * packetSize
+        return store[off:off+packetSize]
+    return render_packet(seqno)
+
+# This function generates the payload data for a given sequence number from
+# the example images and video.
+def render_packet(seqno):
+    f = min(seqno // height, numFrames-1)
+    y = seqno % height
+    frame = get_frame(f)
+    return bytearray(frame[y*packetSize:(y+1)*packetSize])
+
+# This function makes up the payload data for a given sequence number.
+barColors = [(192, 192, 192), (192, 192, 0), (0, 192, 192), (0, 192, 0),
+             (192, 0, 192), (192, 0, 0), (0, 0, 192), (16, 16, 16)]
+boxSize = 40
+
+def synthetic_packet(seqno):
+    f = min(seqno // height, numFrames-1)
+    y = seqno % height
+    shade = 256 - (y * 128) // height
+    barWidth = width // len(barColors)
+    row = bytearray()
+    for (r, g, b) in barColors:
+        row += bytes(((r * shade) >> 8, (g * shade) >> 8, (b * shade) >> 8)) * barWidth
+    row += bytes(3 * (width - len(row) // 3))
+    shift = 3 * ((4 * f) % width)
+    row = row[shift:] + row[:shift]
+    boxX = (7 * f) % (width - boxSize)
+    boxY = (3 * f) % (height - boxSize)
+    if boxY <= y < boxY + boxSize:
+        row[3 * boxX:3 * (boxX + boxSize)] = b"\xff" * (3 * boxSize)
+    return row
 
 # If the program is ever killed using Control-C, save the trace before quitting.
+# The clients call this; just importing this file doesn't.
 def signal_handler(signal, frame):
     print("Exiting...")
     trace.close()
     sys.exit(0)
-signal.signal(signal.SIGINT, signal_handler)
+
+def install_signal_handler():
+    signal.signal(signal.SIGINT, signal_handler)
 
 
-# The remainder of this file is used to generate the example data.
+# The packet store.
+
+store = None
+storeOffset = 0
+storeMap = None
+
+def open_store(filename):
+    global store, storeOffset, storeMap
+    with open(filename, "rb") as f:
+        storeMap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, count, size, offset) = struct.unpack_from(storeHeader, storeMap, 0)
+    if magic != storeMagic or count != numPackets or size != packetSize:
+        storeMap.close()
+        storeMap = None
+        raise Exception("Oops, %s is not a packet store for this data (try rebuilding it)" % (filename))
+    store = memoryview(storeMap)
+    storeOffset = offset
+
+def close_store():
+    global store, storeMap
+    if store is not None:
+        store.release()
+        store = None
+        storeMap.close()
+        storeMap = None
+
+def build_store(filename):
+    offset = storeAlign
+    tmpname = filename + ".tmp"
+    with open(tmpname, "wb") as f:
+        hdr = bytearray(offset)
+        struct.pack_into(storeHeader, hdr, 0, storeMagic, numPackets, packetSize, offset)
+        f.write(hdr)
+        for seqno in range(numPackets):
+            f.write(render_packet(seqno))
+            if seqno % 10000 == 0:
+                print("  rendered %d of %d packets" % (seqno, numPackets))
+    os.replace(tmpname, filename)
+
+
+# The remainder of this file is used to generate the example data. Images and
+# video frames are both kept as raw RGB bytes, 3 bytes per pixel, one row
+# after another, so a packet is just a slice of a frame.
+
+frameCache = OrderedDict()   # frame number -> bytes, least recently used first
+cacheBytes = 0
+numDecoded = 0
+
+videoReader = None
+
+# Returns the raw RGB data for frame f, decoding it if needed. Video frames
+# are decoded chunkFrames at a time, or as many as fit in cacheBudget.
+def get_frame(f):
+    data = frameCache.get(f)
+    if data is not None:
+        frameCache.move_to_end(f)
+        return data
+    if f in imageFiles:
+        data = load_image(imageFiles[f])
+        cache_frame(f, data)
+        return data
+    data = load_video_frame(f)
+    cache_frame(f, data)
+    n = chunkFrames
+    if cacheBudget is not None:
+        n = max(1, min(n, cacheBudget // (packetSize * height)))
+    for g in range(f + 1, min(f + n, numFrames)):
+        if g not in frameCache and g not in imageFiles:
+            cache_frame(g, load_video_frame(g), f)
+    return data
+
+# Add frame f to the cache, throwing the oldest frames out if it's over
+# budget, but never frame keep (the one that was asked for).
+def cache_frame(f, data, keep=None):
+    global cacheBytes, numDecoded
+    frameCache[f] = data
+    cacheBytes = cacheBytes + len(data)
+    numDecoded = numDecoded + 1
+    while cacheBudget is not None and cacheBytes > cacheBudget and len(frameCache) > 1:
+        g = next(iter(frameCache))
+        if g == keep:
+            frameCache.move_to_end(g)
+            continue
+        old = frameCache.pop(g)
+        cacheBytes = cacheBytes - len(old)
 
 def load_image(filename):
+    from PIL import Image
     im = Image.open(filename)
-    return im.load()
+    return im.convert("RGB").tobytes()
 
-def get_image_packet(img, y):
-    row = [img[x,y] for x in range(width)]
-    return bytearray(sum(row, ()))
+def load_video_frame(f):
+    global videoReader
+    if videoReader is None:
+        import imageio
+        videoReader = imageio.get_reader(videoFile, 'ffmpeg')
+    # Reading frames in order is cheap, jumping around means seeking.
+    return videoReader.get_data(videoSkip + f).tobytes()
 
-def load_video(filename):
-    vid = imageio.get_reader(filename,  'ffmpeg')
-    frames = []
-    for i, img in enumerate(vid):
-        if i < 20:
-            continue
-        if i > 20+numFrames:
-            break
-        frames.append(img.tostring())
-    return frames
-
-def get_video_packet(vid, f, y):
-    print(f)
-    data = vid[f]
-    return bytearray(data[y*width*3:(y+1)*width*3])
-
-print("Loading example data...")
-img3 = load_image("/var/streaming/colorbars3.png")
-img2 = load_image("/var/streaming/colorbars2.png")
-img1 = load_image("/var/streaming/colorbars1.png")
-vid = load_video("/var/streaming/video.mp4")
-img0 = load_image("/var/streaming/done.png")
-# the next few lines ensure the data is ready to go
-get_image_packet(img3, 0)
-get_image_packet(img2, 0)
-get_image_packet(img1, 0)
-get_video_packet(vid, 0, 0)
-get_image_packet(img0, 0)
-print("... example data is ready to send")
+# Decode everything now, rather than as it's needed.
+def load_example_data():
+    global cacheBudget
+    print("Loading example data...")
+    cacheBudget = None
+    for f in range(numFrames):
+        get_frame(f)
+    print("... example data is ready to send")
+
+if storefile is not None and os.path.exists(storefile):
+    open_store(storefile)
+    print("Using packet store %s" % (storefile))
+elif not lazy:
+    load_example_data()
 
 if __name__ == "__main__":
     if len(sys.argv) == 1:
         print("There are %d packets of data to be sent, taken from %d images." % (numPackets, numFrames))
         print("You can see info about packets. For example, to see info about packet 0, run:")
         print("   python datasource.py 0")
+        print("To render all the packets into a packet store, run:")
+        print("   python datasource.py --build %s" % (storefile))
+    if len(sys.argv) == 3 and sys.argv[1] == "--build":
+        close_store()
+        print("Building packet store %s..." % (sys.argv[2]))
+        build_store(sys.argv[2])
+        print("... done, %d packets of %d bytes" % (numPackets, packetSize))
+        sys.exit(0)
     for seqno in [int(arg) for arg in sys.argv[1:]]:
         pkt = wait_for_data(seqno)
         print("Packet with seqno=%d contains %d bytes" % (seqno, len(pkt)))
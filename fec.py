@@ -0,0 +1,149 @@
+# Forward error correction: the client sends a little extra parity data along
+# with each group of packets, so the server can rebuild a lost packet itself,
+# instead of waiting a whole round trip (or a whole RTO) for it to be resent.
+#
+# Data packets are split into groups of groupSize consecutive seqnos, starting
+# at multiples of groupSize. Each group is covered by parityCount parity
+# packets: parity packet j is the XOR of the payloads of the packets in the
+# group whose position in the group is j modulo parityCount. Any one missing
+# packet of those can be rebuilt by XORing the parity with the rest of them.
+# So a group can recover from up to parityCount lost packets, as long as they
+# are at different positions modulo parityCount, which covers a burst of up to
+# parityCount packets in a row. (This is a simple, interleaved, form of what a
+# Reed-Solomon code would do, but costs nothing more than XOR.)
+#
+# A parity packet is the usual header, with type protocol.parityType and the
+# first seqno of the group as its seqno, then a parityHeader and the XOR of the
+# payloads, with shorter payloads padded with zeros.
+
+import struct
+import protocol
+
+# packets in the group, parity count, which parity this is, XOR of the payload
+# lengths of the packets it covers
+parityHeader = struct.Struct(">HBBH")
+
+class FecEncoder:
+
+    # magic is the magic word to put in parity packets.
+    def __init__(self, groupSize, parityCount, magic):
+        self.groupSize = groupSize
+        self.parityCount = parityCount
+        self.magic = magic
+        self.start = None
+        self.count = 0
+        self.xors = [0] * parityCount
+        self.lenXors = [0] * parityCount
+        self.maxLens = [0] * parityCount
+        self.numParity = 0
+
+    # Add a newly sent data packet to its group. Returns a list of parity
+    # packets to send, which is empty until the group is complete.
+    def add(self, seqno, payload):
+        start = seqno - seqno % self.groupSize
+        parity = []
+        if start != self.start:
+            parity = self.flush()
+            self.start = start
+        j = (seqno - start) % self.parityCount
+        self.xors[j] = self.xors[j] ^ int.from_bytes(payload, "little")
+        self.lenXors[j] = self.lenXors[j] ^ len(payload)
+        self.maxLens[j] = max(self.maxLens[j], len(payload))
+        self.count = self.count + 1
+        if self.count == self.groupSize:
+            parity.extend(self.flush())
+        return parity
+
+    # Returns the parity packets for the group so far, even if it isn't
+    # complete (at the end of a transfer, say), and starts a new group.
+    def flush(self):
+        parity = []
+        if self.count > 0:
+            for j in range(min(self.parityCount, self.count)):
+                hdr = struct.pack(protocol.hdrFormat, self.magic, self.start & 0xFFFFFFFF)
+                hdr = hdr + parityHeader.pack(self.count, self.parityCount, j, self.lenXors[j])
+                parity.append(hdr + self.xors[j].to_bytes(self.maxLens[j], "little"))
+            self.numParity = self.numParity + len(parity)
+        self.start = None
+        self.count = 0
+        self.xors = [0] * self.parityCount
+        self.lenXors = [0] * self.parityCount
+        self.maxLens = [0] * self.parityCount
+        return parity
+
+class FecDecoder:
+
+    # Keeps copies of the last capacity payloads received (each up to slotSize
+    # bytes), in slot seqno % capacity, for rebuilding lost packets, along with
+    # up to maxPending parity packets that can't be used yet.
+    def __init__(self, capacity, slotSize, maxPending=256):
+        self.capacity = capacity
+        self.slotSize = slotSize
+        self.maxPending = maxPending
+        self.slab = bytearray(capacity * slotSize)
+        self.view = memoryview(self.slab)
+        self.slotSeqno = [-1] * capacity
+        self.slotLen = [0] * capacity
+        self.pending = {}       # (group start, j) -> (count, parityCount, lenXor, xor)
+        self.groupSize = None   # learned from the parity packets
+        self.parityCount = None
+        self.numParity = 0
+        self.numRebuilt = 0
+
+    # Note a newly arrived data packet. received is the flow's ReceivedSet.
+    # Returns a list of (seqno, payload) packets that can now be rebuilt.
+    def data(self, seqno, payload, received):
+        if len(payload) <= self.slotSize:
+            slot = seqno % self.capacity
+            off = slot * self.slotSize
+            self.slab[off:off + len(payload)] = payload
+            self.slotSeqno[slot] = seqno
+            self.slotLen[slot] = len(payload)
+        if not self.pending or self.groupSize is None:
+            return []
+        start = seqno - seqno % self.groupSize
+        key = (start, (seqno - start) % self.parityCount)
+        if key not in self.pending:
+            return []
+        return self.rebuild(key[0], key[1], received)
+
+    # Note a parity packet for the group starting at seqno. Returns a list of
+    # (seqno, payload) packets that can now be rebuilt.
+    def parity(self, seqno, packet, received):
+        if len(packet) < parityHeader.size:
+            return []
+        (count, parityCount, j, lenXor) = parityHeader.unpack_from(packet, 0)
+        if count == 0 or parityCount == 0 or lenXor > self.slotSize:
+            return []
+        self.numParity = self.numParity + 1
+        self.groupSize = max(self.groupSize or 0, count)
+        self.parityCount = parityCount
+        xor = int.from_bytes(packet[parityHeader.size:], "little")
+        self.pending[(seqno, j)] = (count, parityCount, lenXor, xor)
+        if len(self.pending) > self.maxPending:
+            del self.pending[next(iter(self.pending))]
+        return self.rebuild(seqno, j, received)
+
+    # Try to use the parity for (start, j). It is thrown away once it's done
+    # its job, or can never do it.
+    def rebuild(self, start, j, received):
+        (count, parityCount, lenXor, xor) = self.pending[(start, j)]
+        members = range(start + j, start + count, parityCount)
+        missing = [seqno for seqno in members if received.count(seqno) == 0]
+        if len(missing) != 1:
+            if not missing:
+                del self.pending[(start, j)]
+            return []
+        for seqno in members:
+            if seqno == missing[0]:
+                continue
+            slot = seqno % self.capacity
+            if self.slotSeqno[slot] != seqno:
+                del self.pending[(start, j)] # we've already forgotten this one
+                return []
+            off = slot * self.slotSize
+            xor = xor ^ int.from_bytes(self.view[off:off + self.slotLen[slot]], "little")
+            lenXor = lenXor ^ self.slotLen[slot]
+        del self.pending[(start, j)]
+        self.numRebuilt = self.numRebuilt + 1
+        return [(missing[0], xor.to_bytes(lenXor, "little"))]
@@ -0,0 +1,140 @@
+# Puts rows back together into whole frames for the web view, and encodes them
+# for sending to the browser.
+#
+# Each packet carries one row of one frame: packet seqno is row
+# seqno % rowsPerFrame of frame seqno // rowsPerFrame (see datasource.py).
+# Sending the browser one message per row means hundreds of thousands of tiny
+# messages, so instead FrameAssembler copies rows into a frame buffer, and a
+# frame is sent once all its rows are in, or once it has waited for
+# frameDeadline seconds, or once a row of a later frame shows up. A partial
+# frame still has the rows from earlier frames in place of the missing ones,
+# so the browser just sees a few stale rows.
+#
+# The frame can be shrunk by a factor of downsample in each direction, keeping
+# every downsample'th pixel of every downsample'th row.
+#
+# Each frame goes to the browser as one message: a frameHeader followed by the
+# pixels (RGB, top row first), encoded as one of:
+#   raw     the pixels as they are
+#   zlib    the pixels, zlib-compressed
+#   delta   the pixels XORed with the previous frame sent, zlib-compressed;
+#           unchanged parts of the picture become runs of zeros, which
+#           compress to almost nothing
+
+import struct
+import zlib
+
+# frame number, width, height, encoding, flags
+frameHeader = struct.Struct(">IHHBB")
+
+encodings = {"raw": 0, "zlib": 1, "delta": 2}
+flagComplete = 0x1      # every row of the frame arrived
+flagKeyFrame = 0x2      # a delta frame that doesn't depend on the one before
+
+class FrameAssembler:
+
+    # Each frame is handed over as consumer(frame number, pixels, complete) as
+    # soon as it is finished. The pixels are reused for the next frame once
+    # the call returns.
+    def __init__(self, rowsPerFrame, consumer, downsample=1, frameDeadline=0.5):
+        self.consumer = consumer
+        self.rowsPerFrame = rowsPerFrame
+        self.downsample = downsample
+        self.frameDeadline = frameDeadline
+        self.rowBytes = None    # bytes per (downsampled) row, set by the first row
+        self.pixels = None
+        self.frame = None       # frame being assembled
+        self.lastFrame = -1     # the last frame handed over
+        self.rows = 0           # rows of it seen so far
+        self.rowsNeeded = (rowsPerFrame + downsample - 1) // downsample
+        self.started = None     # when its first row arrived
+        self.numComplete = 0
+        self.numPartial = 0
+
+    # Add one row, at time t.
+    def add(self, seqno, payload, t):
+        frame = seqno // self.rowsPerFrame
+        row = seqno % self.rowsPerFrame
+        if frame <= self.lastFrame:
+            return # a late row of a frame that's already gone
+        if self.frame is not None and frame != self.frame:
+            self.finish(False)
+        if self.frame is None:
+            self.frame = frame
+            self.rows = 0
+            self.started = t
+        if row % self.downsample != 0:
+            return
+        if self.pixels is None:
+            width = len(payload) // 3
+            self.rowBytes = ((width + self.downsample - 1) // self.downsample) * 3
+            self.pixels = bytearray(self.rowBytes * self.rowsNeeded)
+        off = (row // self.downsample) * self.rowBytes
+        k = self.downsample
+        if k == 1:
+            self.pixels[off:off + len(payload)] = payload
+        else:
+            n = len(payload) // 3
+            m = (n + k - 1) // k
+            for c in range(3):
+                self.pixels[off + c:off + 3 * m:3] = payload[c:3 * n:3 * k]
+        self.rows = self.rows + 1
+        if self.rows == self.rowsNeeded:
+            self.finish(True)
+
+    # Give up waiting for the rest of the current frame, if it has been waiting
+    # too long, and hand over what there is of it.
+    def expire(self, t):
+        if self.frame is not None and t - self.started >= self.frameDeadline:
+            self.finish(False)
+
+    def finish(self, complete):
+        frame = self.frame
+        self.frame = None
+        self.lastFrame = frame
+        if self.pixels is None:
+            return # no rows yet, not even to size the frame
+        if complete:
+            self.numComplete = self.numComplete + 1
+        else:
+            self.numPartial = self.numPartial + 1
+        self.consumer(frame, self.pixels, complete)
+
+    def width(self):
+        return self.rowBytes // 3
+
+    def height(self):
+        return self.rowsNeeded
+
+class FrameEncoder:
+
+    # A delta frame is sent as a key frame (compared against black) every
+    # keyInterval frames, so a browser that connects late, or misses a message,
+    # soon gets a whole picture.
+    def __init__(self, encoding="delta", level=1, keyInterval=30):
+        self.encoding = encodings[encoding]
+        self.level = level
+        self.keyInterval = keyInterval
+        self.previous = None
+        self.numSent = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    # Returns the message for a frame, header included.
+    def encode(self, frame, pixels, width, height, complete):
+        flags = flagComplete if complete else 0
+        if self.encoding == encodings["raw"]:
+            data = bytes(pixels)
+        elif self.encoding == encodings["zlib"]:
+            data = zlib.compress(pixels, self.level)
+        else:
+            if self.previous is None or len(self.previous) != len(pixels) or self.numSent % self.keyInterval == 0:
+                self.previous = bytearray(len(pixels))
+                flags = flags | flagKeyFrame
+            diff = (int.from_bytes(pixels, "little") ^ int.from_bytes(self.previous, "little")).to_bytes(len(pixels), "little")
+            data = zlib.compress(diff, self.level)
+            self.previous[:] = pixels
+        self.numSent = self.numSent + 1
+        self.bytesIn = self.bytesIn + len(pixels)
+        self.bytesOut = self.bytesOut + frameHeader.size + len(data)
+        return frameHeader.pack(frame & 0xFFFFFFFF, width, height, self.encoding, flags) + data
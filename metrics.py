@@ -0,0 +1,119 @@
+# Counters for watching the server while it runs, and the Prometheus text
+# format they are published in (see /metrics in datasink.py).
+#
+# The receive loop only ever does a few additions per packet here. All the
+# adding up, and the formatting, happens when someone asks for the numbers,
+# in the HTTP server's thread.
+#
+# RateWindow counts bytes and packets in one-second buckets, in a ring of the
+# last numBuckets seconds, so rates over any window up to that long are a sum
+# of a few buckets. Histogram counts observations into fixed buckets.
+
+import bisect
+
+class RateWindow:
+
+    def __init__(self, numBuckets=60):
+        self.numBuckets = numBuckets
+        self.second = [-1] * numBuckets     # which second each bucket holds
+        self.bytes = [0] * numBuckets
+        self.packets = [0] * numBuckets
+
+    # Count a packet of size bytes that arrived at time t.
+    def add(self, t, size):
+        sec = int(t)
+        i = sec % self.numBuckets
+        if self.second[i] != sec:
+            self.second[i] = sec
+            self.bytes[i] = 0
+            self.packets[i] = 0
+        self.bytes[i] = self.bytes[i] + size
+        self.packets[i] = self.packets[i] + 1
+
+    # Returns (bytes per second, packets per second) over the last seconds
+    # whole seconds before time t.
+    def rates(self, t, seconds):
+        now = int(t)
+        nbytes = 0
+        npackets = 0
+        for sec in range(now - seconds, now):
+            i = sec % self.numBuckets
+            if self.second[i] == sec:
+                nbytes = nbytes + self.bytes[i]
+                npackets = npackets + self.packets[i]
+        return (nbytes / seconds, npackets / seconds)
+
+class Histogram:
+
+    # bounds are the upper bounds of the buckets, in increasing order; there
+    # is one more bucket for everything bigger.
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, x):
+        self.counts[bisect.bisect_left(self.bounds, x)] += 1
+        self.count = self.count + 1
+        self.sum = self.sum + x
+
+    # Returns a list of (upper bound, number of observations no bigger), the
+    # last with bound None for "any size".
+    def cumulative(self):
+        total = 0
+        buckets = []
+        for (bound, n) in zip(self.bounds + [None], self.counts):
+            total = total + n
+            buckets.append((bound, total))
+        return buckets
+
+    def as_dict(self):
+        return {"count": self.count, "sum": self.sum,
+                "buckets": [[bound, n] for (bound, n) in self.cumulative()]}
+
+# Builds a page of metrics in the Prometheus text format.
+class PrometheusText:
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lines = []
+
+    # Add a metric of the given type ("counter" or "gauge"). samples is a
+    # list of (labels, value) pairs, labels being a dict, or just a value for
+    # a metric with no labels.
+    def add(self, name, kind, help, samples):
+        name = self.prefix + name
+        self.lines.append("# HELP %s %s" % (name, help))
+        self.lines.append("# TYPE %s %s" % (name, kind))
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        for (labels, value) in samples:
+            self.lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+
+    def add_histogram(self, name, help, hist):
+        name = self.prefix + name
+        self.lines.append("# HELP %s %s" % (name, help))
+        self.lines.append("# TYPE %s histogram" % (name))
+        for (bound, n) in hist.cumulative():
+            le = "+Inf" if bound is None else format_value(bound)
+            self.lines.append("%s_bucket{le=\"%s\"} %d" % (name, le, n))
+        self.lines.append("%s_sum %s" % (name, format_value(hist.sum)))
+        self.lines.append("%s_count %d" % (name, hist.count))
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for (key, value) in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append("%s=\"%s\"" % (key, value))
+    return "{" + ",".join(pairs) + "}"
+
+def format_value(value):
+    if isinstance(value, int):
+        return "%d" % (value)
+    return repr(float(value))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+#
+# A network emulator: a UDP proxy that sits between a client and the server
+# and mistreats the packets going through it, so we can try out the protocol
+# on a bad network without renting one.
+#
+# The client sends to the proxy instead of to the server. Each client gets its
+# own socket towards the server, so the server still sees one flow per client.
+# Packets in each direction go through a Link, which can:
+#    lose them, each with probability loss
+#    delay them by delay seconds, plus a random jitter: anywhere up to jitter
+#        either way ("uniform"), or normally distributed with standard
+#        deviation jitter ("normal")
+#    hold back a fraction reorder of them by another reorderDelay seconds, so
+#        later packets overtake them (jitter reorders packets too)
+#    send a fraction duplicate of them twice
+#    limit the rate to bandwidth bytes per second (None for no limit), queueing
+#        packets up to queueLimit seconds' worth, and dropping any more
+#
+# Every random choice a Link makes comes from its own random number generator,
+# seeded from seed, so the same packets going through get exactly the same
+# treatment on every run. (What the protocol does in response still depends on
+# real timing, so runs are repeatable, not identical.)
+#
+# Run it like this:
+#   python3 netem.py 6001 1.2.3.4 6000 [name=value ...]
+# and point the client at port 6001. The settings below can be changed on the
+# command line, e.g. loss=0.05 delay=0.02 jitter=0.005 bandwidth=1e6 seed=7.
+# Every setting applies to both directions, except that ackLoss and ackDelay,
+# if not None, replace loss and delay for packets going back to the client.
+
+import heapq
+import random
+import select
+import socket
+import sys
+import time
+
+# setting verbose = 0 turns off most printing
+# setting verbose = 1 turns on a little bit of printing
+# setting verbose = 2 turns on a lot of printing
+verbose = 1
+
+seed = 1
+loss = 0.0
+delay = 0.0
+jitter = 0.0
+distribution = "uniform"
+reorder = 0.0
+reorderDelay = 0.005
+duplicate = 0.0
+bandwidth = None
+queueLimit = 0.1
+ackLoss = None
+ackDelay = None
+
+class Link:
+
+    def __init__(self, seed, loss=0.0, delay=0.0, jitter=0.0, distribution="uniform",
+            reorder=0.0, reorderDelay=0.005, duplicate=0.0, bandwidth=None, queueLimit=0.1):
+        if distribution not in ("uniform", "normal"):
+            raise Exception("Oops, unknown delay distribution %s" % (distribution))
+        self.random = random.Random(seed)
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.distribution = distribution
+        self.reorder = reorder
+        self.reorderDelay = reorderDelay
+        self.duplicate = duplicate
+        self.bandwidth = bandwidth
+        self.queueLimit = queueLimit
+        self.busyUntil = 0.0    # when the last packet queued will have been sent
+        self.numPackets = 0
+        self.numLost = 0
+        self.numQueueDrops = 0
+        self.numReordered = 0
+        self.numDuplicated = 0
+        self.numDelivered = 0
+        self.numSendDrops = 0   # due out, but the socket's buffer was full
+
+    # A packet of size bytes shows up at time now. Returns a list of the times
+    # it should come out the other end: empty if it is dropped, two of them if
+    # it is duplicated.
+    def schedule(self, now, size):
+        rand = self.random
+        self.numPackets = self.numPackets + 1
+        # Draw all the random numbers up front, so each packet uses up the
+        # same amount of randomness whatever happens to it.
+        (lost, dup, reordered) = (rand.random(), rand.random(), rand.random())
+        jitters = (self.draw_jitter(), self.draw_jitter())
+        if lost < self.loss:
+            self.numLost = self.numLost + 1
+            return []
+        copies = 1
+        if dup < self.duplicate:
+            self.numDuplicated = self.numDuplicated + 1
+            copies = 2
+        times = []
+        for i in range(copies):
+            departs = now
+            if self.bandwidth is not None:
+                start = max(now, self.busyUntil)
+                if start - now > self.queueLimit:
+                    self.numQueueDrops = self.numQueueDrops + 1
+                    continue
+                departs = start + size / self.bandwidth
+                self.busyUntil = departs
+            t = departs + max(0.0, self.delay + jitters[i])
+            if i == 0 and reordered < self.reorder:
+                self.numReordered = self.numReordered + 1
+                t = t + self.reorderDelay
+            times.append(t)
+        self.numDelivered = self.numDelivered + len(times)
+        return times
+
+    def draw_jitter(self):
+        if self.jitter <= 0:
+            return 0.0
+        if self.distribution == "normal":
+            return self.random.gauss(0.0, self.jitter)
+        return self.random.uniform(-self.jitter, self.jitter)
+
+    def showStats(self, name):
+        print("%s: %d packets, %d lost, %d dropped from a full queue, %d duplicated, %d reordered, %d delivered, %d dropped by a full socket buffer" %
+                (name, self.numPackets, self.numLost, self.numQueueDrops, self.numDuplicated,
+                 self.numReordered, self.numDelivered - self.numSendDrops, self.numSendDrops))
+
+def make_links():
+    forward = Link(seed, loss, delay, jitter, distribution, reorder, reorderDelay,
+            duplicate, bandwidth, queueLimit)
+    reverse = Link(seed + 1,
+            loss if ackLoss is None else ackLoss,
+            delay if ackDelay is None else ackDelay,
+            jitter, distribution, reorder, reorderDelay, duplicate, bandwidth, queueLimit)
+    return (forward, reverse)
+
+# A non-blocking UDP socket with a large receive buffer.
+def open_socket():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    s.setblocking(False)
+    return s
+
+# Relay packets between clients on listenPort and the server at serverAddr,
+# forever.
+def run(listenPort, serverAddr):
+    (forward, reverse) = make_links()
+    front = open_socket()
+    front.bind(("", listenPort))
+    upstream = {}       # client addr -> socket towards the server
+    clients = {}        # that socket -> client addr
+    queue = []          # (time due, order, link, socket, packet, addr)
+    order = 0
+    print("Relaying UDP packets from port %d to %s:%d" % (listenPort, serverAddr[0], serverAddr[1]))
+    try:
+        while True:
+            now = time.time()
+            while queue and queue[0][0] <= now:
+                (t, _, link, sock, packet, addr) = heapq.heappop(queue)
+                try:
+                    sock.sendto(packet, addr)
+                except BlockingIOError:
+                    # the socket is non-blocking, so a full buffer is just
+                    # one more way for the network to lose a packet
+                    link.numSendDrops = link.numSendDrops + 1
+            timeout = max(queue[0][0] - now, 0.0) if queue else 1.0
+            (ready, _, _) = select.select([front] + list(clients), [], [], timeout)
+            # Take everything that's waiting, so the proxy itself doesn't
+            # drop packets when the client sends a burst.
+            for sock in ready:
+                while True:
+                    try:
+                        (packet, addr) = sock.recvfrom(4000)
+                    except BlockingIOError:
+                        break
+                    now = time.time()
+                    if sock is front:
+                        up = upstream.get(addr)
+                        if up is None:
+                            up = open_socket()
+                            upstream[addr] = up
+                            clients[up] = addr
+                            if verbose >= 1:
+                                print("New client %s:%d" % addr)
+                        (link, out, dest) = (forward, up, serverAddr)
+                    else:
+                        (link, out, dest) = (reverse, front, clients[sock])
+                    for t in link.schedule(now, len(packet)):
+                        heapq.heappush(queue, (t, order, link, out, packet, dest))
+                        order = order + 1
+    except KeyboardInterrupt:
+        pass
+    forward.showStats("client to server")
+    reverse.showStats("server to client")
+
+# Set the module's settings from "name=value" arguments.
+def configure(args):
+    settings = globals()
+    for arg in args:
+        (name, _, value) = arg.partition("=")
+        if name not in ("seed", "loss", "delay", "jitter", "distribution", "reorder", "reorderDelay",
+                "duplicate", "bandwidth", "queueLimit", "ackLoss", "ackDelay", "verbose"):
+            print("Oops, unknown setting %s" % (name))
+            sys.exit(1)
+        if name == "distribution":
+            settings[name] = value
+        elif value == "None":
+            settings[name] = None
+        elif name in ("seed", "verbose"):
+            settings[name] = int(value)
+        else:
+            settings[name] = float(value)
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 3:
+        print("To relay packets from port 6001 to the server at 1.2.3.4 port 6000, losing 5% of them, try running:")
+        print("   python3 %s 6001 1.2.3.4 6000 loss=0.05" % (sys.argv[0]))
+        sys.exit(0)
+    listenPort = int(sys.argv[1])
+    serverAddr = (sys.argv[2], int(sys.argv[3]))
+    configure(sys.argv[4:])
+    run(listenPort, serverAddr)
@@ -0,0 +1,64 @@
+# Pacing: spreading the client's packets out evenly in time, instead of
+# sending each window in one burst.
+#
+# A window's worth of packets sent back to back arrives at the first slow link
+# (or the server's socket buffer) all at once, and whatever doesn't fit in the
+# buffer there is lost, so the client causes some of the losses it then has to
+# retransmit. Pacing at about the rate the path can take (a window per round
+# trip) gives the buffers time to drain between packets.
+#
+# Pacer is a token bucket: tokens come in at rate packets per second, a packet
+# can only be sent by taking one, and at most burst of them pile up, so after
+# a pause the sender can still only send burst packets at once. Sending in
+# small bursts means waking up less often than once per packet, which is about
+# as fine as a sleeping process can time things anyway.
+#
+# All times are integer nanoseconds from time.perf_counter_ns(), which is
+# monotonic and much finer grained than time.time().
+
+class Pacer:
+
+    def __init__(self, rate=None, burst=4):
+        self.rate = rate        # packets per second, or None for no limit
+        self.burst = burst
+        self.credit = 0         # nanoseconds' worth of tokens saved up
+        self.last = None        # when credit was last brought up to date
+        self.numWaits = 0       # times a packet had to wait for a token
+
+    def interval(self):
+        return int(1e9 / self.rate)
+
+    # Bring the bucket up to date at time t.
+    def refill(self, t):
+        if self.last is not None:
+            cap = self.burst * self.interval()
+            self.credit = min(cap, self.credit + t - self.last)
+        else:
+            self.credit = self.burst * self.interval()
+        self.last = t
+
+    # Take a token to send a packet at time t, if there is one. Returns False
+    # if the packet has to wait.
+    def take(self, t):
+        if self.rate is None:
+            return True
+        self.refill(t)
+        if self.credit < self.interval():
+            self.numWaits = self.numWaits + 1
+            return False
+        self.credit = self.credit - self.interval()
+        return True
+
+    # Charge for n packets that were sent at time t whatever the bucket said
+    # (retransmissions), so new packets make room for them.
+    def charge(self, t, n=1):
+        if self.rate is None:
+            return
+        self.refill(t)
+        self.credit = max(self.credit - n * self.interval(), -self.burst * self.interval())
+
+    # When the next token will be ready, or None if there's no limit.
+    def next_time(self):
+        if self.rate is None or self.last is None:
+            return None
+        return self.last + max(0, self.interval() - self.credit)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Parallel client: sends the data as several flows at once.
+#
+# One flow of better_client.py has one socket, one window and one core. On a
+# path with a big bandwidth-delay product it can run out of window, or of CPU
+# to build and send packets, long before it fills the path, and one loss
+# halves the whole transfer's congestion window. This splits the frames over
+# numStreams flows instead (see shards.py): frame k goes on flow
+# k % numStreams. Each flow is a better_client.Transfer of its own, with its
+# own window, congestion controller and RTO, sent from its own process and
+# its own socket (so its own source port).
+#
+# The flows are processes, not threads, so that each gets a core of its own;
+# threads would all take turns holding the Python interpreter lock. Every flow
+# carries the same group id (made from our process id) in its session id, along
+# with which shard it is, and the server puts them back together into one
+# stream (see ShardGroup in datasink.py); a server with several workers steers
+# them all to the same one (see steering.py).
+#
+# Each flow writes its own trace file, named after tracefile with the shard
+# number added (client_saw_packets-0.csv, ...).
+#
+# Run the program like this:
+#   python3 parallel_client.py 1.2.3.4 6000 [streams]
+# This will send data to a UDP server at IP address 1.2.3.4 port 6000, as
+# numStreams flows, or as many as the optional third argument says.
+
+import os
+import socket
+import sys
+import better_client
+import datasource
+import profiling
+import trace
+
+# setting verbose = 0 turns off most printing
+# setting verbose = 1 turns on a little bit of printing
+# setting verbose = 2 turns on a lot of printing
+# setting verbose = 3 turns on all printing
+verbose = 1
+
+# setting tracefile = None disables writing trace files
+# tracefile = None
+tracefile = "client_saw_packets.csv"
+
+# how many flows to send at once (at most 16, see protocol.make_shard_session)
+numStreams = 4
+
+# Send shard number index of numShards, then exit.
+def run_shard(host, port, group, index, numShards):
+    better_client.verbose = verbose
+    if tracefile is not None:
+        (base, ext) = os.path.splitext(tracefile)
+        better_client.tracefile = "%s-%d%s" % (base, index, ext)
+    else:
+        better_client.tracefile = None
+    better_client.init_trace()
+    profiling.after_fork()
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Makes a UDP socket!
+    addr = (host, port)
+    xfer = better_client.Transfer(lambda packet: s.sendto(packet, addr),
+            shard=(group, index, numShards))
+    if verbose >= 1:
+        print("Shard %d: sending %d packets using %s congestion control..." %
+                (index, xfer.window.last, xfer.cc.name))
+    better_client.run(s, xfer)
+    if verbose >= 1:
+        print("Shard %d:" % (index))
+        xfer.showStats()
+    trace.close()
+    profiling.report()
+
+def main(host, port):
+    if not hasattr(os, "fork"):
+        raise Exception("Oops, sending several flows at once needs fork()")
+    if numStreams < 1 or numStreams > 16:
+        raise Exception("Oops, can only send 1 to 16 flows at once, not %d" % (numStreams))
+    print("Sending UDP packets to %s:%d as %d flows" % (host, port, numStreams))
+    datasource.install_signal_handler()
+    group = os.getpid() & 0xFFFF
+    tStart = better_client.now()
+
+    pids = []
+    for index in range(numStreams):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                run_shard(host, port, group, index, numStreams)
+                status = 0
+            finally:
+                sys.stdout.flush()
+                os._exit(status)
+        pids.append(pid)
+
+    failed = 0
+    for pid in pids:
+        (pid, status) = os.waitpid(pid, 0)
+        if status != 0:
+            failed = failed + 1
+    elapsed = better_client.now() - tStart
+
+    numBytes = datasource.numPackets * datasource.packetSize
+    print("Finished sending all packets!")
+    print("Elapsed time: %0.4f s for %d flows, %d packets, throughput %0.2f MBps" %
+            (elapsed, numStreams, datasource.numPackets, numBytes / elapsed / 1e6))
+    if failed > 0:
+        print("Oops, %d of the flows failed" % (failed))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 2:
+        print("To send data to the server at 1.2.3.4 port 6000 as 4 flows, try running:")
+        print("   python3 %s 1.2.3.4 6000 4" % (sys.argv[0]))
+        sys.exit(0)
+    host = sys.argv[1]
+    port = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        numStreams = int(sys.argv[3])
+    main(host, port)
@@ -0,0 +1,158 @@
+# Optional instrumentation, for finding out where the time goes in the server's
+# receive loop and the clients' send loops.
+#
+# Nothing here runs unless it is turned on, with the PROFILE environment
+# variable (so it works the same for every program, without touching their
+# command lines), set to a comma-separated list of:
+#    stages     time each stage of the loop (see Stage below)
+#    cprofile   run the whole program under cProfile
+#    sample     a statistical profiler: every sampleInterval seconds of CPU
+#               time, note which line of code is running
+# e.g.   PROFILE=stages,sample python3 server.py 0.0.0.0 6000
+# PROFILE_EVERY=n times only one in every n calls to each stage, to keep the
+# overhead down when every packet goes through them.
+#
+# A summary of everything that was measured is printed when the program exits,
+# and the cProfile statistics are also saved in profileFile, for pstats or
+# snakeviz.
+#
+# A Stage times one step of a loop:
+#    recvStage = profiling.Stage("recv")
+#    ...
+#    t = recvStage.start()
+#    (msg, addr) = s.recvfrom(4000)
+#    recvStage.stop(t)
+# start() returns None when the call isn't being timed, and stop() then does
+# nothing, so an untimed stage costs two short function calls. Times go into a
+# histogram with one bucket per power of two nanoseconds, so recording one is
+# a couple of additions.
+
+import atexit
+import os
+import signal
+import sys
+import time
+
+options = [opt for opt in os.getenv("PROFILE", "").split(",") if opt]
+enabled = "stages" in options
+sampleEvery = max(1, int(os.getenv("PROFILE_EVERY", "1")))
+
+profileFile = "profile.out"
+sampleInterval = 0.001
+
+stages = []     # every Stage, in the order they were made
+
+class Stage:
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.samples = 0
+        self.totalNs = 0
+        self.buckets = [0] * 64     # bucket i: times of 2**(i-1) to 2**i - 1 ns
+        stages.append(self)
+
+    def start(self):
+        if not enabled:
+            return None
+        self.calls = self.calls + 1
+        if self.calls % sampleEvery != 0:
+            return None
+        return time.perf_counter_ns()
+
+    def stop(self, t):
+        if t is None:
+            return
+        ns = time.perf_counter_ns() - t
+        self.samples = self.samples + 1
+        self.totalNs = self.totalNs + ns
+        self.buckets[min(ns.bit_length(), 63)] += 1
+
+    # Roughly the time that fraction p of the samples took no longer than, in
+    # nanoseconds: the top of the bucket it falls in.
+    def percentile(self, p):
+        want = p * self.samples
+        seen = 0
+        for (i, n) in enumerate(self.buckets):
+            seen = seen + n
+            if n > 0 and seen >= want:
+                return (1 << i) - 1
+        return 0
+
+    def mean(self):
+        return self.totalNs / self.samples if self.samples > 0 else 0.0
+
+def show_stages():
+    timed = [stage for stage in stages if stage.samples > 0]
+    if not timed:
+        return
+    print("Time per stage (microseconds; p50/p99 are rounded up to a power of two ns):")
+    print("  %-12s %10s %10s %9s %9s %9s %10s" % ("stage", "calls", "timed", "mean", "p50", "p99", "total s"))
+    for stage in timed:
+        # the calls that weren't timed probably took about as long as the ones
+        # that were
+        total = stage.mean() * stage.calls / 1e9
+        print("  %-12s %10d %10d %9.2f %9.2f %9.2f %10.3f" %
+                (stage.name, stage.calls, stage.samples, stage.mean() / 1000,
+                 stage.percentile(0.5) / 1000, stage.percentile(0.99) / 1000, total))
+
+# The cProfile profiler, if it's running.
+profiler = None
+
+def show_cprofile():
+    import pstats
+    profiler.disable()
+    profiler.dump_stats(profileFile)
+    print("cProfile statistics saved in %s; the top functions by total time were:" % (profileFile))
+    pstats.Stats(profiler, stream=sys.stdout).sort_stats("tottime").print_stats(15)
+
+# Line -> number of times it was running when the sampler looked.
+lineSamples = {}
+
+def sample(signum, frame):
+    if frame is not None:
+        key = (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+        lineSamples[key] = lineSamples.get(key, 0) + 1
+
+def show_samples():
+    total = sum(lineSamples.values())
+    if total == 0:
+        return
+    print("Sampling profiler: %d samples, the busiest lines were:" % (total))
+    for ((filename, line, func), n) in sorted(lineSamples.items(), key=lambda item: -item[1])[:15]:
+        print("  %5.1f%%  %s:%d (%s)" % (100.0 * n / total, os.path.basename(filename), line, func))
+
+reported = False
+
+# Print everything that was measured. Runs at exit; call it directly before
+# os._exit(), which skips that.
+def report():
+    global reported
+    if reported:
+        return
+    reported = True
+    if hasattr(signal, "setitimer") and "sample" in options:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+    show_stages()
+    if profiler is not None:
+        show_cprofile()
+    show_samples()
+    sys.stdout.flush()
+
+# Called in a newly forked process, which doesn't inherit the sampler's timer.
+def after_fork():
+    if hasattr(signal, "setitimer") and "sample" in options:
+        signal.setitimer(signal.ITIMER_PROF, sampleInterval, sampleInterval)
+
+if options:
+    if "cprofile" in options:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if "sample" in options:
+        if not hasattr(signal, "setitimer"):
+            print("Warning: the sampling profiler needs setitimer(), which isn't available here")
+        else:
+            signal.signal(signal.SIGPROF, sample)
+            signal.setitimer(signal.ITIMER_PROF, sampleInterval, sampleInterval)
+    atexit.register(report)
@@ -0,0 +1,191 @@
+# The packet format shared by the clients and the server.
+#
+# Every packet starts with two 32-bit big-endian integers: a "magic" word and
+# a sequence number. The original clients always sent 0xBAADCAFE as the magic
+# word and the server ignored it. We now give it some structure:
+#
+#    top 8 bits     packet type (0xBA for data, 0xAA for an ACK, ...)
+#    low 24 bits    session id
+#
+# so 0xBAADCAFE still means "data", from session 0xADCAFE, and old clients
+# work unchanged. A client that wants the server to keep two of its transfers
+# apart just uses a different session id for each.
+#
+# Data packets all have 0xB in the top 4 bits of the type. The low 4 bits,
+# XORed with 0xA (so that the original 0xBA means "no flags"), are flags:
+#
+#    flagSack       please send cumulative/selective ACKs, not one per packet
+#    flagFec        parity packets for this flow follow each group of data
+#                   packets, so keep recent payloads around for rebuilding
+#                   lost ones (see fec.py)
+#    flagEncoded    every payload starts with a header saying how it was
+#                   compressed, and which earlier row it is a delta against
+#                   (see rowcodec.py)
+#    flagShard      this flow is one shard of a parallel transfer (see
+#                   shards.py): its seqnos only count its own packets, and
+#                   its session id is made by make_shard_session()
+#
+# Parity packets (type 0xCA) carry forward error correction data. The seqno
+# field is the first seqno of the group the parity covers, and the layout of
+# the rest of the packet is in fec.py.
+#
+# ACKs come in two kinds:
+#
+#    type 0xAA      a plain ACK: the seqno field is the seqno just received
+#    type 0xAB      a cumulative ACK: the seqno field is the lowest seqno not
+#                   yet received, so every seqno below it has arrived. It is
+#                   followed by up to maxSackRanges pairs of 32-bit integers
+#                   (start, end), each a run of seqnos start..end-1 above the
+#                   cumulative ACK that have also arrived, lowest first.
+#
+# The server sends cumulative ACKs only to clients that set flagSack, and may
+# wait for several packets (or a few milliseconds) before sending one.
+#
+# A client can also open a transfer with a handshake, and close it when it's
+# done. These packets all carry a Hello (see below) after the header:
+#
+#    type 0xC1      SYN: the client asks to start, or carry on with, the
+#                   transfer with the given id, with the options it would like
+#    type 0xC2      SYN-ACK: the server's answer, with the session id the
+#                   client must use, the options it agreed to, and the seqno
+#                   field a cumulative ACK for whatever it already has of the
+#                   transfer, followed by up to maxHelloRanges runs above that
+#                   (like a cumulative ACK), so a client that was interrupted
+#                   only sends what's missing
+#    type 0xC3      FIN: the client has had everything ACKed; the seqno field
+#                   is the number of packets in the transfer
+#    type 0xC4      FIN-ACK: the server is done with the transfer; the seqno
+#                   field is its cumulative ACK
+#
+# Seqnos wrap around to 0 after 0xFFFFFFFF. Both ends keep "unwrapped" seqnos
+# that just keep counting, and use unwrap() to turn a 32-bit seqno from a
+# packet back into the nearest unwrapped one.
+
+import struct
+from seqset import unwrap
+
+hdrFormat = ">II"
+hdrSize = struct.calcsize(hdrFormat)
+rangeFormat = ">II"
+rangeSize = struct.calcsize(rangeFormat)
+
+dataType = 0xBA
+ackType = 0xAA
+sackType = 0xAB
+parityType = 0xCA
+synType = 0xC1
+synAckType = 0xC2
+finType = 0xC3
+finAckType = 0xC4
+
+flagSack = 0x1
+flagFec = 0x2
+flagEncoded = 0x4
+flagShard = 0x8
+
+defaultSession = 0xADCAFE
+
+maxSackRanges = 16
+
+# The body of a handshake packet: transfer id, number of packets and window,
+# as 32-bit integers, then a byte each of flags (as for data packets) and
+# compression (see rowcodec.compressions).
+helloFormat = struct.Struct(">IIIBB")
+
+# as many runs as fit in a SYN-ACK in one unfragmented datagram
+maxHelloRanges = (1472 - hdrSize - helloFormat.size) // rangeSize
+
+def make_magic(ptype, session):
+    return (ptype << 24) | (session & 0xFFFFFF)
+
+def packet_type(magic):
+    return magic >> 24
+
+def session_id(magic):
+    return magic & 0xFFFFFF
+
+def make_data_magic(session, flags=0):
+    return make_magic(0xB0 | (0xA ^ flags), session)
+
+def is_data(magic):
+    return (magic >> 28) == 0xB
+
+def data_flags(magic):
+    return ((magic >> 24) & 0xF) ^ 0xA
+
+# The session id of shard number shard (counting from 0) of numShards (at most
+# 16) in the parallel transfer with id group: the group in the top 16 bits,
+# then 4 bits each of shard and numShards - 1.
+def make_shard_session(group, shard, numShards):
+    return ((group & 0xFFFF) << 8) | (shard << 4) | (numShards - 1)
+
+# Returns (group, shard, numShards) from a shard's session id.
+def shard_info(session):
+    return (session >> 8, (session >> 4) & 0xF, (session & 0xF) + 1)
+
+# Builds a cumulative ACK packet. ranges is a list of (start, end) pairs.
+def pack_sack(session, cumAck, ranges):
+    ack = bytearray(hdrSize + rangeSize * len(ranges))
+    struct.pack_into(hdrFormat, ack, 0, make_magic(sackType, session), cumAck & 0xFFFFFFFF)
+    off = hdrSize
+    for (start, end) in ranges:
+        struct.pack_into(rangeFormat, ack, off, start & 0xFFFFFFFF, end & 0xFFFFFFFF)
+        off = off + rangeSize
+    return ack
+
+# Returns (cumAck, ranges) from a cumulative ACK packet, unwrapped to be near
+# the seqno reference.
+def unpack_sack(ack, reference=0):
+    (magic, cumAck) = struct.unpack_from(hdrFormat, ack, 0)
+    cumAck = unwrap(cumAck, reference)
+    ranges = []
+    for off in range(hdrSize, len(ack) - rangeSize + 1, rangeSize):
+        (start, end) = struct.unpack_from(rangeFormat, ack, off)
+        start = unwrap(start, cumAck)
+        ranges.append((start, start + ((end - start) & 0xFFFFFFFF)))
+    return (cumAck, ranges)
+
+# What's in a handshake packet. The client picks transferId, and keeps it for
+# as long as the transfer takes, even across restarts; the server picks the
+# session id. cumAck and ranges say which seqnos the server has.
+class Hello:
+
+    def __init__(self, transferId, numPackets, window, flags, compression,
+                 session=0, cumAck=0, ranges=()):
+        self.transferId = transferId
+        self.numPackets = numPackets
+        self.window = window
+        self.flags = flags
+        self.compression = compression
+        self.session = session
+        self.cumAck = cumAck
+        self.ranges = list(ranges)
+
+    # True if the server already has some of the transfer.
+    def resumed(self):
+        return self.cumAck > 0 or len(self.ranges) > 0
+
+# Builds a handshake packet of type ptype.
+def pack_hello(ptype, hello):
+    packet = bytearray(hdrSize + helloFormat.size + rangeSize * len(hello.ranges))
+    struct.pack_into(hdrFormat, packet, 0, make_magic(ptype, hello.session), hello.cumAck & 0xFFFFFFFF)
+    helloFormat.pack_into(packet, hdrSize, hello.transferId, hello.numPackets, hello.window,
+            hello.flags, hello.compression)
+    off = hdrSize + helloFormat.size
+    for (start, end) in hello.ranges:
+        struct.pack_into(rangeFormat, packet, off, start & 0xFFFFFFFF, end & 0xFFFFFFFF)
+        off = off + rangeSize
+    return packet
+
+# Returns the Hello in a handshake packet, or None if it's too short to hold
+# one.
+def unpack_hello(packet):
+    if len(packet) < hdrSize + helloFormat.size:
+        return None
+    (magic, cumAck) = struct.unpack_from(hdrFormat, packet, 0)
+    (transferId, numPackets, window, flags, compression) = helloFormat.unpack_from(packet, hdrSize)
+    ranges = []
+    for off in range(hdrSize + helloFormat.size, len(packet) - rangeSize + 1, rangeSize):
+        ranges.append(struct.unpack_from(rangeFormat, packet, off))
+    return Hello(transferId, numPackets, window, flags, compression,
+                 session_id(magic), cumAck, ranges)
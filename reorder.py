@@ -0,0 +1,150 @@
+# A reorder buffer: packets go in in whatever order they arrive, and come out
+# in seqno order.
+#
+# Packets that arrive in order are handed straight to the consumer. A packet
+# that arrives early (above a hole) is copied into a slab of fixed-size slots,
+# in slot seqno % size, and waits there until the hole below it fills. Then
+# the whole contiguous run is released, in order.
+#
+# The slab isn't allocated until a packet first arrives early, and then only
+# with room for as far ahead as packets have actually arrived, so a flow that
+# never reorders anything (or only a little) costs next to nothing. It grows,
+# doubling each time, as packets arrive further ahead, up to capacity slots,
+# which caps how much can be held.
+#
+# A hole that never fills (because the sender gave up, or because the packet
+# was lost and the sender doesn't retransmit) would stall delivery forever, so
+# we give up on a hole, skip over it, and release what comes after it if
+# either:
+#   - a packet arrives that's too far ahead to fit in the slab, or
+#   - the hole has been blocking delivery for more than holeTimeout seconds
+#     (if holeTimeout is not None).
+# Packets for seqnos that have already been skipped or released are dropped.
+#
+# The consumer is called as consumer(seqno, payload). The payload may be a
+# memoryview into the slab, which is reused as soon as the call returns, so
+# the consumer must copy anything it wants to keep.
+
+class ReorderBuffer:
+
+    def __init__(self, capacity, slotSize, consumer, first=0, holeTimeout=None):
+        if capacity < 1:
+            raise Exception("Oops, a reorder buffer needs room for at least one packet, not %d" % (capacity))
+        self.capacity = capacity
+        self.slotSize = slotSize
+        self.consumer = consumer
+        self.holeTimeout = holeTimeout
+        self.next = first               # next seqno to release
+        self.size = 0                   # slots in the slab so far
+        self.slab = None
+        self.view = None
+        self.slotSeqno = []
+        self.slotLen = []
+        self.depth = 0                  # packets waiting in the slab
+        self.holeSince = None           # when delivery first got stuck
+        self.numReleased = 0
+        self.numSkipped = 0             # seqnos given up on
+        self.numLate = 0                # arrived after being skipped
+        self.numOversize = 0
+
+    # Add a packet. t is the current time, used for holeTimeout.
+    def add(self, seqno, payload, t=None):
+        if seqno < self.next:
+            self.numLate = self.numLate + 1
+            return
+        if seqno == self.next:
+            self.consumer(seqno, payload)
+            self.numReleased = self.numReleased + 1
+            self.next = seqno + 1
+            if self.depth > 0:
+                self.release(t)
+            return
+        if len(payload) > self.slotSize:
+            self.numOversize = self.numOversize + 1
+            return
+        if seqno >= self.next + self.capacity:
+            # No room: give up on holes until this one fits.
+            self.skip_to(seqno - self.capacity + 1, t)
+            if seqno == self.next:
+                self.add(seqno, payload, t)
+                return
+        if seqno >= self.next + self.size:
+            self.grow(seqno - self.next + 1)
+        slot = seqno % self.size
+        if self.slotSeqno[slot] == seqno:
+            return # already waiting
+        off = slot * self.slotSize
+        self.slab[off:off + len(payload)] = payload
+        self.slotSeqno[slot] = seqno
+        self.slotLen[slot] = len(payload)
+        self.depth = self.depth + 1
+        if self.holeSince is None:
+            self.holeSince = t
+        self.expire(t)
+
+    # Make room for packets up to n seqnos ahead of next, moving any that are
+    # waiting into their slots in the bigger slab.
+    def grow(self, n):
+        size = min(self.capacity, max(n, 2 * self.size, 16))
+        slab = bytearray(size * self.slotSize)
+        slotSeqno = [-1] * size
+        slotLen = [0] * size
+        for slot in range(self.size):
+            seqno = self.slotSeqno[slot]
+            if seqno >= 0:
+                off = slot * self.slotSize
+                newOff = (seqno % size) * self.slotSize
+                slab[newOff:newOff + self.slotLen[slot]] = self.view[off:off + self.slotLen[slot]]
+                slotSeqno[seqno % size] = seqno
+                slotLen[seqno % size] = self.slotLen[slot]
+        self.size = size
+        self.slab = slab
+        self.view = memoryview(slab)
+        self.slotSeqno = slotSeqno
+        self.slotLen = slotLen
+
+    # Release the contiguous run of waiting packets starting at next.
+    def release(self, t=None):
+        while self.depth > 0:
+            slot = self.next % self.size
+            if self.slotSeqno[slot] != self.next:
+                break
+            off = slot * self.slotSize
+            self.consumer(self.next, self.view[off:off + self.slotLen[slot]])
+            self.slotSeqno[slot] = -1
+            self.depth = self.depth - 1
+            self.numReleased = self.numReleased + 1
+            self.next = self.next + 1
+        # If packets are still waiting, there's a new hole below them.
+        self.holeSince = t if self.depth > 0 else None
+
+    # Give up on every missing seqno below seqno, releasing anything waiting
+    # in between.
+    def skip_to(self, seqno, t=None):
+        while self.next < seqno:
+            if self.depth == 0:
+                self.numSkipped = self.numSkipped + seqno - self.next
+                self.next = seqno
+                break
+            slot = self.next % self.size
+            if self.slotSeqno[slot] == self.next:
+                self.release(t)
+            else:
+                self.numSkipped = self.numSkipped + 1
+                self.next = self.next + 1
+        self.release(t)
+
+    # Skip the hole at the bottom of the buffer if it has been stuck for too
+    # long. Called on every out-of-order arrival, and can also be called
+    # periodically so a buffer with no new arrivals still drains.
+    def expire(self, t):
+        if self.holeTimeout is None or self.holeSince is None or t is None:
+            return
+        if t - self.holeSince < self.holeTimeout:
+            return
+        while self.depth > 0:
+            if self.slotSeqno[self.next % self.size] == self.next:
+                break
+            self.numSkipped = self.numSkipped + 1
+            self.next = self.next + 1
+        self.release(t)
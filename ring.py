@@ -0,0 +1,150 @@
+# Bounded rings for handing things from the server's receive loop to slower
+# threads (the console printer and the web view) without ever making the
+# receive loop wait.
+#
+# Each ring has exactly one producer thread and one consumer thread. The
+# producer only ever changes head (the count of items put in), and the consumer
+# only ever changes tail (the count of items taken out), so there are no locks:
+# the producer fills a slot and then bumps head, and the consumer only reads
+# slots below head. When the ring is full, put() drops the new item and returns
+# False straight away, rather than waiting for the consumer to catch up. The
+# consumer polls, sleeping a little whenever the ring is empty.
+#
+# Ring holds any Python objects. PacketRing holds (seqno, payload) pairs,
+# copying each payload into a preallocated slab, and can drop whole frames at
+# a time under backpressure, rather than random rows.
+
+import struct
+import time
+
+# seconds a consumer sleeps when there's nothing to do
+pollInterval = 0.01
+
+class Ring:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.numPut = 0
+        self.numDropped = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    # Producer: add item, or drop it and return False if the ring is full.
+    def put(self, item):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.numDropped = self.numDropped + 1
+            return False
+        self.slots[head % self.capacity] = item
+        self.head = head + 1
+        self.numPut = self.numPut + 1
+        return True
+
+    # Consumer: take up to maxItems items out, oldest first.
+    def get_batch(self, maxItems):
+        tail = self.tail
+        n = min(self.head - tail, maxItems)
+        items = []
+        for i in range(tail, tail + n):
+            slot = i % self.capacity
+            items.append(self.slots[slot])
+            self.slots[slot] = None
+        self.tail = tail + n
+        return items
+
+    # Consumer: like get_batch(), but wait until there is something to get.
+    def wait_batch(self, maxItems):
+        while self.head == self.tail:
+            time.sleep(pollInterval)
+        return self.get_batch(maxItems)
+
+    # Wait (up to timeout seconds) for the consumer to empty the ring.
+    def drain(self, timeout=1.0):
+        deadline = time.time() + timeout
+        while self.head != self.tail and time.time() < deadline:
+            time.sleep(pollInterval)
+
+# Each record handed out by PacketRing.get_into() is this header, followed by
+# the payload.
+recordHeader = struct.Struct(">II") # seqno, payload length
+
+class PacketRing:
+
+    # If rowsPerFrame is not None, packet seqno is taken to be a row of frame
+    # seqno // rowsPerFrame, and a frame is only let in if there's room for all
+    # of it when its first row arrives. Otherwise, packets are dropped one at a
+    # time when the ring is full.
+    def __init__(self, capacity, slotSize, rowsPerFrame=None):
+        self.capacity = capacity
+        self.slotSize = slotSize
+        self.rowsPerFrame = rowsPerFrame
+        self.slab = bytearray(capacity * slotSize)
+        self.view = memoryview(self.slab)
+        self.seqnos = [0] * capacity
+        self.lens = [0] * capacity
+        self.head = 0
+        self.tail = 0
+        self.frame = None       # frame we last decided about
+        self.admit = True       # whether we're letting that frame in
+        self.numPut = 0
+        self.numDropped = 0
+        self.numFramesDropped = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    # Producer: copy in a packet, or drop it and return False.
+    def put(self, seqno, payload):
+        head = self.head
+        if self.rowsPerFrame is not None:
+            frame = seqno // self.rowsPerFrame
+            if frame != self.frame:
+                self.frame = frame
+                self.admit = self.capacity - (head - self.tail) >= self.rowsPerFrame
+                if not self.admit:
+                    self.numFramesDropped = self.numFramesDropped + 1
+            if not self.admit:
+                self.numDropped = self.numDropped + 1
+                return False
+        n = len(payload)
+        if head - self.tail >= self.capacity or n > self.slotSize:
+            self.numDropped = self.numDropped + 1
+            return False
+        slot = head % self.capacity
+        off = slot * self.slotSize
+        self.slab[off:off + n] = payload
+        self.seqnos[slot] = seqno
+        self.lens[slot] = n
+        self.head = head + 1
+        self.numPut = self.numPut + 1
+        return True
+
+    # Consumer: append up to maxItems packets to out (a bytearray), each as a
+    # recordHeader followed by the payload, and return how many there were.
+    def get_into(self, out, maxItems):
+        tail = self.tail
+        n = min(self.head - tail, maxItems)
+        for i in range(tail, tail + n):
+            slot = i % self.capacity
+            off = slot * self.slotSize
+            out += recordHeader.pack(self.seqnos[slot], self.lens[slot])
+            out += self.view[off:off + self.lens[slot]]
+        self.tail = tail + n
+        return n
+
+    # Consumer: call fn(seqno, payload) for up to maxItems packets, and return
+    # how many there were. The payload is a view into the slab, only good until
+    # fn returns.
+    def get_each(self, fn, maxItems):
+        tail = self.tail
+        n = min(self.head - tail, maxItems)
+        for i in range(tail, tail + n):
+            slot = i % self.capacity
+            off = slot * self.slotSize
+            fn(self.seqnos[slot], self.view[off:off + self.lens[slot]])
+        self.tail = tail + n
+        return n
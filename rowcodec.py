@@ -0,0 +1,149 @@
+# Squeezing each row of payload before it goes on the wire.
+#
+# Every payload is one row of an image (see datasource.py), and rows are very
+# much like their neighbours: the row above, and the same row of the frame
+# before. So instead of sending a row as it is, the client can send it XORed
+# with one of those (a "delta", mostly zeros where the picture hasn't
+# changed), compressed with zlib, or with LZ4 if the lz4 module is installed.
+#
+# The server can only undo a delta if it already has the row it was taken
+# against. So the client only ever takes a delta against a row the server has
+# already ACKed, and the server keeps the last few thousand rows it decoded.
+# Retransmissions resend exactly the same bytes, so they decode the same way.
+#
+# An encoded payload is a codecHeader followed by the data:
+#    compression    one of compressions below
+#    distance       0 for no delta, otherwise the payload is XORed with the
+#                   row of seqno (this seqno - distance) before compressing
+# A row that doesn't get any smaller is sent uncompressed, with no delta.
+# Packets of a flow that sets protocol.flagEncoded all start with a
+# codecHeader.
+
+import struct
+import zlib
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+codecHeader = struct.Struct(">BH")
+
+compressions = {"none": 0, "zlib": 1, "lz4": 2}
+
+def xor(a, b):
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+class RowEncoder:
+
+    # source(seqno) returns the raw row for seqno, and acked(seqno) says
+    # whether the server is known to have seqno. Deltas are only tried against
+    # the rows distances back.
+    def __init__(self, source, acked, compression="zlib", level=1, distances=(360, 1)):
+        if compression not in compressions:
+            raise Exception("Oops, unknown payload compression %s" % (compression))
+        if compression == "lz4" and lz4 is None:
+            raise Exception("Oops, lz4 compression needs the lz4 module")
+        self.source = source
+        self.acked = acked
+        self.compression = compressions[compression]
+        self.level = level
+        self.distances = distances
+        self.numEncoded = 0
+        self.numDelta = 0
+        self.numRaw = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    def compress(self, data):
+        if self.compression == compressions["zlib"]:
+            return zlib.compress(data, self.level)
+        if self.compression == compressions["lz4"]:
+            return lz4.block.compress(data)
+        return data
+
+    # Returns the encoded payload for seqno, header included.
+    def encode(self, seqno):
+        row = self.source(seqno)
+        best = self.compress(row)
+        distance = 0
+        # Try the delta against whichever usable neighbour it has the most in
+        # common with.
+        diff = None
+        for d in self.distances:
+            if seqno - d < 0 or not self.acked(seqno - d):
+                continue
+            ref = self.source(seqno - d)
+            if len(ref) != len(row):
+                continue
+            candidate = xor(row, ref)
+            if diff is None or candidate.count(0) > diff.count(0):
+                (diff, distance) = (candidate, d)
+        if diff is not None:
+            packed = self.compress(diff)
+            if len(packed) < len(best):
+                best = packed
+            else:
+                distance = 0
+        self.numEncoded = self.numEncoded + 1
+        self.bytesIn = self.bytesIn + len(row)
+        if len(best) >= len(row):
+            self.numRaw = self.numRaw + 1
+            self.bytesOut = self.bytesOut + codecHeader.size + len(row)
+            return codecHeader.pack(compressions["none"], 0) + row
+        if distance > 0:
+            self.numDelta = self.numDelta + 1
+        self.bytesOut = self.bytesOut + codecHeader.size + len(best)
+        return codecHeader.pack(self.compression, distance) + best
+
+class RowDecoder:
+
+    # Keeps the last capacity rows decoded (each up to slotSize bytes), in slot
+    # seqno % capacity, to undo deltas against.
+    def __init__(self, capacity, slotSize):
+        self.capacity = capacity
+        self.slotSize = slotSize
+        self.slab = bytearray(capacity * slotSize)
+        self.view = memoryview(self.slab)
+        self.slotSeqno = [-1] * capacity
+        self.slotLen = [0] * capacity
+        self.numDecoded = 0
+        self.numFailed = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    # Returns the row encoded in payload, or None if it can't be decoded (it's
+    # garbled, or its delta is against a row we don't have).
+    def decode(self, seqno, payload):
+        if len(payload) < codecHeader.size:
+            self.numFailed = self.numFailed + 1
+            return None
+        (compression, distance) = codecHeader.unpack_from(payload, 0)
+        data = payload[codecHeader.size:]
+        try:
+            if compression == compressions["zlib"]:
+                data = zlib.decompress(data)
+            elif compression == compressions["lz4"] and lz4 is not None:
+                data = lz4.block.decompress(data)
+            elif compression != compressions["none"]:
+                raise ValueError("unknown compression %d" % (compression))
+        except Exception: # zlib.error, or whatever lz4 raises for a garbled block
+            self.numFailed = self.numFailed + 1
+            return None
+        if distance > 0:
+            ref = seqno - distance
+            slot = ref % self.capacity
+            if self.slotSeqno[slot] != ref or self.slotLen[slot] != len(data):
+                self.numFailed = self.numFailed + 1
+                return None
+            off = slot * self.slotSize
+            data = xor(data, self.view[off:off + self.slotLen[slot]])
+        if len(data) <= self.slotSize:
+            slot = seqno % self.capacity
+            off = slot * self.slotSize
+            self.slab[off:off + len(data)] = data
+            self.slotSeqno[slot] = seqno
+            self.slotLen[slot] = len(data)
+        self.numDecoded = self.numDecoded + 1
+        self.bytesIn = self.bytesIn + len(payload)
+        self.bytesOut = self.bytesOut + len(data)
+        return bytes(data)
@@ -0,0 +1,67 @@
+# Retransmission timer for our TCP-like protocol, following the usual TCP
+# recipe (RFC 6298):
+#
+#   - The first RTT sample R sets SRTT = R and RTTVAR = R/2.
+#   - Every later sample updates
+#         RTTVAR = (1 - beta) * RTTVAR + beta * |SRTT - R|
+#         SRTT   = (1 - alpha) * SRTT + alpha * R
+#   - RTO = SRTT + max(G, K * RTTVAR), clamped to [minRTO, maxRTO].
+#
+# Each time the timer expires the RTO is doubled (exponential backoff), up to
+# maxRTO. The backoff sticks until a fresh RTT sample arrives.
+#
+# minRTO is 200 ms, as in most TCP stacks, rather than RFC 6298's full second.
+# Much lower than that, and the odd packet held up by reordering or a burst of
+# jitter times out even though nothing was lost.
+#
+# Karn's rule: an ACK for a packet that was sent more than once can't tell us
+# which copy it is ACKing, so it doesn't give a valid RTT sample. The caller
+# should pass retransmitted=True for those, and they will be ignored.
+#
+# minRtt is the shortest RTT sample so far: no packet can be ACKed any sooner
+# than that after it was sent.
+#
+# All times are in seconds.
+
+alpha = 1.0 / 8
+beta = 1.0 / 4
+K = 4
+
+class RTOEstimator:
+
+    def __init__(self, initialRTO=1.0, minRTO=0.2, maxRTO=60.0, granularity=0.001):
+        self.srtt = None
+        self.rttvar = None
+        self.minRtt = None
+        self.minRTO = minRTO
+        self.maxRTO = maxRTO
+        self.granularity = granularity
+        self.rto = initialRTO
+        self.lastSample = None
+        self.numSamples = 0
+        self.numBackoffs = 0
+
+    # Feed in one RTT measurement. Returns the sample if it was used, or None
+    # if it was discarded because of Karn's rule.
+    def sample(self, rtt, retransmitted=False):
+        if retransmitted:
+            return None
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - beta) * self.rttvar + beta * abs(self.srtt - rtt)
+            self.srtt = (1 - alpha) * self.srtt + alpha * rtt
+        self.rto = self.srtt + max(self.granularity, K * self.rttvar)
+        self.rto = min(max(self.rto, self.minRTO), self.maxRTO)
+        if self.minRtt is None or rtt < self.minRtt:
+            self.minRtt = rtt
+        self.lastSample = rtt
+        self.numSamples = self.numSamples + 1
+        return rtt
+
+    # Called when the retransmission timer expires.
+    def backoff(self):
+        self.rto = min(self.rto * 2, self.maxRTO)
+        self.numBackoffs = self.numBackoffs + 1
+        return self.rto
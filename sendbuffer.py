@@ -0,0 +1,55 @@
+# A ring of preallocated packet slots for the clients.
+#
+# Building each packet as bytearray(struct.pack(...)) + body allocates and
+# copies a brand new 1448 byte object every time, and retransmitting a packet
+# means fetching its body from datasource all over again. Instead, all the
+# packets live in one big bytearray carved into fixed-size slots. Packet seqno
+# lives in slot seqno % numSlots: the header is written in place with
+# struct.pack_into, the body is copied in once, and sendto() is handed a
+# memoryview of the slot, so nothing else gets copied.
+#
+# A slot is only rebuilt when a different seqno needs it. As long as numSlots
+# is at least as large as the largest number of seqnos the sender can have
+# outstanding (the window span), every retransmission finds its packet still
+# sitting in the ring.
+
+import struct
+
+hdrSize = struct.calcsize(">II")
+
+class SendBuffer:
+
+    # source(seqno) should return the payload bytes for seqno.
+    def __init__(self, numSlots, maxPayload, magic, source):
+        if numSlots < 1:
+            raise Exception("Oops, a send buffer needs at least one slot, not %d" % (numSlots))
+        self.numSlots = numSlots
+        self.slotSize = hdrSize + maxPayload
+        self.magic = magic
+        self.source = source
+        self.buf = bytearray(numSlots * self.slotSize)
+        self.view = memoryview(self.buf)
+        self.slotSeqno = [-1] * numSlots    # which seqno each slot holds
+        self.slotLen = [0] * numSlots       # packet length in each slot
+        self.numBuilt = 0
+        self.numReused = 0
+
+    # Returns a memoryview of the complete packet (header + payload) for seqno,
+    # building it first if it isn't already in the ring.
+    def packet(self, seqno):
+        slot = seqno % self.numSlots
+        off = slot * self.slotSize
+        if self.slotSeqno[slot] == seqno:
+            self.numReused = self.numReused + 1
+            return self.view[off:off + self.slotLen[slot]]
+        body = self.source(seqno)
+        n = hdrSize + len(body)
+        if n > self.slotSize:
+            raise Exception("Oops, payload for seqno %d is %d bytes, but slots only hold %d" %
+                    (seqno, len(body), self.slotSize - hdrSize))
+        struct.pack_into(">II", self.buf, off, self.magic, seqno & 0xFFFFFFFF)
+        self.buf[off + hdrSize:off + n] = body
+        self.slotSeqno[slot] = seqno
+        self.slotLen[slot] = n
+        self.numBuilt = self.numBuilt + 1
+        return self.view[off:off + n]
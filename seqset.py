@@ -0,0 +1,151 @@
+# Keeps track of which seqnos have been received, and how many times.
+#
+# Counts are stored one byte per seqno (saturating at 255) in chunks of
+# 65536 seqnos, each chunk a bytearray that's only allocated once a seqno in
+# it arrives. Once every seqno in a chunk has arrived and we've moved well past
+# it, the chunk is thrown away, so a transfer of any length only needs memory
+# for the part of the sequence space that still has holes in it. A packet that
+# shows up again after its chunk is gone is still counted as a duplicate.
+#
+# Seqnos on the wire are 32 bits, and wrap around to 0 after 0xFFFFFFFF. To
+# keep the arithmetic simple, everything in here works on "unwrapped" seqnos
+# that just keep counting up; unwrap() turns a 32-bit seqno from a packet into
+# the unwrapped seqno nearest the highest one seen so far.
+#
+# For cumulative ACKs, we also keep:
+#   cumAck               every seqno below this has arrived
+#   rangeStarts/Ends     sorted runs [start, end) of seqnos above cumAck that
+#                        have arrived
+# which are updated as each new seqno arrives, so neither ACKs nor missing
+# counts ever need a scan.
+
+from bisect import bisect_right
+
+chunkBits = 16
+chunkSize = 1 << chunkBits
+
+def unwrap(seqno, reference):
+    candidate = (reference & ~0xFFFFFFFF) | (seqno & 0xFFFFFFFF)
+    if candidate - reference > 0x80000000:
+        candidate = candidate - 0x100000000
+    elif reference - candidate > 0x80000000:
+        candidate = candidate + 0x100000000
+    if candidate < 0:
+        candidate = candidate + 0x100000000
+    return candidate
+
+class ReceivedSet:
+
+    def __init__(self, first=0):
+        self.chunks = {}        # chunk number -> bytearray of counts
+        self.retiredBelow = first - first % chunkSize
+        self.late = {}          # seqno -> count, for retired seqnos seen again
+        self.first = first
+        self.highest = first - 1
+        self.unique = 0
+        self.cumAck = first
+        self.rangeStarts = []
+        self.rangeEnds = []
+
+    def unwrap(self, seqno):
+        return unwrap(seqno, max(self.highest, self.first))
+
+    # Record one arrival of seqno, and return how many times it has arrived,
+    # including this time.
+    def mark(self, seqno):
+        if self.first <= seqno < self.retiredBelow:
+            n = self.late[seqno] = self.late.get(seqno, 1) + 1
+            return n
+        c = seqno >> chunkBits
+        chunk = self.chunks.get(c)
+        if chunk is None:
+            chunk = self.chunks[c] = bytearray(chunkSize)
+        i = seqno & (chunkSize - 1)
+        n = chunk[i] + 1
+        if n <= 255:
+            chunk[i] = n
+        if n == 1:
+            self.unique = self.unique + 1
+            if seqno > self.highest:
+                self.highest = seqno
+            if seqno >= self.first:
+                self.add_to_ranges(seqno)
+        return n
+
+    # How many times seqno has arrived.
+    def count(self, seqno):
+        if self.first <= seqno < self.retiredBelow:
+            return self.late.get(seqno, 1)
+        chunk = self.chunks.get(seqno >> chunkBits)
+        if chunk is None:
+            return 0
+        return chunk[seqno & (chunkSize - 1)]
+
+    # The lowest seqno that hasn't arrived yet.
+    def first_missing(self):
+        return self.cumAck
+
+    # How many seqnos between first and the highest seen haven't arrived.
+    def missing(self):
+        return self.highest + 1 - self.first - self.unique
+
+    # How many seqnos in start..end-1 haven't arrived.
+    def missing_between(self, start, end):
+        start = max(start, self.cumAck)
+        if end <= start:
+            return 0
+        n = 0
+        c = start >> chunkBits
+        while (c << chunkBits) < end:
+            lo = max(start, c << chunkBits) - (c << chunkBits)
+            hi = min(end, (c + 1) << chunkBits) - (c << chunkBits)
+            chunk = self.chunks.get(c)
+            if chunk is None:
+                n = n + hi - lo
+            else:
+                n = n + chunk.count(0, lo, hi)
+            c = c + 1
+        return n
+
+    # Returns up to maxRanges (start, end) runs of received seqnos above
+    # cumAck, lowest first.
+    def sack_ranges(self, maxRanges):
+        n = min(maxRanges, len(self.rangeStarts))
+        return list(zip(self.rangeStarts[:n], self.rangeEnds[:n]))
+
+    # Fold a newly arrived seqno into cumAck and the runs above it.
+    def add_to_ranges(self, seqno):
+        starts = self.rangeStarts
+        ends = self.rangeEnds
+        if seqno < self.cumAck:
+            return
+        if seqno == self.cumAck:
+            self.cumAck = seqno + 1
+            if starts and starts[0] == self.cumAck:
+                self.cumAck = ends[0]
+                del starts[0]
+                del ends[0]
+            self.retire()
+            return
+        i = bisect_right(starts, seqno)
+        if i > 0 and seqno < ends[i-1]:
+            return # already in a run
+        if i > 0 and ends[i-1] == seqno:
+            ends[i-1] = seqno + 1
+            if i < len(starts) and starts[i] == seqno + 1:
+                ends[i-1] = ends[i]
+                del starts[i]
+                del ends[i]
+        elif i < len(starts) and starts[i] == seqno + 1:
+            starts[i] = seqno
+        else:
+            starts.insert(i, seqno)
+            ends.insert(i, seqno + 1)
+
+    # Throw away chunks that are complete and at least a whole chunk behind
+    # cumAck, so late duplicates just behind cumAck are still counted exactly.
+    def retire(self):
+        limit = (self.cumAck >> chunkBits) - 1
+        while (self.retiredBelow >> chunkBits) < limit:
+            self.chunks.pop(self.retiredBelow >> chunkBits, None)
+            self.retiredBelow = self.retiredBelow + chunkSize
@@ -6,25 +6,75 @@
 # Server for a simple TCP-like semi-reliable protocol on top of UDP. 
 #
 # What it does: This version expects the first 8 bytes of each packet to contain
-# a sequence number and a magic number. The magic number is completely ignored.
-# Every time a packet arrives, an 8-byte ACK is sent back, consisting of the
-# magic number 0xAAAAAAAA followed by the sequence number just received. 
+# a magic number and a sequence number. The low 24 bits of the magic number are
+# a session id, and the top bits give the packet type and flags (see
+# protocol.py). For an ordinary client, every time a packet arrives an 8-byte
+# ACK is sent back, consisting of the magic number 0xAA (ACK) plus the session
+# id, followed by the sequence number just received.
+#
+# Clients that set the SACK flag get cumulative ACKs instead: the lowest seqno
+# not yet received, plus a list of runs of seqnos above that which have
+# arrived. These are delayed and coalesced, so one ACK goes out for every
+# ackEvery packets, or after ackDelay seconds, whichever comes first. An ACK
+# goes out right away if a packet arrives out of order, fills in a hole, or is
+# a duplicate, so the client hears about holes as soon as possible.
+#
+# Clients can also send parity packets along with their data, so that a lost
+# packet can be rebuilt here without waiting for it to be sent again (see
+# fec.py). A rebuilt packet is ACKed as if it had arrived, and shows up in the
+# trace with Rebuilt = 1. Clients that compress their payloads set a flag
+# saying so, and datasink.py decodes them (see rowcodec.py); a payload that
+# can't be decoded is dropped without an ACK, so the client resends it.
+#
+# Clients can open a transfer with a handshake, and close it when they are done
+# (see protocol.py). The server hands out a session id, agrees to a window and
+# options, and says which seqnos it already has, from memory or from the
+# checkpoints datasink.py saves on disk, so a client that was interrupted only
+# resends what's missing.
+#
+# Many clients can send to the same server at once. Packets are sorted into
+# flows by the client's address and the session id, and datasink.py keeps
+# separate statistics for each flow. Flows that go quiet are dropped after a
+# while. The shards of a parallel transfer (see parallel_client.py) are flows
+# of their own, which datasink.py puts back together into one stream.
+#
+# Packets are taken off the socket in batches, up to batchSize per wakeup, and
+# the ACKs for a whole batch are sent together (see batchio.py), so a busy
+# server makes a few system calls per batch instead of two per packet.
+#
+# One process can only keep one core busy. With more than one worker, the
+# server forks that many processes which all listen on the same port using
+# SO_REUSEPORT, each with its own flows, and adds up their statistics through
+# shared memory (see sharedstats.py). The kernel picks a worker for each
+# packet by its session id, or by its transfer id for a SYN or FIN (see
+# steering.py), so the shards of a parallel transfer, and a client resuming a
+# transfer from a new port, all find the worker that has the rest of it.
+#
+# Running with PROFILE=stages times each stage of handling a packet (see
+# profiling.py), and prints where the time went on exit.
 # 
-# What it doesn't do: There is no real attempt to detect missing packets, send
-# NACKs, use cumulative acknowledgements, or do any sort of flow-control. The
-# code in datasink.py will keep track of duplicates and rearrange mis-ordered
-# packets, so we don't need to worry about that here.
+# What it doesn't do: There is no attempt to send NACKs, or do any sort of
+# flow-control. The code in datasink.py will keep track of duplicates and
+# rearrange mis-ordered packets, so we don't need to worry about that here.
 #
 # Run the program like this:
-#   python3 server.py 1.2.3.4 6000
+#   python3 server.py 1.2.3.4 6000 [workers]
 # This will listen for data on UDP 1.2.3.4:6000. The IP address should be the IP
-# for our own host.
+# for our own host. The optional third argument runs that many worker
+# processes, to use more than one core.
 
+import os
+import signal
 import socket
 import sys
 import time
 import struct
+import batchio
 import datasink
+import profiling
+import protocol
+import sharedstats
+import steering
 import trace
 
 # setting verbose = 0 turns off most printing
@@ -34,50 +84,357 @@ import trace
 verbose = datasink.verbose = 2
 
 # setting tracefile = None disables writing a trace file for the server
+# a name ending in .bin writes a faster, binary trace instead (see trace.py)
 # tracefile = None
 tracefile = "server_packets.csv"
 
-def main(host, port):
-    print("Listening for UDP packets at %s:%d" % (host, port))
+# for clients that want cumulative ACKs: send an ACK after this many packets,
+# or this many seconds after the first unACKed one, whichever comes first
+ackEvery = 4
+ackDelay = 0.002
+
+# most packets to take off the socket per wakeup, and ACKs to send at once
+# (see batchio.py); batchSize = 1 handles packets one at a time
+batchSize = 64
+
+# number of worker processes sharing the port (see run_workers)
+workers = 1
+
+# the stages of the receive loop, for PROFILE=stages (see profiling.py)
+recvStage = profiling.Stage("recv")
+unpackStage = profiling.Stage("unpack")
+deliverStage = profiling.Stage("deliver")
+logStage = profiling.Stage("log")
+traceStage = profiling.Stage("trace")
+ackStage = profiling.Stage("ack")
+flushStage = profiling.Stage("flush")
+
+# Send a cumulative ACK to flow, covering everything it has sent so far.
+def send_sack(s, flow, pending):
+    cumAck = flow.received.first_missing()
+    ack = protocol.pack_sack(flow.session, cumAck, flow.sack_ranges(protocol.maxSackRanges))
+    s.sendto(ack, flow.addr)
+    flow.unacked = 0
+    flow.ackDeadline = None
+    pending.pop(flow, None)
+    if verbose >= 2:
+        datasink.log("  sending cumulative ACK for seqno < %d with %d ranges", cumAck, len(ack) // 8 - 1)
+
+
+# Send any delayed ACKs whose time is up.
+def send_due_acks(s, pending, t):
+    for flow in [flow for flow in pending if flow.ackDeadline <= t]:
+        send_sack(s, flow, pending)
+
+# Like handle_packet(), but a packet that makes it fail is logged and dropped,
+# so one garbled or malicious datagram can't stop the server for every client.
+def handle_packet_safely(s, packet, client_addr, tRecv, start, pending):
+    try:
+        handle_packet(s, packet, client_addr, tRecv, start, pending)
+    except Exception as e:
+        datasink.log("Oops, dropped a %d byte packet from %s: %s: %s",
+                len(packet), str(client_addr), type(e).__name__, e)
+
+# Handle one packet that arrived at time tRecv: give it to its flow, log it,
+# and ACK it (or arrange for a delayed ACK, by adding the flow to pending).
+# s can be anything with a sendto(data, addr) method.
+def handle_packet(s, packet, client_addr, tRecv, start, pending):
+    t = unpackStage.start()
+    if len(packet) < protocol.hdrSize:
+        unpackStage.stop(t)
+        if verbose >= 1:
+            datasink.log("Ignoring %d byte packet from %s", len(packet), str(client_addr))
+        return
+
+    # split the packet into header (first 8 bytes) and payload (the rest)
+    hdr = packet[0:8]
+    payload = packet[8:]
+
+    # unpack integers from the header
+    (magic, seqno) = struct.unpack(">II", hdr)
+    session = protocol.session_id(magic)
+    if protocol.packet_type(magic) == protocol.synType:
+        unpackStage.stop(t)
+        handle_syn(s, packet, client_addr)
+        return
+    if protocol.packet_type(magic) == protocol.finType:
+        unpackStage.stop(t)
+        handle_fin(s, packet, client_addr)
+        return
+    if protocol.packet_type(magic) == protocol.parityType:
+        unpackStage.stop(t)
+        handle_parity(s, seqno, payload, client_addr, session, tRecv, start, pending)
+        return
+    if not protocol.is_data(magic):
+        unpackStage.stop(t)
+        if verbose >= 1:
+            datasink.log("Ignoring packet with magic = 0x%08x from %s", magic, str(client_addr))
+        return
+
+    # give the packet to the consumer for its flow
+    flow = datasink.get_flow(client_addr, session)
+    flags = protocol.data_flags(magic)
+    flow.sack = (flags & protocol.flagSack) != 0
+    if flags & protocol.flagFec:
+        flow.enable_fec()
+    if flags & protocol.flagEncoded:
+        flow.enable_codec()
+    if flags & protocol.flagShard:
+        flow.join_group()
+    hadHoles = len(flow.received.rangeStarts) > 0
+    unpackStage.stop(t)
+    t = deliverStage.start()
+    numTimesSeen = flow.deliver(seqno, payload)
+    deliverStage.stop(t)
+    if numTimesSeen == 0:
+        return # undecodable, so treat it as lost
+
+    if verbose >= 2:
+        t = logStage.start()
+        datasink.log("Got a packet containing %d bytes from %s", len(packet), str(client_addr))
+        datasink.log("  packet had magic = 0x%08x and seqno = %d", magic, seqno)
+        datasink.log("  packet has been seen %d times, including this time", numTimesSeen)
+        logStage.stop(t)
+
+    # write info about the packet to the log file
+    t = traceStage.start()
+    trace.write(seqno, tRecv - start, numTimesSeen, flow.flowid, 0)
+    traceStage.stop(t)
+
+    # create and send an ACK
+    t = ackStage.start()
+    send_acks(s, flow, seqno, numTimesSeen, hadHoles, tRecv, start, pending)
+    ackStage.stop(t)
+
+# ACK a data packet for seqno that just arrived for flow, right away or later.
+def send_acks(s, flow, seqno, numTimesSeen, hadHoles, tRecv, start, pending):
+    if flow.rebuilt:
+        send_rebuilt_acks(s, flow, tRecv, start, pending)
+        if not flow.sack:
+            send_ack(s, flow, seqno)
+        return
+    if flow.sack:
+        flow.unacked = flow.unacked + 1
+        if flow.unacked >= ackEvery or numTimesSeen > 1 or hadHoles or flow.received.rangeStarts:
+            send_sack(s, flow, pending)
+        elif flow.ackDeadline is None:
+            flow.ackDeadline = tRecv + ackDelay
+            pending[flow] = True
+        return
+    send_ack(s, flow, seqno)
+
+# Send a plain ACK for seqno to flow.
+def send_ack(s, flow, seqno):
+    if verbose >= 2:
+        datasink.log("  sending ACK in reply containing seqno = %d", seqno & 0xFFFFFFFF)
+    ack = bytearray(struct.pack(">II", protocol.make_magic(protocol.ackType, flow.session), seqno & 0xFFFFFFFF))
+    s.sendto(ack, flow.addr)
+
+# Handle a SYN: start or carry on with the transfer it asks for, and answer
+# with the session id and options to use, and what we already have of it.
+def handle_syn(s, packet, client_addr):
+    hello = protocol.unpack_hello(packet)
+    if hello is None:
+        return
+    flow = datasink.open_transfer(client_addr, hello)
+    reply = flow.progress(protocol.maxHelloRanges)
+    if verbose >= 1:
+        datasink.log("Transfer 0x%08x from %s: session 0x%06x, window %d, flags 0x%x, %d of %d packets already here",
+                hello.transferId, str(client_addr), flow.session, reply.window, reply.flags,
+                flow.received.unique, hello.numPackets)
+    s.sendto(protocol.pack_hello(protocol.synAckType, reply), client_addr)
+
+# Handle a FIN: the client has had every packet of the transfer ACKed. If we
+# don't know the transfer, we already finished it and the FIN-ACK was lost.
+def handle_fin(s, packet, client_addr):
+    hello = protocol.unpack_hello(packet)
+    if hello is None:
+        return
+    reply = hello
+    flow = datasink.transfers.get(hello.transferId)
+    if flow is not None:
+        reply = flow.progress(0)
+        if flow.complete():
+            datasink.close_transfer(flow)
+        elif verbose >= 1:
+            datasink.log("Oops, got a FIN for transfer 0x%08x, but seqno %d is still missing",
+                    hello.transferId, reply.cumAck)
+    s.sendto(protocol.pack_hello(protocol.finAckType, reply), client_addr)
+
+# Handle a parity packet for the group starting at seqno.
+def handle_parity(s, seqno, payload, client_addr, session, tRecv, start, pending):
+    flow = datasink.get_flow(client_addr, session)
+    flow.deliver_parity(seqno, payload)
+    if verbose >= 2:
+        datasink.log("Got a parity packet for the group starting at seqno %d from %s", seqno, str(client_addr))
+    if flow.rebuilt:
+        send_rebuilt_acks(s, flow, tRecv, start, pending)
+
+# Log the packets that flow just rebuilt from parity, and ACK them right away,
+# since the client is missing them.
+def send_rebuilt_acks(s, flow, tRecv, start, pending):
+    for seqno in flow.rebuilt:
+        if verbose >= 2:
+            datasink.log("  rebuilt packet with seqno %d from parity", seqno)
+        trace.write(seqno, tRecv - start, 1, flow.flowid, 1)
+        if not flow.sack:
+            send_ack(s, flow, seqno)
+    flow.rebuilt = []
+    if flow.sack:
+        send_sack(s, flow, pending)
+
+
+def open_socket(port):
     server_addr = ("", port)
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # Makes a UDP socket!
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if workers > 1:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     s.bind(server_addr)
+    return s
 
-    trace.init(tracefile,
+def init_trace(filename):
+    trace.init(filename,
             "Log of all packets received by server", 
-            "SeqNo", "TimeArrived", "NumTimesSeen")
-    datasink.init(host)
+            "SeqNo", "TimeArrived", "NumTimesSeen", "Flow", "Rebuilt")
 
-    start = time.time()
+# Receive and ACK packets on socket s, forever. If stats is not None, this
+# process is one of several workers, and publishes its totals there.
+def serve(s, stats=None, worker=0):
+    # flows owed a delayed ACK
+    pending = {}
+
+    # packets come in, and ACKs go out, in batches
+    receiver = batchio.BatchReceiver(s, batchSize)
+    sender = batchio.BatchSender(s, batchSize)
+
+    # wake up now and then, even if nothing arrives, to drop idle flows and
+    # send any delayed ACKs that are due
+    idleTimeout = 1.0
+    s.settimeout(idleTimeout)
+    lastEvict = start = time.time()
     while True:
-        # wait for a packet, and record the time it arrived
-        (packet, client_addr) = s.recvfrom(4000)
+        # wait for some packets, and record the time they arrived
+        t = recvStage.start()
+        try:
+            batch = receiver.recv()
+        except socket.timeout:
+            batch = ()
+        recvStage.stop(t)
         tRecv = time.time()
+        tBatch = time.perf_counter()
 
-        # split the packet into header (first 8 bytes) and payload (the rest)
-        hdr = packet[0:8]
-        payload = packet[8:]
+        for (packet, client_addr) in batch:
+            handle_packet_safely(sender, packet, client_addr, tRecv, start, pending)
 
-        # unpack integers from the header
-        (magic, seqno) = struct.unpack(">II", hdr)
+        # send any delayed ACKs whose time is up, then all the ACKs at once
+        if pending:
+            send_due_acks(sender, pending, tRecv)
+        t = flushStage.start()
+        sender.flush()
+        flushStage.stop(t)
+        s.settimeout(ackDelay if pending else idleTimeout)
+        if batch:
+            datasink.loopLatency.observe(time.perf_counter() - tBatch)
+            datasink.batchSizes.observe(len(batch))
 
-        # give the packet to the consumer
-        numTimesSeen = datasink.deliver(seqno, payload)
+        if tRecv - lastEvict > 1.0:
+            lastEvict = tRecv
+            datasink.evict_idle(tRecv)
+            if stats is not None:
+                stats.publish(worker, datasink.totals())
 
-        if verbose >= 2:
-            print("Got a packet containing %d bytes from %s" % (len(packet), str(client_addr)))
-            print("  packet had magic = 0x%08x and seqno = %d" % (magic, seqno))
-            print("  packet has been seen %d times, including this time" % (numTimesSeen))
 
-        # write info about the packet to the log file
-        trace.write(seqno, tRecv - start, numTimesSeen)
+def main(host, port):
+    if workers > 1:
+        run_workers(host, port)
+        return
+    print("Listening for UDP packets at %s:%d" % (host, port))
+    s = open_socket(port)
+    init_trace(tracefile)
+    datasink.init(host)
+    serve(s)
 
-        # create and send an ACK
-        if verbose >= 2:
-            print("  sending ACK in reply containing seqno = %d" % (seqno))
-        ack = bytearray(struct.pack(">II", 0xAAAAAAAA, seqno))
-        s.sendto(ack, client_addr)
+
+# Run a worker process on socket s. Only the first worker runs the web view.
+# The parent tells the workers to stop with SIGTERM, and each one publishes its
+# final totals and closes its trace file before exiting.
+def run_worker(host, s, stats, worker):
+    datasink.worker = worker
+    datasink.numWorkers = workers
+    if tracefile is not None:
+        (base, ext) = os.path.splitext(tracefile)
+        init_trace("%s-%d%s" % (base, worker, ext))
+    if worker == 0:
+        datasink.sharedStats = stats
+        datasink.init(host)
+
+    def stop(signum, frame):
+        datasink.save_checkpoints()
+        stats.publish(worker, datasink.totals())
+        if verbose >= 1 and datasink.totalPackets > 0:
+            datasink.showStats()
+        datasink.flush_log()
+        trace.close()
+        profiling.report()
+        sys.stdout.flush()
+        os._exit(0)
+    profiling.after_fork()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop)
+    serve(s, stats, worker)
+
+# Fork worker processes that all listen on the same port. With SO_REUSEPORT,
+# the kernel spreads incoming packets over the workers' sockets, and
+# steering.py tells it which packets go where: the sockets are bound here, in
+# order, so worker i's socket is the one the steering program calls i. The
+# parent keeps every socket open, so none of them ever leaves the group and
+# shifts the others along.
+def run_workers(host, port):
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+        raise Exception("Oops, running several workers needs SO_REUSEPORT and fork()")
+    socks = [open_socket(port) for worker in range(workers)]
+    try:
+        steering.attach(socks[0], workers)
+    except OSError as e:
+        raise Exception("Oops, running several workers needs SO_ATTACH_REUSEPORT_CBPF (Linux) "
+                "to steer packets to them: %s" % (e))
+    print("Listening for UDP packets at %s:%d with %d worker processes" % (host, port, workers))
+    stats = sharedstats.SharedStats(workers)
+    pids = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(host, socks[worker], stats, worker)
+            finally:
+                os._exit(1)
+        pids.append(pid)
+
+    def stop(signum, frame):
+        print("Exiting...")
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            os.waitpid(pid, 0)
+        show_totals(stats)
+        sys.exit(0)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while True:
+        time.sleep(10)
+        if verbose >= 1:
+            show_totals(stats)
+
+def show_totals(stats):
+    t = stats.totals()
+    print("%d workers, %d flows (%d active), %d packets, %d unique, %d duplicate, %d misordered, %s in total" %
+            (workers, t["totalFlows"], t["activeFlows"], t["totalPackets"], t["uniquePackets"],
+            t["duplicatePackets"], t["misorderedPackets"], datasink.kb(t["totalBytes"])))
 
 
 if __name__ == "__main__":
@@ -87,4 +444,6 @@ if __name__ == "__main__":
         sys.exit(0)
     host = sys.argv[1]
     port = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        workers = int(sys.argv[3])
     main(host, port)
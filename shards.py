@@ -0,0 +1,26 @@
+# Splitting one transfer into several flows that run in parallel.
+#
+# One flow only has one socket, one window and one process behind it, so on a
+# long, fast path it can run out of window or CPU before it runs out of
+# network. A parallel transfer (see parallel_client.py) deals the frames out
+# to numShards flows instead: shard k sends frames k, k + numShards,
+# k + 2 * numShards, and so on, each frame being rowsPerFrame packets.
+#
+# Each shard is an ordinary flow with its own seqnos, counting only its own
+# packets from 0, so windows, ACKs, FEC and encoding all work as usual. The
+# server knows from the session id which shard a flow is (see protocol.py),
+# maps each one's packets back to their seqnos in the whole transfer, and puts
+# them all in order together (see ShardGroup in datasink.py).
+
+# The seqno in the whole transfer of packet seqno of shard shard.
+def to_global(seqno, shard, numShards, rowsPerFrame):
+    (frame, row) = divmod(seqno, rowsPerFrame)
+    return (frame * numShards + shard) * rowsPerFrame + row
+
+# The number of packets shard shard sends, out of numPackets in all.
+def shard_size(numPackets, shard, numShards, rowsPerFrame):
+    (frames, rows) = divmod(numPackets, rowsPerFrame)
+    n = len(range(shard, frames, numShards)) * rowsPerFrame
+    if frames % numShards == shard:
+        n = n + rows # the last, partial, frame
+    return n
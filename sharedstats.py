@@ -0,0 +1,53 @@
+# Statistics shared between server worker processes.
+#
+# When server.py runs several worker processes, each one has its own datasink
+# state, so no single process knows the totals. Before forking, the parent maps
+# an anonymous block of shared memory with a slot for each worker. Every so
+# often, each worker writes its datasink totals into its own slot, and anyone
+# can add up the slots to get totals for the whole server.
+#
+# Only the owning worker ever writes a slot, so no locks are needed. Each slot
+# starts with a counter that the writer makes odd while it is writing and even
+# again when it is done; a reader that sees an odd counter, or a counter that
+# changed while it was reading, just reads the slot again.
+
+import mmap
+import struct
+
+# the statistics kept for each worker, in slot order
+fields = ["totalBytes", "totalPackets", "uniquePackets", "duplicatePackets",
+          "misorderedPackets", "activeFlows", "totalFlows", "missingPackets"]
+
+genFormat = struct.Struct("<Q")
+dataFormat = struct.Struct("<%dq" % (len(fields)))
+slotFormat = struct.Struct("<Q%dq" % (len(fields)))
+
+class SharedStats:
+
+    def __init__(self, numWorkers):
+        self.numWorkers = numWorkers
+        self.map = mmap.mmap(-1, numWorkers * slotFormat.size)
+
+    # Store stats (a dict, keyed by the names in fields) in worker's slot.
+    def publish(self, worker, stats):
+        off = worker * slotFormat.size
+        gen = genFormat.unpack_from(self.map, off)[0]
+        genFormat.pack_into(self.map, off, gen + 1)
+        dataFormat.pack_into(self.map, off + genFormat.size, *[stats.get(name, 0) for name in fields])
+        genFormat.pack_into(self.map, off, gen + 2)
+
+    # Returns the stats in worker's slot, as a dict.
+    def read(self, worker):
+        off = worker * slotFormat.size
+        while True:
+            vals = slotFormat.unpack_from(self.map, off)
+            if vals[0] % 2 == 0 and genFormat.unpack_from(self.map, off)[0] == vals[0]:
+                return dict(zip(fields, vals[1:]))
+
+    # Returns the stats added up over every worker, as a dict.
+    def totals(self):
+        sums = dict.fromkeys(fields, 0)
+        for worker in range(self.numWorkers):
+            for (name, val) in self.read(worker).items():
+                sums[name] = sums[name] + val
+        return sums
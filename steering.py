@@ -0,0 +1,87 @@
+# Steering packets to server workers by what's in them.
+#
+# With several workers sharing a port (see server.py), the kernel normally
+# picks the worker for each packet by hashing the client's address and port.
+# That keeps every flow on one worker, but not the things that span flows: the
+# shards of a parallel transfer come from ports of their own, and a client
+# resuming a transfer comes back from a new one. So instead the kernel runs a
+# little classic BPF program on each packet, which looks at our header (just
+# past the UDP header) and picks the worker:
+#
+#   SYN and FIN                 - transfer id % workers, so whichever worker
+#                                 has a transfer hears about it every time
+#   any other session           - (session >> 8) % workers, which for the
+#                                 shards of a parallel transfer is the group
+#                                 (see protocol.make_shard_session), so they
+#                                 all end up together
+#   the default session         - the kernel's usual hash, since plain clients
+#                                 all share it
+#
+# A worker only hands out session ids that steer back to it (see
+# datasink.new_session), so once a SYN has found the right worker, the rest of
+# the transfer follows it there.
+#
+# The program picks a socket by its position in the port's SO_REUSEPORT group,
+# which is the order they were bound in, so server.py binds all the sockets up
+# front, before forking, and keeps them all open. This needs Linux 4.6 or so;
+# attach() raises OSError anywhere else.
+
+import ctypes
+import socket
+import struct
+import protocol
+
+# from <asm-generic/socket.h>
+SO_ATTACH_REUSEPORT_CBPF = 51
+
+# classic BPF opcodes, from <linux/filter.h>
+ldWord = 0x00 | 0x00 | 0x20     # BPF_LD | BPF_W | BPF_ABS
+rshK = 0x04 | 0x70 | 0x00       # BPF_ALU | BPF_RSH | BPF_K
+andK = 0x04 | 0x50 | 0x00       # BPF_ALU | BPF_AND | BPF_K
+modK = 0x04 | 0x90 | 0x00       # BPF_ALU | BPF_MOD | BPF_K
+jeqK = 0x05 | 0x10 | 0x00       # BPF_JMP | BPF_JEQ | BPF_K
+retA = 0x06 | 0x10              # BPF_RET | BPF_A
+retK = 0x06 | 0x00              # BPF_RET | BPF_K
+
+# Any index past the last socket means "hash it as usual".
+useHash = 0xFFFFFFFF
+
+# The program, as a list of (code, jt, jf, k) instructions. A packet too short
+# to load from ends the program and goes to worker 0, which will ignore it.
+def program(numWorkers):
+    return [
+        (ldWord, 0, 0, 0),                      # A = magic
+        (rshK, 0, 0, 24),                       # A = packet type
+        (jeqK, 7, 0, protocol.synType),         # SYN: goto byTransfer
+        (jeqK, 6, 0, protocol.finType),         # FIN: goto byTransfer
+        (ldWord, 0, 0, 0),                      # A = magic
+        (andK, 0, 0, 0xFFFFFF),                 # A = session
+        (jeqK, 6, 0, protocol.defaultSession),  # default: goto byHash
+        (rshK, 0, 0, 8),
+        (modK, 0, 0, numWorkers),
+        (retA, 0, 0, 0),
+        # byTransfer:
+        (ldWord, 0, 0, 8),                      # A = transfer id (see protocol.Hello)
+        (modK, 0, 0, numWorkers),
+        (retA, 0, 0, 0),
+        # byHash:
+        (retK, 0, 0, useHash),
+    ]
+
+# Tell the kernel to steer the packets for every socket sharing s's port.
+def attach(s, numWorkers):
+    code = b"".join(struct.pack("HBBI", *insn) for insn in program(numWorkers))
+    buf = ctypes.create_string_buffer(code, len(code))
+    fprog = struct.pack("HP", len(code) // 8, ctypes.addressof(buf))
+    s.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+
+# The worker the program sends a packet with session id session to, or None if
+# the kernel picks.
+def session_worker(session, numWorkers):
+    if session == protocol.defaultSession:
+        return None
+    return (session >> 8) % numWorkers
+
+# The worker the program sends the SYN and FIN for transferId to.
+def transfer_worker(transferId, numWorkers):
+    return transferId % numWorkers
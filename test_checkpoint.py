@@ -0,0 +1,42 @@
+# Tests for checkpoint.py: what's saved for a transfer comes back, however
+# many runs of seqnos it has, and a missing or broken checkpoint is no
+# checkpoint at all.
+
+import os
+import checkpoint
+import protocol
+from protocol import Hello
+
+def test_save_and_load(tmp_path):
+    directory = str(tmp_path / "ckpt")
+    ranges = [(3 * i + 101, 3 * i + 102) for i in range(2 * protocol.maxHelloRanges)]
+    checkpoint.save(directory, Hello(0xFEEDF00D, 5000, 64, protocol.flagSack, 0,
+                                     session=0x123456, cumAck=100, ranges=ranges))
+    saved = checkpoint.load(directory, 0xFEEDF00D)
+    assert (saved.numPackets, saved.session, saved.cumAck) == (5000, 0x123456, 100)
+    assert saved.ranges == ranges
+    assert os.listdir(directory) == ["transfer-feedf00d.ckpt"]
+
+def test_save_replaces(tmp_path):
+    directory = str(tmp_path)
+    checkpoint.save(directory, Hello(7, 100, 64, 0, 0, cumAck=10))
+    checkpoint.save(directory, Hello(7, 100, 64, 0, 0, cumAck=20))
+    assert checkpoint.load(directory, 7).cumAck == 20
+
+def test_missing_or_broken(tmp_path):
+    directory = str(tmp_path)
+    assert checkpoint.load(directory, 7) is None
+    with open(checkpoint.path(directory, 7), "wb") as f:
+        f.write(b"garbage")
+    assert checkpoint.load(directory, 7) is None
+    # a file with another transfer's checkpoint in it
+    checkpoint.save(directory, Hello(8, 100, 64, 0, 0))
+    os.replace(checkpoint.path(directory, 8), checkpoint.path(directory, 7))
+    assert checkpoint.load(directory, 7) is None
+
+def test_remove(tmp_path):
+    directory = str(tmp_path)
+    checkpoint.save(directory, Hello(7, 100, 64, 0, 0))
+    checkpoint.remove(directory, 7)
+    checkpoint.remove(directory, 7)
+    assert checkpoint.load(directory, 7) is None
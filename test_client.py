@@ -28,6 +28,7 @@ import time
 import struct
 import datasource
 import trace
+from sendbuffer import SendBuffer
 
 # setting verbose = 0 turns off most printing
 # setting verbose = 1 turns on a little bit of printing
@@ -36,6 +37,7 @@ import trace
 verbose = 2
 
 # setting tracefile = None disables writing a trace file for the client
+# a name ending in .bin writes a faster, binary trace instead (see trace.py)
 # tracefile = None
 tracefile = "client_saw_packets.csv"
 
@@ -45,19 +47,19 @@ magic = 0xBAADCAFE
 def main(host, port):
     print("Sending UDP packets to %s:%d" % (host, port))
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Makes a UDP socket!
+    datasource.install_signal_handler()
 
     trace.init(tracefile,
                "Log of all packets sent and ACKs received by client",
                "SeqNo", "TimeSent", "AckNo", "timeACKed")
 
-    start = time.time()
-    for seqno in range(0, 180000):
-        # get some example data to send
-        body = datasource.wait_for_data(seqno)
+    # stop-and-wait only ever has one packet in flight, so one slot will do
+    sendbuf = SendBuffer(1, datasource.width * 3, magic, datasource.wait_for_data)
 
-        # make a header, create a packet, and send it
-        hdr = bytearray(struct.pack(">II", magic, seqno))
-        pkt = hdr + body
+    start = time.time()
+    for seqno in range(0, datasource.numPackets):
+        # get some example data, and build a packet around it in place
+        pkt = sendbuf.packet(seqno)
         tSend = time.time()
         s.sendto(pkt, (host, port))
         if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
@@ -0,0 +1,107 @@
+# Tests for congestion.py: how Reno and CUBIC move between slow start,
+# congestion avoidance and fast recovery, and undoing a loss that wasn't one.
+
+import pytest
+import congestion
+from congestion import Reno, Cubic, make_controller
+
+def test_slow_start_doubles_per_round_trip():
+    cc = Reno(initialWindow=4)
+    for i in range(4):
+        cc.on_ack(0.0, 0.1, i + 1)
+    assert cc.window() == 8
+    assert cc.state == congestion.slow_start
+
+def test_avoidance_one_packet_per_round_trip():
+    cc = Reno(initialWindow=10)
+    cc.ssthresh = 10.0
+    for i in range(10):
+        cc.on_ack(0.0, 0.1, i + 1)
+    assert cc.state == congestion.avoidance
+    assert cc.window() == 10
+    assert cc.cwnd == pytest.approx(11.0, abs=0.05)
+
+def test_max_window():
+    cc = Reno(initialWindow=4, maxWindow=6)
+    for i in range(10):
+        cc.on_ack(0.0, 0.1, i + 1)
+    assert cc.window() == 6
+
+def test_fast_recovery_once_per_window():
+    cc = Reno(initialWindow=20)
+    cc.on_loss(0.0, 20, 49)
+    assert cc.state == congestion.recovery
+    assert cc.cwnd == 10.0 and cc.ssthresh == 10.0
+    # more losses from the same window don't cut it again
+    cc.on_loss(0.0, 20, 55)
+    assert cc.numLosses == 1
+    cc.on_ack(0.0, 0.1, 49)
+    assert cc.state == congestion.recovery
+    cc.on_ack(0.0, 0.1, 50)
+    assert cc.state == congestion.avoidance
+    assert cc.cwnd == 10.0
+
+def test_timeout_back_to_one():
+    cc = Reno(initialWindow=20)
+    cc.on_timeout(0.0, 20)
+    assert cc.window() == 1
+    assert cc.ssthresh == 10.0
+    assert cc.state == congestion.slow_start
+
+def test_window_never_below_one():
+    cc = Reno(initialWindow=1)
+    cc.on_timeout(0.0, 0)
+    assert cc.ssthresh == 2.0
+    assert cc.window() == 1
+
+def test_cubic_backs_off_less():
+    cc = Cubic(initialWindow=100)
+    cc.on_loss(0.0, 100, 199)
+    assert cc.ssthresh == pytest.approx(70.0)
+    assert cc.wMax == 100.0
+
+def test_cubic_fast_convergence():
+    cc = Cubic(initialWindow=100)
+    cc.wMax = 200.0
+    cc.on_loss(0.0, 100, 199)
+    assert cc.wMax == pytest.approx(100 * (1 + Cubic.beta) / 2)
+
+def test_cubic_grows_back_to_wmax():
+    cc = Cubic(initialWindow=100)
+    cc.on_loss(0.0, 100, 199)
+    cc.on_ack(0.0, 0.05, 200) # out of recovery, at 70
+    t = 0.0
+    while t < 10.0:
+        t = t + 0.05
+        for i in range(int(cc.cwnd)):
+            cc.on_ack(t, 0.05, 300)
+    # K is about 4.2 s, so by 10 s the window is well past the old maximum
+    assert cc.K == pytest.approx(((100.0 - 70.0) / Cubic.C) ** (1.0 / 3))
+    assert cc.cwnd > 100.0
+
+def test_undo_restores_window():
+    for cc in [Reno(initialWindow=20), Cubic(initialWindow=20)]:
+        cc.on_ack(0.0, 0.1, 1)
+        before = cc.save()
+        cc.on_loss(0.0, 21, 40)
+        cc.undo()
+        assert cc.save() == before
+        assert cc.state == congestion.slow_start
+        assert cc.recover is None
+        assert cc.numUndos == 1
+        # nothing left to undo
+        cc.undo()
+        assert cc.numUndos == 1
+
+def test_no_undo_after_timeout():
+    cc = Reno(initialWindow=20)
+    cc.on_loss(0.0, 20, 40)
+    cc.on_timeout(0.0, 20)
+    cc.undo()
+    assert cc.window() == 1
+    assert cc.numUndos == 0
+
+def test_make_controller():
+    assert make_controller("cubic", 5).name == "cubic"
+    with pytest.raises(Exception):
+        make_controller("vegas")
@@ -0,0 +1,64 @@
+# Tests for fec.py: a lost packet is rebuilt from the XOR parity and the rest
+# of its group.
+
+import protocol
+from fec import FecEncoder, FecDecoder
+from seqset import ReceivedSet
+
+magic = protocol.make_magic(protocol.parityType, 0x123456)
+
+def payload(seqno):
+    # different lengths, to check the lengths are rebuilt too
+    return bytes((seqno * 7 + i) & 0xFF for i in range(20 + seqno % 5))
+
+# Sends seqnos 0..n-1 through an encoder and a decoder, losing the ones in
+# lost. Returns what the decoder rebuilt.
+def send(n, groupSize, parityCount, lost):
+    enc = FecEncoder(groupSize, parityCount, magic)
+    dec = FecDecoder(256, 64)
+    received = ReceivedSet()
+    rebuilt = []
+    def arrive(packets):
+        for (seqno, data) in packets:
+            received.mark(seqno)
+            rebuilt.append((seqno, data))
+            arrive(dec.data(seqno, data, received))
+    def send_parity(parity):
+        for p in parity:
+            assert protocol.packet_type(int.from_bytes(p[0:4], "big")) == protocol.parityType
+            start = int.from_bytes(p[4:8], "big")
+            arrive(dec.parity(start, p[protocol.hdrSize:], received))
+    for seqno in range(n):
+        if seqno not in lost:
+            received.mark(seqno)
+            arrive(dec.data(seqno, payload(seqno), received))
+        send_parity(enc.add(seqno, payload(seqno)))
+    send_parity(enc.flush())
+    return rebuilt
+
+def test_rebuilds_one_lost_packet():
+    assert send(8, 8, 1, {5}) == [(5, payload(5))]
+
+def test_rebuilds_a_burst_across_interleaved_parity():
+    rebuilt = send(16, 8, 2, {2, 3, 12})
+    assert sorted(rebuilt) == [(2, payload(2)), (3, payload(3)), (12, payload(12))]
+
+def test_two_losses_in_one_parity_cannot_be_rebuilt():
+    assert send(8, 8, 1, {1, 6}) == []
+
+def test_partial_last_group():
+    assert send(11, 8, 1, {9}) == [(9, payload(9))]
+
+def test_parity_arriving_before_the_rest_of_the_group():
+    enc = FecEncoder(4, 1, magic)
+    parity = []
+    for seqno in range(4):
+        parity.extend(enc.add(seqno, payload(seqno)))
+    dec = FecDecoder(16, 64)
+    received = ReceivedSet()
+    assert dec.parity(0, parity[0][protocol.hdrSize:], received) == []
+    for seqno in [0, 2]:
+        received.mark(seqno)
+        assert dec.data(seqno, payload(seqno), received) == []
+    received.mark(3)
+    assert dec.data(3, payload(3), received) == [(1, payload(1))]
@@ -0,0 +1,80 @@
+# Tests for frames.py: rows are put back together into frames, and frames come
+# back out of the encoder exactly as they went in.
+
+import zlib
+import frames
+from frames import FrameAssembler, FrameEncoder, frameHeader
+
+rowsPerFrame = 4
+width = 5
+
+def row(seqno):
+    return bytes((seqno * 3 + i) & 0xFF for i in range(3 * width))
+
+def assemble(seqnos, downsample=1, times=None):
+    out = []
+    fa = FrameAssembler(rowsPerFrame, lambda frame, pixels, complete: out.append((frame, bytes(pixels), complete)),
+                        downsample=downsample, frameDeadline=1.0)
+    for (i, seqno) in enumerate(seqnos):
+        fa.add(seqno, row(seqno), 0.0 if times is None else times[i])
+    return (fa, out)
+
+def test_complete_frames():
+    (fa, out) = assemble(range(8))
+    assert out == [(0, b"".join(row(s) for s in range(4)), True),
+                   (1, b"".join(row(s) for s in range(4, 8)), True)]
+    assert (fa.width(), fa.height()) == (width, rowsPerFrame)
+
+def test_later_frame_finishes_partial_one():
+    (fa, out) = assemble([0, 1, 3, 4])
+    assert len(out) == 1
+    (frame, pixels, complete) = out[0]
+    assert (frame, complete) == (0, False)
+    assert pixels[3 * width:6 * width] == row(1)
+    assert fa.numPartial == 1
+
+def test_late_rows_ignored():
+    (fa, out) = assemble([4, 5, 6, 7, 0, 1, 2, 3])
+    assert [frame for (frame, pixels, complete) in out] == [1]
+
+def test_deadline():
+    (fa, out) = assemble([0, 1], times=[0.0, 0.5])
+    fa.expire(0.9)
+    assert out == []
+    fa.expire(1.0)
+    assert [(frame, complete) for (frame, pixels, complete) in out] == [(0, False)]
+
+def test_downsample():
+    (fa, out) = assemble(range(4), downsample=2)
+    assert (fa.width(), fa.height()) == (3, 2)
+    (frame, pixels, complete) = out[0]
+    assert complete
+    assert pixels[0:9] == row(0)[0:3] + row(0)[6:9] + row(0)[12:15]
+    assert pixels[9:18] == row(2)[0:3] + row(2)[6:9] + row(2)[12:15]
+
+# What the browser does with each message.
+def decode(messages):
+    previous = None
+    for message in messages:
+        (frame, w, h, encoding, flags) = frameHeader.unpack_from(message, 0)
+        data = message[frameHeader.size:]
+        if encoding == frames.encodings["raw"]:
+            yield data
+            continue
+        data = zlib.decompress(data)
+        if encoding == frames.encodings["delta"]:
+            if flags & frames.flagKeyFrame:
+                previous = bytes(len(data))
+            data = bytes(a ^ b for (a, b) in zip(data, previous))
+            previous = data
+        yield data
+
+def test_encodings_round_trip():
+    pictures = [bytes((f * 7 + i // 10) & 0xFF for i in range(300)) for f in range(5)]
+    for encoding in frames.encodings:
+        enc = FrameEncoder(encoding, keyInterval=3)
+        messages = [enc.encode(f, p, 10, 10, True) for (f, p) in enumerate(pictures)]
+        assert list(decode(messages)) == pictures
+        if encoding == "delta":
+            keys = [frameHeader.unpack_from(m, 0)[4] & frames.flagKeyFrame != 0 for m in messages]
+            assert keys == [True, False, False, True, False]
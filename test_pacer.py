@@ -0,0 +1,42 @@
+# Tests for pacer.py: packets go out at rate, a burst at a time at most.
+
+from pacer import Pacer
+
+ms = 1000000 # nanoseconds
+
+def test_no_limit():
+    p = Pacer()
+    assert all(p.take(0) for i in range(100))
+    assert p.next_time() is None
+
+def test_burst_then_rate():
+    p = Pacer(rate=1000, burst=4)   # one packet per ms
+    t = 100 * ms
+    assert [p.take(t) for i in range(5)] == [True, True, True, True, False]
+    assert p.numWaits == 1
+    assert p.next_time() == t + ms
+    assert not p.take(t + ms // 2)
+    assert p.take(t + ms)
+
+def test_idle_credit_capped_at_burst():
+    p = Pacer(rate=1000, burst=4)
+    p.take(0)
+    sent = 0
+    while p.take(1000 * ms):
+        sent = sent + 1
+    assert sent == 4
+
+def test_charge_delays_new_packets():
+    p = Pacer(rate=1000, burst=4)
+    t = 100 * ms
+    # a full bucket of four, less six, leaves two owed
+    p.charge(t, 6)
+    assert not p.take(t)
+    assert p.next_time() == t + 3 * ms
+    assert p.take(t + 3 * ms)
+
+def test_debt_capped_at_burst():
+    p = Pacer(rate=1000, burst=4)
+    t = 100 * ms
+    p.charge(t, 100)
+    assert p.next_time() == t + 5 * ms
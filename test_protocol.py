@@ -0,0 +1,54 @@
+# Tests for protocol.py: packet types and flags, shard session ids, and
+# packing and unpacking cumulative ACKs and handshake packets.
+
+import protocol
+from protocol import Hello, pack_hello, unpack_hello
+
+def test_data_magic_flags():
+    for flags in range(16):
+        magic = protocol.make_data_magic(0x123456, flags)
+        assert protocol.is_data(magic)
+        assert protocol.data_flags(magic) == flags
+        assert protocol.session_id(magic) == 0x123456
+    # the plain data type is the one clients have always sent
+    assert protocol.packet_type(protocol.make_data_magic(0)) == protocol.dataType
+    for ptype in [protocol.ackType, protocol.sackType, protocol.parityType, protocol.synType]:
+        assert not protocol.is_data(protocol.make_magic(ptype, 1))
+
+def test_shard_sessions():
+    session = protocol.make_shard_session(0xBEEF, 5, 16)
+    assert protocol.shard_info(session) == (0xBEEF, 5, 16)
+    assert session <= 0xFFFFFF
+
+def test_sack_round_trip_across_the_wrap():
+    ack = protocol.pack_sack(7, 0xFFFFFFFE, [(0x100000001, 0x100000004)])
+    (cumAck, ranges) = protocol.unpack_sack(ack, 0xFFFFFF00)
+    assert cumAck == 0xFFFFFFFE
+    assert ranges == [(0x100000001, 0x100000004)]
+
+def test_hello_round_trip():
+    hello = Hello(0xDEADBEEF, 123456, 200000, protocol.flagSack | protocol.flagEncoded, 1,
+                  session=0xABCDEF, cumAck=100, ranges=[(105, 110), (200, 201)])
+    packet = pack_hello(protocol.synAckType, hello)
+    assert protocol.packet_type(int.from_bytes(packet[0:4], "big")) == protocol.synAckType
+    got = unpack_hello(packet)
+    assert (got.transferId, got.numPackets, got.window, got.flags, got.compression) == \
+            (0xDEADBEEF, 123456, 200000, protocol.flagSack | protocol.flagEncoded, 1)
+    assert (got.session, got.cumAck) == (0xABCDEF, 100)
+    assert got.ranges == [(105, 110), (200, 201)]
+    assert got.resumed()
+
+def test_fresh_hello_not_resumed():
+    got = unpack_hello(pack_hello(protocol.synType, Hello(1, 10, 64, 0, 0)))
+    assert got.ranges == []
+    assert not got.resumed()
+
+def test_short_hello():
+    packet = pack_hello(protocol.synType, Hello(1, 10, 64, 0, 0))
+    assert unpack_hello(packet[:-1]) is None
+
+def test_full_hello_fits_one_datagram():
+    ranges = [(2 * i + 1, 2 * i + 2) for i in range(protocol.maxHelloRanges)]
+    packet = pack_hello(protocol.synAckType, Hello(1, 1000, 64, 0, 0, ranges=ranges))
+    assert len(packet) <= 1472
+    assert unpack_hello(packet).ranges == ranges
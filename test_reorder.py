@@ -0,0 +1,75 @@
+# Tests for reorder.py: packets come out in seqno order, and holes that never
+# fill are skipped over.
+
+import pytest
+from reorder import ReorderBuffer
+
+def make_buffer(capacity=64, holeTimeout=None):
+    out = []
+    buf = ReorderBuffer(capacity, 16, lambda seqno, payload: out.append((seqno, bytes(payload))),
+                        holeTimeout=holeTimeout)
+    return (buf, out)
+
+def packet(seqno):
+    return b"p%d" % (seqno)
+
+def test_in_order_needs_no_slab():
+    (buf, out) = make_buffer()
+    for seqno in range(10):
+        buf.add(seqno, packet(seqno))
+    assert out == [(seqno, packet(seqno)) for seqno in range(10)]
+    assert buf.slab is None
+
+def test_out_of_order_released_in_order():
+    (buf, out) = make_buffer()
+    for seqno in [3, 1, 2, 5, 0, 4]:
+        buf.add(seqno, packet(seqno))
+    assert out == [(seqno, packet(seqno)) for seqno in range(6)]
+    assert buf.depth == 0
+
+def test_grows_to_fit_packets_far_ahead():
+    (buf, out) = make_buffer(capacity=1024)
+    for seqno in [1, 40, 500]:
+        buf.add(seqno, packet(seqno))
+    assert 500 < buf.size <= 1024
+    buf.add(0, packet(0))
+    assert out == [(0, packet(0)), (1, packet(1))]
+    assert buf.depth == 2
+
+def test_duplicates_and_late_packets_dropped():
+    (buf, out) = make_buffer()
+    buf.add(2, packet(2))
+    buf.add(2, packet(2))
+    assert buf.depth == 1
+    buf.add(0, packet(0))
+    buf.add(1, packet(1))
+    buf.add(0, packet(0))
+    assert [seqno for (seqno, payload) in out] == [0, 1, 2]
+    assert buf.numLate == 1
+
+def test_skips_hole_when_full():
+    (buf, out) = make_buffer(capacity=8)
+    for seqno in range(1, 8):
+        buf.add(seqno, packet(seqno))
+    assert out == []
+    # seqno 8 doesn't fit while 0 is missing, so 0 is given up on
+    buf.add(8, packet(8))
+    assert [seqno for (seqno, payload) in out] == list(range(1, 9))
+    assert buf.numSkipped == 1
+    buf.add(0, packet(0))
+    assert buf.numLate == 1
+
+def test_skips_hole_after_timeout():
+    (buf, out) = make_buffer(holeTimeout=0.5)
+    buf.add(2, packet(2), t=10.0)
+    buf.add(3, packet(3), t=10.2)
+    buf.expire(10.4)
+    assert out == []
+    buf.expire(10.6)
+    assert [seqno for (seqno, payload) in out] == [2, 3]
+    assert buf.numSkipped == 2
+    assert buf.next == 4
+
+def test_needs_room_for_a_packet():
+    with pytest.raises(Exception):
+        make_buffer(capacity=0)
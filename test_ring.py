@@ -0,0 +1,49 @@
+# Tests for ring.py: items come out in order, and a full ring drops new items
+# (or whole frames) instead of waiting.
+
+from ring import Ring, PacketRing, recordHeader
+
+def test_ring_in_order_and_drops_when_full():
+    r = Ring(4)
+    assert [r.put(i) for i in range(6)] == [True, True, True, True, False, False]
+    assert r.numDropped == 2
+    assert r.get_batch(3) == [0, 1, 2]
+    assert r.put(6)
+    assert r.get_batch(10) == [3, 6]
+    assert len(r) == 0
+
+def test_packet_ring_records():
+    r = PacketRing(8, 16)
+    r.put(5, b"five")
+    r.put(6, b"six!!")
+    out = bytearray()
+    assert r.get_into(out, 10) == 2
+    assert recordHeader.unpack_from(out, 0) == (5, 4)
+    assert out[8:12] == b"five"
+    assert recordHeader.unpack_from(out, 12) == (6, 5)
+    assert out[20:] == b"six!!"
+
+def test_packet_ring_each_wraps():
+    r = PacketRing(3, 16)
+    got = []
+    for seqno in range(7):
+        assert r.put(seqno, b"p%d" % (seqno))
+        r.get_each(lambda seqno, payload: got.append((seqno, bytes(payload))), 10)
+    assert got == [(seqno, b"p%d" % (seqno)) for seqno in range(7)]
+
+def test_packet_ring_drops_oversized():
+    r = PacketRing(3, 4)
+    assert not r.put(0, b"too big")
+    assert r.numDropped == 1
+
+def test_packet_ring_drops_whole_frames():
+    r = PacketRing(6, 8, rowsPerFrame=4)
+    for seqno in range(4):
+        assert r.put(seqno, b"a")
+    # frame 1 can't fit all four rows, so none of it goes in, even the rows
+    # there would be room for
+    assert not r.put(4, b"b")
+    r.get_each(lambda seqno, payload: None, 4)
+    assert not r.put(5, b"b")
+    assert r.numFramesDropped == 1
+    assert r.put(8, b"c")
@@ -0,0 +1,77 @@
+# Tests for rowcodec.py: rows come back exactly as they went in, whether sent
+# raw, compressed, or as deltas against rows the server already has.
+
+import pytest
+import rowcodec
+from rowcodec import RowEncoder, RowDecoder, codecHeader, compressions
+
+rowSize = 120
+rowsPerFrame = 4
+
+# Frames that change a little from one to the next, with rows much like the
+# row above.
+def row(seqno):
+    frame = seqno // rowsPerFrame
+    data = bytearray((i // 8) * 3 & 0xFF for i in range(rowSize))
+    data[(seqno % rowsPerFrame) * 10] = 0xFF
+    data[frame % rowSize] = frame & 0xFF
+    return bytes(data)
+
+def round_trip(compression, n=40, distances=(rowsPerFrame, 1)):
+    acked = set()
+    enc = RowEncoder(row, lambda seqno: seqno in acked, compression, distances=distances)
+    dec = RowDecoder(64, rowSize)
+    for seqno in range(n):
+        payload = enc.encode(seqno)
+        assert dec.decode(seqno, payload) == row(seqno)
+        acked.add(seqno)
+    return (enc, dec)
+
+@pytest.mark.parametrize("compression", ["none", "zlib"])
+def test_round_trip(compression):
+    (enc, dec) = round_trip(compression)
+    assert dec.numDecoded == 40
+    assert dec.numFailed == 0
+
+def test_round_trip_lz4():
+    if rowcodec.lz4 is None:
+        pytest.skip("no lz4 module")
+    round_trip("lz4")
+
+def test_deltas_used_and_smaller():
+    (enc, dec) = round_trip("zlib")
+    assert enc.numDelta > 0
+    assert enc.bytesOut < enc.bytesIn
+
+def test_deltas_only_against_acked_rows():
+    enc = RowEncoder(row, lambda seqno: False, "zlib")
+    for seqno in range(10):
+        (compression, distance) = codecHeader.unpack_from(enc.encode(seqno), 0)
+        assert distance == 0
+    assert enc.numDelta == 0
+
+def test_incompressible_row_sent_raw():
+    noise = bytes((i * 167 + 13) * 91 & 0xFF for i in range(rowSize))
+    enc = RowEncoder(lambda seqno: noise, lambda seqno: False, "zlib")
+    payload = enc.encode(0)
+    assert codecHeader.unpack_from(payload, 0) == (compressions["none"], 0)
+    assert RowDecoder(8, rowSize).decode(0, payload) == noise
+
+def test_delta_against_missing_row_fails():
+    acked = set(range(10))
+    enc = RowEncoder(row, lambda seqno: seqno in acked, "zlib", distances=(1,))
+    payload = enc.encode(10)
+    assert codecHeader.unpack_from(payload, 0)[1] == 1
+    dec = RowDecoder(64, rowSize)
+    assert dec.decode(10, payload) is None
+    assert dec.numFailed == 1
+
+def test_garbled_payload_fails():
+    dec = RowDecoder(8, rowSize)
+    assert dec.decode(0, codecHeader.pack(compressions["zlib"], 0) + b"not zlib") is None
+    assert dec.decode(1, b"x") is None
+    assert dec.numFailed == 2
+
+def test_unknown_compression():
+    with pytest.raises(Exception):
+        RowEncoder(row, lambda seqno: False, "brotli")
@@ -0,0 +1,62 @@
+# Tests for rto.py: the RFC 6298 estimator, Karn's rule, and backoff.
+
+import pytest
+from rto import RTOEstimator
+
+def test_first_sample():
+    rto = RTOEstimator(initialRTO=1.0, minRTO=0.0)
+    assert rto.sample(0.1) == 0.1
+    assert rto.srtt == 0.1
+    assert rto.rttvar == 0.05
+    assert rto.rto == pytest.approx(0.1 + 4 * 0.05)
+
+def test_later_samples_smoothed():
+    rto = RTOEstimator(minRTO=0.0)
+    rto.sample(0.1)
+    rto.sample(0.2)
+    assert rto.rttvar == pytest.approx(0.75 * 0.05 + 0.25 * 0.1)
+    assert rto.srtt == pytest.approx(0.875 * 0.1 + 0.125 * 0.2)
+    assert rto.rto == pytest.approx(rto.srtt + 4 * rto.rttvar)
+
+def test_clamped():
+    rto = RTOEstimator()
+    rto.sample(0.001)
+    assert rto.rto == 0.2
+    rto = RTOEstimator(maxRTO=5.0)
+    rto.sample(10.0)
+    assert rto.rto == 5.0
+
+def test_granularity_floor():
+    rto = RTOEstimator(minRTO=0.0, granularity=0.01)
+    for i in range(100):
+        rto.sample(0.05)
+    assert rto.rto == pytest.approx(0.05 + 0.01, abs=1e-4)
+
+def test_karn_ignores_retransmitted():
+    rto = RTOEstimator(initialRTO=1.0)
+    assert rto.sample(0.3, retransmitted=True) is None
+    assert rto.srtt is None
+    assert rto.rto == 1.0
+    assert rto.numSamples == 0
+
+def test_backoff_doubles_until_fresh_sample():
+    rto = RTOEstimator(minRTO=0.0, maxRTO=3.0)
+    rto.sample(0.4)
+    first = rto.rto
+    assert rto.backoff() == pytest.approx(2 * first)
+    assert rto.backoff() == 3.0
+    assert rto.backoff() == 3.0
+    assert rto.numBackoffs == 3
+    # an ACK for a retransmitted packet doesn't undo the backoff...
+    rto.sample(0.4, retransmitted=True)
+    assert rto.rto == 3.0
+    # ...but a fresh sample does
+    rto.sample(0.4)
+    assert rto.rto < first
+
+def test_min_rtt():
+    rto = RTOEstimator()
+    for rtt in [0.3, 0.1, 0.2]:
+        rto.sample(rtt)
+    rto.sample(0.05, retransmitted=True)
+    assert rto.minRtt == 0.1
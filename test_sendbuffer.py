@@ -0,0 +1,50 @@
+# Tests for sendbuffer.py: packets are built once into their slot, and reused
+# until a different seqno needs the slot.
+
+import struct
+import pytest
+from sendbuffer import SendBuffer, hdrSize
+
+def payload(seqno):
+    return b"row %d" % (seqno)
+
+def make_buffer(numSlots=4):
+    built = []
+    def source(seqno):
+        built.append(seqno)
+        return payload(seqno)
+    return (SendBuffer(numSlots, 16, 0xBADCAFE, source), built)
+
+def test_packet_layout():
+    (buf, built) = make_buffer()
+    packet = buf.packet(3)
+    assert struct.unpack_from(">II", packet) == (0xBADCAFE, 3)
+    assert bytes(packet[hdrSize:]) == payload(3)
+
+def test_retransmission_reuses_slot():
+    (buf, built) = make_buffer()
+    buf.packet(1)
+    buf.packet(1)
+    assert built == [1]
+    assert (buf.numBuilt, buf.numReused) == (1, 1)
+
+def test_slot_rebuilt_for_another_seqno():
+    (buf, built) = make_buffer()
+    buf.packet(1)
+    packet = buf.packet(5)
+    assert bytes(packet[hdrSize:]) == payload(5)
+    buf.packet(1)
+    assert built == [1, 5, 1]
+
+def test_seqno_wraps_in_header():
+    (buf, built) = make_buffer()
+    assert struct.unpack_from(">II", buf.packet(0x100000002))[1] == 2
+
+def test_payload_too_big():
+    buf = SendBuffer(4, 8, 0, lambda seqno: bytes(9))
+    with pytest.raises(Exception):
+        buf.packet(0)
+
+def test_needs_a_slot():
+    with pytest.raises(Exception):
+        SendBuffer(0, 16, 0, payload)
@@ -0,0 +1,68 @@
+# Tests for seqset.py: unwrapping 32-bit seqnos, and the cumulative ACK and
+# SACK ranges a ReceivedSet keeps.
+
+from seqset import unwrap, ReceivedSet, chunkSize
+
+def test_unwrap_near_reference():
+    assert unwrap(5, 0) == 5
+    assert unwrap(0x12345678, 0x12345000) == 0x12345678
+
+def test_unwrap_across_the_wrap():
+    # just past the wrap, seen from just before it
+    assert unwrap(3, 0xFFFFFFF0) == 0x100000003
+    # a late packet from just before the wrap, seen from just after it
+    assert unwrap(0xFFFFFFF0, 0x100000003) == 0xFFFFFFF0
+    # many wraps in
+    assert unwrap(7, 5 * 0x100000000 + 0xFFFFFF00) == 6 * 0x100000000 + 7
+
+def test_unwrap_never_negative():
+    assert unwrap(0xFFFFFFFF, 0) == 0xFFFFFFFF
+
+def test_received_set_unwraps_from_highest():
+    r = ReceivedSet(0xFFFFFFF0)
+    for seqno in range(0xFFFFFFF0, 0x100000000):
+        r.mark(r.unwrap(seqno))
+    assert r.unwrap(2) == 0x100000002
+    r.mark(r.unwrap(0))
+    assert r.cumAck == 0x100000001
+
+def test_counts_and_duplicates():
+    r = ReceivedSet()
+    assert r.mark(0) == 1
+    assert r.mark(0) == 2
+    assert r.count(0) == 2
+    assert r.count(1) == 0
+    assert r.unique == 1
+
+def test_sack_ranges():
+    r = ReceivedSet()
+    for seqno in [0, 1, 3, 4, 7, 9, 10]:
+        r.mark(seqno)
+    assert r.first_missing() == 2
+    assert r.sack_ranges(16) == [(3, 5), (7, 8), (9, 11)]
+    assert r.sack_ranges(2) == [(3, 5), (7, 8)]
+    assert r.missing() == 4
+    assert r.missing_between(0, 11) == 4
+
+def test_ranges_merge_as_holes_fill():
+    r = ReceivedSet()
+    for seqno in [2, 4, 6]:
+        r.mark(seqno)
+    r.mark(5)
+    assert r.sack_ranges(16) == [(2, 3), (4, 7)]
+    r.mark(3)
+    assert r.sack_ranges(16) == [(2, 7)]
+    r.mark(1)
+    r.mark(0)
+    assert r.cumAck == 7
+    assert r.sack_ranges(16) == []
+    assert r.missing() == 0
+
+def test_late_duplicates_after_retiring():
+    r = ReceivedSet()
+    for seqno in range(3 * chunkSize):
+        r.mark(seqno)
+    assert 0 not in r.chunks
+    assert r.count(5) == 1
+    assert r.mark(5) == 2
+    assert r.unique == 3 * chunkSize
@@ -0,0 +1,92 @@
+# Tests for the ACK rules in server.py: plain clients get an ACK per packet,
+# SACK clients get delayed, coalesced cumulative ACKs, except that anything
+# out of the ordinary is ACKed right away.
+
+import struct
+import pytest
+
+pytest.importorskip("simple_websocket_server")
+
+import datasink
+import protocol
+import server
+
+addr = ("127.0.0.1", 5555)
+
+class FakeSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append(bytes(data))
+
+@pytest.fixture
+def srv(monkeypatch):
+    monkeypatch.setattr(server, "verbose", 0)
+    monkeypatch.setattr(server, "ackEvery", 4)
+    monkeypatch.setattr(datasink, "verbose", 0)
+    monkeypatch.setattr(datasink, "flows", {})
+    s = FakeSocket()
+    pending = {}
+    session = [0x100000]
+    def send(seqno, flags=0, t=0.0):
+        packet = struct.pack(">II", protocol.make_data_magic(session[0], flags), seqno) + b"row"
+        server.handle_packet(s, packet, addr, t, 0.0, pending)
+    return (s, pending, send, session)
+
+def acks(s):
+    got = []
+    for ack in s.sent:
+        magic = struct.unpack_from(">I", ack)[0]
+        if protocol.packet_type(magic) == protocol.sackType:
+            got.append(protocol.unpack_sack(ack))
+        else:
+            got.append(struct.unpack_from(">I", ack, 4)[0])
+    s.sent = []
+    return got
+
+def test_plain_ack_per_packet(srv):
+    (s, pending, send, session) = srv
+    for seqno in [0, 2, 1]:
+        send(seqno)
+    assert acks(s) == [0, 2, 1]
+    assert not pending
+
+def test_sack_every_few_packets(srv):
+    (s, pending, send, session) = srv
+    for seqno in range(3):
+        send(seqno, protocol.flagSack)
+    assert acks(s) == []
+    assert len(pending) == 1
+    send(3, protocol.flagSack)
+    assert acks(s) == [(4, [])]
+    assert not pending
+
+def test_sack_delayed_ack_sent_when_due(srv):
+    (s, pending, send, session) = srv
+    send(0, protocol.flagSack, t=1.0)
+    server.send_due_acks(s, pending, 1.0 + server.ackDelay / 2)
+    assert acks(s) == []
+    server.send_due_acks(s, pending, 1.0 + server.ackDelay)
+    assert acks(s) == [(1, [])]
+    assert not pending
+
+def test_sack_holes_and_duplicates_acked_at_once(srv):
+    (s, pending, send, session) = srv
+    send(0, protocol.flagSack)
+    send(2, protocol.flagSack)  # out of order
+    assert acks(s) == [(1, [(2, 3)])]
+    send(3, protocol.flagSack)  # still a hole
+    assert acks(s) == [(1, [(2, 4)])]
+    send(1, protocol.flagSack)  # fills it
+    assert acks(s) == [(4, [])]
+    send(1, protocol.flagSack)  # duplicate
+    assert acks(s) == [(4, [])]
+
+def test_sessions_are_separate_flows(srv):
+    (s, pending, send, session) = srv
+    send(0, protocol.flagSack)
+    session[0] = 0x200000
+    send(1, protocol.flagSack)
+    assert acks(s) == [(0, [(1, 2)])]
@@ -0,0 +1,19 @@
+# Tests for shards.py: between them, the shards send every seqno of the whole
+# transfer exactly once.
+
+import pytest
+from shards import to_global, shard_size
+
+rowsPerFrame = 10
+
+def test_frames_dealt_out_in_turn():
+    assert [to_global(seqno, 1, 3, rowsPerFrame) for seqno in [0, 9, 10, 20]] == [10, 19, 40, 70]
+
+@pytest.mark.parametrize("numPackets", [0, 7, 10, 95, 100, 123])
+@pytest.mark.parametrize("numShards", [1, 2, 3, 4])
+def test_every_seqno_once(numPackets, numShards):
+    seen = []
+    for shard in range(numShards):
+        for seqno in range(shard_size(numPackets, shard, numShards, rowsPerFrame)):
+            seen.append(to_global(seqno, shard, numShards, rowsPerFrame))
+    assert sorted(seen) == list(range(numPackets))
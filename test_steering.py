@@ -0,0 +1,76 @@
+# Tests for steering.py: the kernel sends each packet to the socket the
+# program picks, which is the one session_worker() and transfer_worker() say.
+
+import socket
+import struct
+import time
+import pytest
+import protocol
+import steering
+
+numWorkers = 3
+
+@pytest.fixture
+def group():
+    if not hasattr(socket, "SO_REUSEPORT"):
+        pytest.skip("no SO_REUSEPORT")
+    socks = []
+    port = 0
+    for i in range(numWorkers):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind(("127.0.0.1", port))
+        s.setblocking(False)
+        port = s.getsockname()[1]
+        socks.append(s)
+    try:
+        steering.attach(socks[0], numWorkers)
+    except OSError:
+        pytest.skip("no SO_ATTACH_REUSEPORT_CBPF")
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield (socks, client, port)
+    client.close()
+    for s in socks:
+        s.close()
+
+# Which socket packet lands on.
+def worker_for(group, packet):
+    (socks, client, port) = group
+    client.sendto(packet, ("127.0.0.1", port))
+    deadline = time.time() + 1.0
+    while time.time() < deadline:
+        for (i, s) in enumerate(socks):
+            try:
+                s.recv(2048)
+                return i
+            except BlockingIOError:
+                pass
+        time.sleep(0.001)
+    return None
+
+def test_sessions(group):
+    for session in [0x000100, 0x000200, 0x000300, 0x123456, 0xABCDEF]:
+        packet = struct.pack(">II", protocol.make_data_magic(session), 7)
+        assert worker_for(group, packet) == steering.session_worker(session, numWorkers)
+        packet = struct.pack(">II", protocol.make_magic(protocol.parityType, session), 7)
+        assert worker_for(group, packet) == steering.session_worker(session, numWorkers)
+
+def test_shards_of_a_group_stay_together(group):
+    workers = set()
+    for shard in range(8):
+        session = protocol.make_shard_session(0x1234, shard, 8)
+        packet = struct.pack(">II", protocol.make_data_magic(session, protocol.flagShard), 0)
+        workers.add(worker_for(group, packet))
+    assert len(workers) == 1
+
+def test_handshake_by_transfer_id(group):
+    for transferId in [5, 7, 9, 0xFFFFFFFF]:
+        for ptype in [protocol.synType, protocol.finType]:
+            packet = protocol.pack_hello(ptype, protocol.Hello(transferId, 10, 64, 0, 0, session=0x010203))
+            assert worker_for(group, bytes(packet)) == steering.transfer_worker(transferId, numWorkers)
+
+def test_default_session_and_short_packets(group):
+    packet = struct.pack(">II", protocol.make_data_magic(protocol.defaultSession), 1)
+    assert steering.session_worker(protocol.defaultSession, numWorkers) is None
+    assert worker_for(group, packet) is not None
+    assert worker_for(group, b"abc") == 0
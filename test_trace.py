@@ -0,0 +1,29 @@
+# Tests for trace.py: a binary trace, converted to CSV, is the same file a CSV
+# trace would have been.
+
+import trace
+
+rows = [(seqno, seqno + 0.25, 1 + seqno % 3, "" if seqno % 4 else 2.5) for seqno in range(50)]
+
+def write_trace(filename):
+    trace.init(filename, "Log of a test", "SeqNo", "Time", "Seen", "Extra")
+    for r in rows:
+        trace.write(*[trace.blank if v == "" else v for v in r])
+    trace.write(99, 1.5) # short rows are padded with blanks
+    trace.close()
+
+def test_binary_matches_csv(tmp_path, monkeypatch):
+    # small blocks, so the background thread writes several
+    monkeypatch.setattr(trace, "recordsPerBlock", 8)
+    write_trace(str(tmp_path / "t.csv"))
+    write_trace(str(tmp_path / "t.bin"))
+    trace.to_csv(str(tmp_path / "t.bin"), str(tmp_path / "converted.csv"))
+    with open(tmp_path / "t.csv") as f:
+        expected = f.read().replace("99,1.5\n", "99,1.5,,\n")
+    with open(tmp_path / "converted.csv") as f:
+        assert f.read() == expected
+
+def test_format_value():
+    assert trace.format_value(3.0) == "3"
+    assert trace.format_value(0.125) == "0.125"
+    assert trace.format_value(trace.nan) == ""
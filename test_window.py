@@ -0,0 +1,130 @@
+# Tests for window.py: what may be sent, what's been ACKed, and what has timed
+# out or been overtaken enough to count as lost.
+
+from window import SendWindow
+
+# A window that has sent seqnos 0..n-1, seqno k at time k.
+def sent(n, size=100, **kwargs):
+    w = SendWindow(size, **kwargs)
+    for seqno in range(n):
+        w.sent(seqno, float(seqno))
+    return w
+
+def test_size_limits_in_flight():
+    w = sent(4, size=4)
+    assert w.in_flight() == 4
+    assert not w.can_send()
+    w.ack(2)
+    assert w.can_send()
+
+def test_base_slides_past_acked():
+    w = sent(5)
+    for seqno in [1, 2, 4]:
+        assert w.ack(seqno) == float(seqno)
+    assert w.base == 0
+    w.ack(0)
+    assert w.base == 3
+    w.ack(3)
+    assert w.base == 5
+    assert w.numAcked == 5
+
+def test_duplicate_ack():
+    w = sent(3)
+    w.ack(1)
+    assert w.ack(1) is None
+    assert w.ack(7) is None
+    assert w.numAcked == 1
+
+def test_done_when_last_acked():
+    w = sent(3, last=3)
+    assert not w.can_send()
+    for seqno in [2, 0]:
+        w.ack(seqno)
+    assert not w.done()
+    w.ack(1)
+    assert w.done()
+
+def test_span_limits_run_ahead():
+    w = sent(4, span=4)
+    w.ack(1)
+    w.ack(2)
+    w.ack(3)
+    assert not w.can_send() # still waiting for 0
+    w.ack(0)
+    assert w.can_send()
+
+def test_expired_oldest_first():
+    w = sent(5)
+    assert w.expired(3.5, 2.0) == [0, 1]
+    assert w.next_deadline(2.0) == 2.0
+    # a retransmission goes to the back of the queue
+    w.sent(0, 10.0)
+    assert w.expired(3.5, 2.0) == [1]
+    assert w.next_deadline(2.0) == 3.0
+    assert w.times_sent(0) == 2
+    assert w.numRetransmits == 1
+
+def test_nothing_in_flight_has_no_deadline():
+    w = sent(2)
+    w.ack(0)
+    w.ack(1)
+    assert w.next_deadline(1.0) is None
+
+def test_ack_range():
+    w = sent(6)
+    w.sent(2, 10.0)
+    assert w.ack_range(1, 4) == [(1, 1.0, False), (2, 10.0, True), (3, 3.0, False)]
+    assert w.ack_range(0, 100) == [(0, 0.0, False), (4, 4.0, False), (5, 5.0, False)]
+    assert w.base == 6
+
+def test_lost_after_dupthresh():
+    w = sent(10)
+    w.ack(3)
+    assert w.lost() == [0] # 0 + dupthresh <= 3
+    w.ack(5)
+    assert w.lost() == [0, 1, 2]
+
+def test_retransmitted_not_lost_again_until_later_acked():
+    w = sent(10)
+    w.ack(5)
+    assert w.lost() == [0, 1, 2]
+    for seqno in [0, 1, 2]:
+        w.sent(seqno, 20.0 + seqno)
+    w.ack(6)
+    assert w.lost() == [3]
+    w.sent(10, 30.0)
+    w.ack(10)
+    assert w.lost() == [3, 4, 7, 0, 1, 2]
+
+def test_spurious_retransmit_raises_dupthresh():
+    w = sent(10)
+    w.ack(7)
+    assert 0 in w.lost()
+    w.sent(0, 20.0)
+    w.fast_retransmitted(0)
+    # with a minimum RTT of 0.5, an ACK at 20.2 must be for the original
+    w.ack(0, tooSoon=20.2 - 0.5)
+    assert w.numSpurious == 1
+    assert w.dupthresh == 8
+    w.ack(8)
+    assert w.lost() == []
+
+def test_real_loss_leaves_dupthresh():
+    w = sent(10)
+    w.ack(7)
+    w.sent(0, 20.0)
+    w.fast_retransmitted(0)
+    w.ack(0, tooSoon=25.0 - 0.5)
+    assert w.numSpurious == 0
+    assert w.dupthresh == SendWindow.dupthresh
+
+def test_resume_skips_what_receiver_has():
+    w = SendWindow(100, 0, 20)
+    w.resume(5, [(6, 8), (10, 11)])
+    assert (w.first, w.base, w.next) == (5, 5, 5)
+    w.sent(5, 0.0)
+    assert w.next == 8
+    assert w.is_acked(7) and not w.acked_here(7)
+    w.ack(5)
+    assert w.base == 8
+    assert w.acked_here(5)
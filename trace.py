@@ -8,30 +8,173 @@
 # The first line is a title.
 # The second line is the title for each column.
 # The rest of the lines contain the data.
+#
+# Formatting every value as text costs a lot when there's a row for every
+# packet, so if the filename ends in ".bin" the log is written in a binary
+# format instead. Each row is a fixed-size record of 8-byte floats, one per
+# column (a blank value is stored as NaN). Pass trace.blank for a value that
+# should be left blank; it is right for either format, and much cheaper than
+# "" or None for the binary one. Rows are packed into a preallocated
+# buffer, and a background thread writes out full buffers, and anything else
+# that's waiting once a second, so very little is lost even if the program is
+# killed. Convert a binary log to the usual CSV format afterwards with:
+#   python3 trace.py server_packets.bin server_packets.csv
+#
+# The binary file starts with:
+#    8 bytes   b"TRACEBIN"
+#    4 bytes   number of columns
+#    4 bytes   length of the text that follows
+#    the title and column names, as the same two lines the CSV would start with
+# followed by the records.
+
+import atexit
+import struct
+import sys
+import threading
 
 csv = None
 csvname = None
+binw = None
+
+binMagic = b"TRACEBIN"
+binHeader = ">8sII"
+
+# rows per buffer, and seconds between background writes
+recordsPerBlock = 16384
+flushInterval = 1.0
+
+nan = float("nan")
+
+# the value to write for a blank entry
+blank = ""
+
+class BinaryWriter:
+
+    def __init__(self, f, ncols):
+        self.f = f
+        self.fmt = struct.Struct("<%dd" % (ncols))
+        self.ncols = ncols
+        self.blockSize = self.fmt.size * recordsPerBlock
+        self.buf = bytearray(self.blockSize)
+        self.pos = 0
+        self.full = []          # buffers waiting to be written
+        self.spare = []         # written buffers, ready for reuse
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target=self.run, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, args):
+        if "" in args or None in args or len(args) != self.ncols:
+            args = [nan if a is None or a == "" else float(a) for a in args]
+            args = (args + [nan] * self.ncols)[:self.ncols]
+        with self.lock:
+            self.fmt.pack_into(self.buf, self.pos, *args)
+            self.pos = self.pos + self.fmt.size
+            if self.pos == self.blockSize:
+                self.full.append(self.buf)
+                self.buf = self.spare.pop() if self.spare else bytearray(self.blockSize)
+                self.pos = 0
+                self.wake.set()
+
+    # Background thread: write out full buffers as they appear, and whatever
+    # is in the current buffer every flushInterval seconds.
+    def run(self):
+        while True:
+            self.wake.wait(flushInterval)
+            self.wake.clear()
+            with self.lock:
+                blocks = self.full
+                self.full = []
+                partial = None
+                if not blocks and self.pos > 0:
+                    partial = bytes(self.buf[:self.pos])
+                    self.pos = 0
+                closing = self.closing
+            for block in blocks:
+                self.f.write(block)
+            if partial is not None:
+                self.f.write(partial)
+            if blocks or partial is not None:
+                self.f.flush()
+            with self.lock:
+                self.spare.extend(blocks)
+            if closing:
+                break
+
+    def close(self):
+        self.closing = True
+        self.wake.set()
+        self.thread.join()
+        self.f.write(self.buf[:self.pos])
+        self.f.close()
 
 def init(filename, title, *args):
-    global csv, csvname
+    global csv, csvname, binw, blank
     if filename is not None:
-        csv = open(filename, "w")
-        csv.write("#" + title + "\n")
-        csv.write("#" + (",".join(args)) + "\n")
+        if filename.endswith(".bin"):
+            blank = nan
+            f = open(filename, "wb")
+            text = ("#" + title + "\n" + "#" + (",".join(args)) + "\n").encode()
+            f.write(struct.pack(binHeader, binMagic, len(args), len(text)))
+            f.write(text)
+            binw = BinaryWriter(f, len(args))
+        else:
+            blank = ""
+            csv = open(filename, "w")
+            csv.write("#" + title + "\n")
+            csv.write("#" + (",".join(args)) + "\n")
         csvname = filename
         print("**** Data will be saved to %s ****" % (csvname))
+        atexit.register(close)
 
 def write(*args):
     global csv
-    if csv is not None:
+    if binw is not None:
+        binw.write(args)
+    elif csv is not None:
         csv.write(",".join([str(a) for a in args]) + "\n")
 
 def close():
-    global csv, csvname
-    if csv is not None:
+    global csv, csvname, binw
+    if binw is not None:
+        binw.close()
+        binw = None
+        print("**** Data saved to %s ****" % (csvname))
+    elif csv is not None:
         csv.close()
         csv = None
         print("**** Data saved to %s ****" % (csvname))
-    else:
+    elif csvname is None:
         print("**** No data saved, because tracefile = None ****")
 
+# Convert a binary log into the usual CSV format.
+def to_csv(binname, csvname):
+    with open(binname, "rb") as f, open(csvname, "w") as out:
+        (magic, ncols, textlen) = struct.unpack(binHeader, f.read(struct.calcsize(binHeader)))
+        if magic != binMagic:
+            raise Exception("Oops, %s is not a binary trace file" % (binname))
+        out.write(f.read(textlen).decode())
+        fmt = struct.Struct("<%dd" % (ncols))
+        while True:
+            block = f.read(fmt.size * recordsPerBlock)
+            if not block:
+                break
+            for vals in fmt.iter_unpack(block[:len(block) - len(block) % fmt.size]):
+                out.write(",".join([format_value(v) for v in vals]) + "\n")
+
+def format_value(v):
+    if v != v:
+        return "" # NaN
+    if v.is_integer() and abs(v) < 2**53:
+        return str(int(v))
+    return str(v)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("To convert a binary trace file to CSV, try running:")
+        print("   python3 %s server_packets.bin server_packets.csv" % (sys.argv[0]))
+        sys.exit(0)
+    to_csv(sys.argv[1], sys.argv[2])
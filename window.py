@@ -0,0 +1,190 @@
+# Sliding-window bookkeeping for the sender side of our TCP-like protocol.
+#
+# The window keeps track of which packets are "in flight", i.e. have been sent
+# but not yet ACKed, and when each of them was most recently sent. ACKs can
+# arrive in any order: each one marks a single seqno (or, for cumulative and
+# selective ACKs, a run of seqnos) as done, and the bottom of the window (base)
+# slides forward past every seqno that has been ACKed.
+#
+# The window limits the number of packets in flight (size), which the client
+# adjusts as its congestion window changes. It can also limit how far ahead of
+# the lowest unACKed packet the sender may run (span), so a single lost packet
+# can't make the receiver buffer an unbounded amount of data.
+#
+# Fast retransmit: a packet is considered lost, without waiting for its timer
+# to expire, once some packet sent after it has been ACKed, and a packet at
+# least dupthresh (3) seqnos above it has been ACKed too. That's the same test
+# as TCP's "three duplicate ACKs", but it works for every hole in the window at
+# once, not just the lowest one. Because it compares send times, a packet that
+# has just been retransmitted won't be declared lost again until something
+# sent after the retransmission is ACKed. lost() returns the lost packets.
+#
+# Packets that are only reordered, not lost, fool that test, so dupthresh
+# adapts. The client calls fast_retransmitted() for each packet it resends
+# because lost() said so. If the ACK for one comes back too soon to be for the
+# retransmission (sent after tooSoon, for ack() and ack_range()), and it was
+# only resent the once, the original was only overtaken: that counts in
+# numSpurious, and dupthresh goes up past how far behind it was, up to
+# maxDupthresh, the way Linux learns a path's reordering.
+#
+# The send-time table is a dict kept in transmission order. A retransmission
+# removes the seqno and puts it back at the end, so the first entry is always
+# the packet that has been waiting the longest. That makes finding expired
+# timers cheap: we only ever look at the front of the table.
+#
+# A transfer that was interrupted can carry on part-way through: resume() marks
+# what the receiver already has as ACKed, and those seqnos are skipped over
+# instead of being sent.
+#
+# This file does no socket I/O at all. The client decides when to send, and
+# tells the window about it using sent(), ack(), ack_range(), expired() and
+# lost().
+
+class SendWindow:
+
+    dupthresh = 3
+    maxDupthresh = 256
+
+    def __init__(self, size, first=0, last=None, span=None):
+        self.size = size        # max number of packets in flight
+        self.span = span        # max distance from base to next, or None
+        self.first = first      # first seqno this window sends
+        self.base = first       # lowest seqno not yet ACKed
+        self.next = first       # next never-before-sent seqno
+        self.last = last        # one past the final seqno, or None if unbounded
+        self.sendTime = {}      # seqno -> time of most recent transmission
+        self.sendCount = {}     # seqno -> number of times transmitted
+        self.acked = set()      # seqnos ACKed out of order, above base
+        self.resumed = set()    # seqnos the receiver had before we started
+        self.highestAcked = first - 1   # highest seqno ACKed so far
+        self.latestSent = None  # latest send time of any ACKed packet
+        self.fastRetransmits = {}   # seqno -> how far it had been overtaken
+        self.numAcked = 0
+        self.numRetransmits = 0
+        self.numSpurious = 0
+
+    # Number of packets that have been sent but not yet ACKed.
+    def in_flight(self):
+        return len(self.sendTime)
+
+    # True if a brand new packet may be sent right now.
+    def can_send(self):
+        if self.last is not None and self.next >= self.last:
+            return False
+        if self.span is not None and self.next - self.base >= self.span:
+            return False
+        return len(self.sendTime) < self.size
+
+    # True once every seqno in [first, last) has been ACKed.
+    def done(self):
+        return self.last is not None and self.base >= self.last
+
+    # Record that seqno was just (re)transmitted at time t.
+    def sent(self, seqno, t):
+        if seqno == self.next:
+            self.next = seqno + 1
+            while self.next in self.acked:
+                self.next = self.next + 1
+        else:
+            self.numRetransmits = self.numRetransmits + 1
+        self.sendTime.pop(seqno, None)
+        self.sendTime[seqno] = t
+        self.sendCount[seqno] = self.sendCount.get(seqno, 0) + 1
+
+    # Record an ACK for seqno. Returns the time seqno was last sent, or None if
+    # the ACK was a duplicate or for something we never sent.
+    def ack(self, seqno, tooSoon=None):
+        tSent = self.sendTime.pop(seqno, None)
+        if tSent is None:
+            return None
+        # (with more than one retransmission, the ACK could be for any of them)
+        once = self.sendCount.pop(seqno) == 2
+        overtaken = self.fastRetransmits.pop(seqno, None)
+        if overtaken is not None and once and tooSoon is not None and tSent > tooSoon:
+            self.dupthresh = min(max(self.dupthresh, overtaken + 1), self.maxDupthresh)
+            self.numSpurious = self.numSpurious + 1
+        self.numAcked = self.numAcked + 1
+        if seqno == self.base:
+            self.base = self.base + 1
+            while self.base in self.acked:
+                self.acked.remove(self.base)
+                self.base = self.base + 1
+        else:
+            self.acked.add(seqno)
+        if seqno > self.highestAcked:
+            self.highestAcked = seqno
+        if self.latestSent is None or tSent > self.latestSent:
+            self.latestSent = tSent
+        return tSent
+
+    # Record an ACK for every seqno in start..end-1. Returns a list of
+    # (seqno, timeSent, retransmitted) for the ones that were in flight.
+    def ack_range(self, start, end, tooSoon=None):
+        newlyAcked = []
+        start = max(start, self.base)
+        end = min(end, self.next)
+        for seqno in range(start, end):
+            if seqno in self.sendTime:
+                retransmitted = self.sendCount[seqno] > 1
+                newlyAcked.append((seqno, self.ack(seqno, tooSoon), retransmitted))
+        return newlyAcked
+
+    # Returns a list of in-flight seqnos that must have been lost, oldest
+    # first. See above.
+    def lost(self):
+        late = []
+        if self.latestSent is None:
+            return late
+        for seqno, tSent in self.sendTime.items():
+            if tSent >= self.latestSent:
+                break
+            if seqno + self.dupthresh <= self.highestAcked:
+                late.append(seqno)
+        return late
+
+    # Record that seqno, which lost() returned, is being resent.
+    def fast_retransmitted(self, seqno):
+        self.fastRetransmits[seqno] = self.highestAcked - seqno
+
+    # True if seqno has been ACKed.
+    def is_acked(self, seqno):
+        return seqno < self.base or seqno in self.acked
+
+    # True if seqno was sent from this window, and has been ACKed, as opposed
+    # to the receiver having had it since before resume().
+    def acked_here(self, seqno):
+        return seqno >= self.first and self.is_acked(seqno) and seqno not in self.resumed
+
+    # Carry on with a transfer the receiver already has part of: every seqno
+    # below cumAck, and every seqno in each run (start, end) in ranges, counts
+    # as ACKed. Call it before sending anything.
+    def resume(self, cumAck, ranges):
+        self.first = self.base = self.next = max(self.base, cumAck)
+        self.highestAcked = self.base - 1
+        for (start, end) in ranges:
+            for seqno in range(max(start, self.base), end):
+                self.acked.add(seqno)
+                self.resumed.add(seqno)
+        while self.next in self.acked:
+            self.next = self.next + 1
+
+    # Number of times an in-flight seqno has been transmitted so far.
+    def times_sent(self, seqno):
+        return self.sendCount.get(seqno, 0)
+
+    # Time at which the oldest outstanding packet will time out, or None if
+    # nothing is in flight.
+    def next_deadline(self, timeout):
+        for seqno in self.sendTime:
+            return self.sendTime[seqno] + timeout
+        return None
+
+    # Return a list of in-flight seqnos that were last sent at or before
+    # time t - timeout, oldest first.
+    def expired(self, t, timeout):
+        late = []
+        for seqno, tSent in self.sendTime.items():
+            if tSent + timeout > t:
+                break
+            late.append(seqno)
+        return late